@@ -0,0 +1,4 @@
+"""Benchmarks for the talk processing pipeline.
+
+Run them with `flask bench-pipeline`; see benchmarks/pipeline.py.
+"""
@@ -0,0 +1,293 @@
+"""Time each stage of turning an edited talk into the files we distribute.
+
+    flask bench-pipeline                  # 10, 60 and 120 minute talks
+    flask bench-pipeline -m 10 -o bench.json
+
+Synthetic talks are generated with ffmpeg's lavfi sources, so nothing has to be
+downloaded: pink noise for the edited talk, and tones for the top and tail. They
+are kept in the work directory and reused by later runs.
+
+Each stage runs in a forked child process so that its peak RSS, which covers
+both Python and the ffmpeg it runs, isn't hidden by an earlier stage's. The
+stages are those of process_talk:
+
+    decode_jingles  top.mp3 and tail.mp3 to WAV (cached between talks in use)
+    hash            sha256 of the edited file, the loudness cache key
+    measure         concat + loudnorm analysis
+    render          concat + loudnorm + MP3 encode + CD slicing, one ffmpeg pass
+    tag             ID3 frames on the processed MP3
+    publish         web and USB gold copies
+
+Concat, normalise, encode and slicing are one ffmpeg filter graph, so they are
+timed together as `render`.
+
+The report is JSON: wall and CPU seconds, peak RSS and bytes written for every
+stage of every talk length.
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import click
+from flask import current_app as app
+from flask.cli import with_appcontext
+
+from gbtalks.audio import (
+    FFMPEG,
+    decoded_asset,
+    measure_loudness,
+    render_talk,
+    tag_processed_mp3,
+)
+from gbtalks.distribution import place_file
+from gbtalks.libgbtalks import file_sha256
+
+DEFAULT_MINUTES = (10, 60, 120)
+
+# The smallest valid PNG, for the cover art tag_processed_mp3 embeds
+ICON = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+def fixture_command(source, seconds, destination):
+    """The ffmpeg command that renders a lavfi `source` to a 128k MP3."""
+    return [
+        FFMPEG,
+        "-hide_banner",
+        "-nostdin",
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        f"{source}:duration={seconds}",
+        "-c:a",
+        "libmp3lame",
+        "-b:a",
+        "128k",
+        destination,
+    ]
+
+
+def generate_fixtures(workdir, minutes):
+    """Write top, tail and edited MP3s into `workdir`, unless already there."""
+    fixtures = {
+        "top.mp3": ("sine=frequency=880:sample_rate=44100", 10),
+        "tail.mp3": ("sine=frequency=440:sample_rate=44100", 15),
+    }
+    for length in minutes:
+        fixtures[f"edited-{length}.mp3"] = (
+            "anoisesrc=color=pink:amplitude=0.1:sample_rate=44100",
+            length * 60,
+        )
+
+    for name, (source, seconds) in fixtures.items():
+        path = os.path.join(workdir, name)
+        if not os.path.exists(path):
+            subprocess.run(
+                fixture_command(source, seconds, path), check=True, capture_output=True
+            )
+
+    return {name: os.path.join(workdir, name) for name in fixtures}
+
+
+def _bytes_written_by_self():
+    """Bytes this process has passed to write(), from /proc/self/io"""
+    try:
+        with open("/proc/self/io") as io:
+            for line in io:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _paths_size(paths):
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in os.scandir(path):
+                total += entry.stat().st_size
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def _stage_child(stage, connection):
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    written_before = _bytes_written_by_self()
+    started = time.perf_counter()
+
+    try:
+        outputs = stage() or []
+    except Exception as error:
+        connection.send({"error": f"{type(error).__name__}: {error}"})
+        return
+
+    wall = time.perf_counter() - started
+    written = _bytes_written_by_self() - written_before
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu = sum(
+        getattr(after, field) - getattr(before, field)
+        for before, after in ((self_before, self_after), (children_before, children_after))
+        for field in ("ru_utime", "ru_stime")
+    )
+
+    connection.send(
+        {
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu, 3),
+            # kilobytes on Linux
+            "peak_rss_kb": max(self_after.ru_maxrss, children_after.ru_maxrss),
+            # What Python wrote, plus what ffmpeg left in the stage's outputs
+            "bytes_written": written + _paths_size(outputs),
+        }
+    )
+
+
+def measure_stage(stage):
+    """Run `stage` in a forked child and return its resource use.
+
+    `stage` returns the paths its ffmpeg wrote, if it ran one, so they can be
+    counted as bytes written.
+    """
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+
+    child = context.Process(target=_stage_child, args=(stage, sender))
+    child.start()
+    sender.close()
+
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": "stage exited without reporting"}
+    child.join()
+
+    if "error" in result:
+        raise click.ClickException(result["error"])
+    return result
+
+
+def benchmark_talk(fixtures, minutes, workdir):
+    """Every stage of processing the `minutes` long talk, as {stage: result}."""
+    out = os.path.join(workdir, f"out-{minutes}")
+    shutil.rmtree(out, ignore_errors=True)
+    cd_dir = os.path.join(out, "cd")
+    os.makedirs(cd_dir)
+
+    edited = fixtures[f"edited-{minutes}.mp3"]
+    processed = os.path.join(out, "processed.mp3")
+    talk = SimpleNamespace(
+        id=minutes,
+        title=f"A {minutes} minute talk",
+        speaker="Bench Mark",
+        description="Synthetic talk for benchmarking",
+    )
+
+    def decode_jingles():
+        shutil.rmtree(app.config["DECODED_CACHE_DIR"], ignore_errors=True)
+        decoded_asset(fixtures["top.mp3"])
+        decoded_asset(fixtures["tail.mp3"])
+        return [app.config["DECODED_CACHE_DIR"]]
+
+    def inputs():
+        return [decoded_asset(fixtures["top.mp3"]), edited, decoded_asset(fixtures["tail.mp3"])]
+
+    def measure():
+        with open(os.path.join(out, "loudness.json"), "w") as stats:
+            json.dump(measure_loudness(inputs()), stats)
+
+    def render():
+        with open(os.path.join(out, "loudness.json")) as stats:
+            render_talk(inputs(), json.load(stats), [processed], cd_dir)
+        return [processed, cd_dir]
+
+    def hash_edited():
+        file_sha256(edited)
+
+    def publish():
+        # Hard links write nothing; copies are counted through write()
+        for name in ("web.mp3", "usb_gold.mp3"):
+            place_file(processed, os.path.join(out, name))
+
+    stages = {
+        "decode_jingles": decode_jingles,
+        "hash": hash_edited,
+        "measure": measure,
+        "render": render,
+        "tag": lambda: tag_processed_mp3(processed, talk),
+        "publish": publish,
+    }
+
+    results = {name: measure_stage(stage) for name, stage in stages.items()}
+
+    results["total"] = {
+        "wall_s": round(sum(result["wall_s"] for result in results.values()), 3),
+        "cpu_s": round(sum(result["cpu_s"] for result in results.values()), 3),
+        "peak_rss_kb": max(result["peak_rss_kb"] for result in results.values()),
+        "bytes_written": sum(result["bytes_written"] for result in results.values()),
+    }
+    return results
+
+
+def ffmpeg_version():
+    result = subprocess.run([FFMPEG, "-version"], capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else None
+
+
+@click.command(name="bench-pipeline")
+@click.option(
+    "--minutes", "-m", type=int, multiple=True, help="Talk lengths to benchmark [default: 10, 60, 120]"
+)
+@click.option("--workdir", type=click.Path(file_okay=False), help="Where to keep fixtures and outputs")
+@click.option("--output", "-o", type=click.File("w"), default="-", help="Write the JSON report here")
+@with_appcontext
+def bench_pipeline(minutes, workdir, output):
+    """Benchmark each stage of processing a talk"""
+
+    minutes = minutes or DEFAULT_MINUTES
+    workdir = workdir or os.path.join(tempfile.gettempdir(), "gbtalks-bench")
+    os.makedirs(workdir, exist_ok=True)
+
+    # Keep everything the stages write inside the work directory
+    app.config["DECODED_CACHE_DIR"] = os.path.join(workdir, "decoded")
+
+    # The real cover art if there is some, as its size affects tagging
+    if not os.path.exists(os.path.join(app.config["IMG_DIR"], "alltalksicon.png")):
+        app.config["IMG_DIR"] = os.path.join(workdir, "images")
+        os.makedirs(app.config["IMG_DIR"], exist_ok=True)
+        with open(os.path.join(app.config["IMG_DIR"], "alltalksicon.png"), "wb") as icon:
+            icon.write(ICON)
+
+    click.echo(f"Generating fixtures in {workdir}", err=True)
+    fixtures = generate_fixtures(workdir, minutes)
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "ffmpeg": ffmpeg_version(),
+        "talks": {},
+    }
+
+    for length in minutes:
+        click.echo(f"Benchmarking a {length} minute talk", err=True)
+        report["talks"][str(length)] = benchmark_talk(fixtures, length, workdir)
+
+    json.dump(report, output, indent=2)
+    output.write("\n")
@@ -22,6 +22,27 @@ class Config:
     USB_GOLD_DIR = os.getenv("USB_GOLD_DIR", "/storage/usb_gold")
     WEB_MP3_DIR = os.getenv("WEB_MP3_DIR", "/storage/web_mp3s")
 
+    # Uploads are streamed here, then renamed into UPLOAD_DIR, so it must be on
+    # the same filesystem
+    UPLOAD_INCOMING_DIR = os.getenv("UPLOAD_INCOMING_DIR", os.path.join(UPLOAD_DIR, ".incoming"))
+
+    # Background upload and video work in the web server; see gbtalks/media_jobs.py
+    MEDIA_JOB_WORKERS = int(os.getenv("MEDIA_JOB_WORKERS", "2"))
+    MEDIA_EXTRACT_CONCURRENCY = int(os.getenv("MEDIA_EXTRACT_CONCURRENCY", "1"))
+
+    # Chunked uploads untouched for this long are deleted, hours
+    UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", "48"))
+
+    # Where talks are converted before being moved into place; see gbtalks/scratch.py
+    SCRATCH_DIR = os.getenv("SCRATCH_DIR", "/storage/scratch")
+    SCRATCH_QUOTA_MB = os.getenv("SCRATCH_QUOTA_MB")  # unset: limited by free space
+    SCRATCH_HEADROOM_MB = int(os.getenv("SCRATCH_HEADROOM_MB", "1024"))  # always left free
+    SCRATCH_WAIT_TIMEOUT = int(os.getenv("SCRATCH_WAIT_TIMEOUT", "3600"))  # seconds
+
+    # Pre-decoded copies of top.mp3 and tail.mp3, so they aren't decoded again
+    # for every talk
+    DECODED_CACHE_DIR = os.getenv("DECODED_CACHE_DIR", os.path.join(UPLOAD_DIR, ".decoded"))
+
 
     TALKS_DIRS = {
         "raw": {
@@ -38,6 +59,28 @@ class Config:
             }
     }
 
+    # Conversion queue (see gbtalks/conversion.py)
+    CONVERSION_MAX_ATTEMPTS = int(os.getenv("CONVERSION_MAX_ATTEMPTS", "3"))
+    CONVERSION_RETRY_DELAY = int(os.getenv("CONVERSION_RETRY_DELAY", "60"))  # seconds, per attempt
+    CONVERSION_SCAN_INTERVAL = int(os.getenv("CONVERSION_SCAN_INTERVAL", "300"))  # seconds
+    # Talks converted at once, and MB they may use; unset sizes from the machine
+    CONVERSION_WORKERS = os.getenv("CONVERSION_WORKERS")
+    CONVERSION_MEMORY_BUDGET_MB = os.getenv("CONVERSION_MEMORY_BUDGET_MB")
+
+    # /events streams open at once, each holding one of uWSGI's threads; past
+    # this, pages poll for events instead (see gbtalks/events.py)
+    SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "8"))
+
+    # Seconds "optimise" may spend improving on the greedy rota; see gbtalks/rota/optimise.py
+    ROTA_OPTIMISE_SECONDS = float(os.getenv("ROTA_OPTIMISE_SECONDS", "10"))
+    # Rota what-ifs simulate-rota runs at once (see gbtalks/rota/simulate.py);
+    # unset from the machine. The web page runs them one at a time
+    ROTA_SIMULATION_WORKERS = os.getenv("ROTA_SIMULATION_WORKERS")
+
+    # Lets Prometheus scrape /metrics with "Authorization: Bearer <token>";
+    # without one, /metrics needs a team leader's login like everything else
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
     # Greenbelt - Default to Friday of August Bank Holiday weekend of current year
     current_year = datetime.now().year
     # August bank holiday is last Monday of August, so Friday is 3 days before
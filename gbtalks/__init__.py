@@ -24,10 +24,16 @@ def register_commands(app):
     from gbtalks import commands
 
     app.cli.add_command(commands.convert_talks)
+    app.cli.add_command(commands.conversion_worker)
+    app.cli.add_command(commands.retag_talks)
+    app.cli.add_command(commands.publish_talks)
     app.cli.add_command(commands.create_db)
     app.cli.add_command(commands.migrate_db)
     app.cli.add_command(commands.migration_status)
     app.cli.add_command(commands.load_sample_data)
+    app.cli.add_command(commands.generate_rota)
+    app.cli.add_command(commands.simulate_rota)
+    app.cli.add_command(commands.bench_pipeline)
 
 
 def setup_login(app):
@@ -42,6 +48,11 @@ def create_app():
     """Construct the core application."""
     app = Flask(__name__, instance_relative_config=False)
 
+    # Stream talk uploads straight to disk; see gbtalks/uploads.py
+    from .uploads import UploadRequest
+
+    app.request_class = UploadRequest
+
     # Application Configuration
     app.config.from_object("config.Config")
 
@@ -63,6 +74,13 @@ def create_app():
 
     Markdown(app)
 
+    # Run finishing uploads and video extraction in the background; see
+    # gbtalks/media_jobs.py. Started by the first request rather than here, so
+    # CLI commands and uWSGI's master process don't start threads.
+    from .media_jobs import start_media_jobs
+
+    app.before_request(lambda: start_media_jobs(app))
+
     with app.app_context():
         # Imports
         from . import routes
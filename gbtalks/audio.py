@@ -0,0 +1,517 @@
+"""The ffmpeg pipeline that turns an edited talk into the files we distribute.
+
+A talk used to go through pydub and ffmpeg-normalize, which decoded the audio
+four times and held the whole talk in memory as PCM. Instead, ffmpeg does all of
+the work in two streaming passes over the same filter graph:
+
+    measure     top + edited + tail -> concat -> loudnorm (analysis only)
+    render      top + edited + tail -> concat -> loudnorm (using the measured
+                values) -> 44.1 kHz, then split three ways:
+                    128k MP3, written to both the processed and web MP3 paths
+                    16-bit WAV, cut into 5 minute tracks for the CDs
+
+Nothing is decoded into Python and nothing is written to /tmp, so a worker's
+memory use no longer grows with the length of the talk.
+
+top.mp3 and tail.mp3 are the same for every talk, so they are decoded once into
+DECODED_CACHE_DIR and the WAVs are used as inputs from then on. A cached WAV is
+named after its source's modification time and size, so uploading a new jingle
+is picked up by the next talk processed without anything having to be told.
+
+The CD tracks are cut by ffmpeg's segment muxer as the PCM streams past, with
+the audio grouped into whole CD sectors (588 samples) first. Every track except
+the last is then exactly 22,500 sectors, and the last is padded with silence
+to a whole sector, so `wodim -dao` gets tracks it can write back to back
+without gaps or clicks. A final track shorter than the four seconds the Red
+Book allows is folded into the one before it.
+
+Audio extracted from an uploaded video becomes the talk's raw MP3. When the
+camera already recorded MP3 it is copied out as it is, which takes seconds;
+anything else has to be encoded. That includes AAC, which is what most cameras
+record in an MP4, so for most videos extraction is still a full re-encode
+taking minutes. Copying AAC would mean a raw file that isn't an MP3, and
+everything that finds, serves or checks raw files expects gbXX-XXX_RAW.mp3.
+
+The loudness targets are the values we previously passed to ffmpeg-normalize
+(-t -13 --loudness-range-target 3, and its default true peak of -2 dBTP).
+"""
+
+import json
+import os
+import struct
+import subprocess
+
+from flask import current_app as app
+from mutagen.id3 import (
+    APIC,
+    COMM,
+    ID3,
+    TALB,
+    TCMP,
+    TCOP,
+    TDRC,
+    TIT2,
+    TPE1,
+    TPE2,
+    TRCK,
+    ID3NoHeaderError,
+)
+
+from .distribution import publish_talk
+from .libgbtalks import find_processed_files, get_path_for_file
+
+FFMPEG = "/usr/bin/ffmpeg"
+FFPROBE = "/usr/bin/ffprobe"
+
+LOUDNESS_TARGET = -13
+LOUDNESS_RANGE_TARGET = 3
+TRUE_PEAK_TARGET = -2
+
+SAMPLE_RATE = 44100
+PROCESSED_BITRATE = "128k"
+CD_TRACK_SECONDS = 300
+CD_SECTOR_SAMPLES = 588  # 2352 bytes of 16-bit stereo
+CD_MIN_TRACK_SECONDS = 4
+
+# Raw MP3s extracted from videos, when they can't just be copied out
+EXTRACTED_BITRATE = "320k"
+
+# Audio codecs a video's track can be copied from into the raw MP3 unchanged.
+# Only MP3 can go into an MP3 file, so AAC is re-encoded (see above)
+COPYABLE_CODECS = {"mp3"}
+
+# Decoded assets already checked by this process, keyed by their source's
+# (path, mtime, size). Pool workers inherit it from convert_talks.
+_decoded_assets = {}
+
+# The loudnorm fields we need to carry from the first pass to the second.
+LOUDNORM_STATS = ("input_i", "input_lra", "input_tp", "input_thresh", "target_offset")
+
+
+class AudioProcessingError(RuntimeError):
+    """Raised when ffmpeg fails, with the tail of its output attached."""
+
+
+def concat_filter(input_count):
+    """Filter graph fragment joining every input's audio into one stream.
+
+    Each input is converted to 44.1 kHz stereo first, so a mono edit still joins
+    cleanly onto stereo jingles.
+    """
+    graph = [
+        f"[{index}:a]aformat=sample_rates={SAMPLE_RATE}:channel_layouts=stereo[a{index}]"
+        for index in range(input_count)
+    ]
+    labels = "".join(f"[a{index}]" for index in range(input_count))
+    graph.append(f"{labels}concat=n={input_count}:v=0:a=1")
+    return ";".join(graph)
+
+
+def loudnorm_filter(measured=None):
+    """The loudnorm filter, for analysis (no `measured`) or for the final pass.
+
+    A measurement of silence comes back as -inf, which loudnorm will not accept
+    as an input, so the second pass falls back to loudnorm's one-pass mode.
+    """
+    options = [
+        f"I={LOUDNESS_TARGET}",
+        f"LRA={LOUDNESS_RANGE_TARGET}",
+        f"TP={TRUE_PEAK_TARGET}",
+    ]
+
+    if measured is None:
+        options.append("print_format=json")
+    elif all(_is_finite(measured[key]) for key in LOUDNORM_STATS):
+        options += [
+            f"measured_I={measured['input_i']}",
+            f"measured_LRA={measured['input_lra']}",
+            f"measured_TP={measured['input_tp']}",
+            f"measured_thresh={measured['input_thresh']}",
+            f"offset={measured['target_offset']}",
+            "linear=true",
+        ]
+
+    return "loudnorm=" + ":".join(options)
+
+
+def _is_finite(value):
+    try:
+        return float(value) not in (float("inf"), float("-inf"))
+    except (TypeError, ValueError):
+        return False
+
+
+def _input_args(inputs):
+    args = []
+    for path in inputs:
+        args += ["-i", path]
+    return args
+
+
+def measure_command(inputs):
+    """The ffmpeg command for the first, analysis-only, loudnorm pass."""
+    return [
+        FFMPEG,
+        "-hide_banner",
+        "-nostdin",
+        *_input_args(inputs),
+        "-filter_complex",
+        concat_filter(len(inputs)) + "," + loudnorm_filter(),
+        "-f",
+        "null",
+        "-",
+    ]
+
+
+def parse_loudnorm_stats(output):
+    """Pull loudnorm's JSON summary out of ffmpeg's stderr."""
+    start = output.rfind("{")
+    end = output.rfind("}")
+
+    if start == -1 or end < start:
+        raise AudioProcessingError("ffmpeg did not report loudness statistics")
+
+    try:
+        stats = json.loads(output[start : end + 1])
+    except ValueError as error:
+        raise AudioProcessingError(f"Could not read loudness statistics: {error}") from None
+
+    missing = [key for key in LOUDNORM_STATS if key not in stats]
+    if missing:
+        raise AudioProcessingError(f"Loudness statistics are missing {', '.join(missing)}")
+
+    return {key: stats[key] for key in LOUDNORM_STATS}
+
+
+def _escape_tee_path(path):
+    """Escape a filename for use as one slave of ffmpeg's tee muxer."""
+    for character in ("\\", "'", "|"):
+        path = path.replace(character, "\\" + character)
+    return path
+
+
+def render_command(inputs, measured, mp3_paths, cd_dir):
+    """The ffmpeg command that writes every output of a talk in one pass.
+
+    The MP3 is encoded once and the tee muxer writes it to each of `mp3_paths`.
+    The CD tracks are written into `cd_dir` as 00.wav, 01.wav, ...
+    """
+    graph = (
+        concat_filter(len(inputs))
+        + ","
+        + loudnorm_filter(measured)
+        + f",aresample={SAMPLE_RATE},asplit=2[mp3][pcm]"
+        # Whole sectors, so the segment muxer can only cut on a sector boundary
+        + f";[pcm]asetnsamples=n={CD_SECTOR_SAMPLES}:p=1[cd]"
+    )
+
+    tee = "|".join(f"[f=mp3]{_escape_tee_path(path)}" for path in mp3_paths)
+
+    return [
+        FFMPEG,
+        "-hide_banner",
+        "-nostdin",
+        "-y",
+        *_input_args(inputs),
+        "-filter_complex",
+        graph,
+        # Don't carry the editor's tags across; process_talk writes our own.
+        "-map_metadata",
+        "-1",
+        "-map",
+        "[mp3]",
+        "-c:a",
+        "libmp3lame",
+        "-b:a",
+        PROCESSED_BITRATE,
+        "-f",
+        "tee",
+        tee,
+        "-map",
+        "[cd]",
+        "-c:a",
+        "pcm_s16le",
+        # A bare RIFF header, with no LIST chunk naming the encoder
+        "-fflags",
+        "+bitexact",
+        "-f",
+        "segment",
+        "-segment_time",
+        str(CD_TRACK_SECONDS),
+        "-segment_format",
+        "wav",
+        os.path.join(cd_dir, "%02d.wav"),
+    ]
+
+
+def _run(command):
+    result = subprocess.run(command, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        raise AudioProcessingError(
+            f"ffmpeg exited with status {result.returncode}: {result.stderr[-2000:]}"
+        )
+
+    return result
+
+
+def decode_command(source, destination):
+    """The ffmpeg command that decodes `source` to a CD-format WAV."""
+    return [
+        FFMPEG,
+        "-hide_banner",
+        "-nostdin",
+        "-y",
+        "-i",
+        source,
+        "-vn",
+        "-map_metadata",
+        "-1",
+        "-af",
+        f"aformat=sample_rates={SAMPLE_RATE}:channel_layouts=stereo",
+        "-c:a",
+        "pcm_s16le",
+        "-f",
+        "wav",
+        destination,
+    ]
+
+
+def probe_audio(path):
+    """ffprobe's description of the first audio stream in `path`, or None.
+
+    Includes codec_name, sample_rate, channels and duration. None if there is
+    no audio, or ffprobe can't read the file or isn't installed.
+    """
+    command = [
+        FFPROBE,
+        "-v",
+        "error",
+        "-select_streams",
+        "a:0",
+        "-show_entries",
+        "stream=codec_name,sample_rate,channels,bit_rate,duration",
+        "-of",
+        "json",
+        path,
+    ]
+
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except OSError:
+        return None
+
+    if result.returncode != 0:
+        return None
+
+    try:
+        streams = json.loads(result.stdout).get("streams") or []
+    except ValueError:
+        return None
+    return streams[0] if streams else None
+
+
+def extraction_command(video_path, audio_path, stream):
+    """How to take a video's audio out into a raw MP3: ("copy" or "transcode", command).
+
+    `stream` is the video's audio as described by probe_audio(). An MP3 track
+    is copied out as it is; anything else, or a video we couldn't probe, is
+    encoded.
+    """
+    command = [FFMPEG, "-hide_banner", "-nostdin", "-y", "-i", video_path, "-vn", "-map", "0:a:0"]
+
+    if stream is not None and stream.get("codec_name") in COPYABLE_CODECS:
+        return "copy", command + ["-c:a", "copy", audio_path]
+
+    return "transcode", command + [
+        "-c:a",
+        "libmp3lame",
+        "-b:a",
+        EXTRACTED_BITRATE,
+        "-ar",
+        str(SAMPLE_RATE),
+        audio_path,
+    ]
+
+
+def _decoded_prefix(source):
+    return os.path.splitext(os.path.basename(source))[0] + "-"
+
+
+def decoded_asset_path(source):
+    """Where the decoded copy of `source`, as it is right now, is cached."""
+    stat = os.stat(source)
+    return os.path.join(
+        app.config["DECODED_CACHE_DIR"],
+        f"{_decoded_prefix(source)}{stat.st_mtime_ns}-{stat.st_size}.wav",
+    )
+
+
+def decoded_asset(source):
+    """Return the path of a decoded WAV copy of `source`, decoding it if needed."""
+    stat = os.stat(source)
+    key = (source, stat.st_mtime_ns, stat.st_size)
+
+    if key in _decoded_assets and os.path.exists(_decoded_assets[key]):
+        return _decoded_assets[key]
+
+    path = decoded_asset_path(source)
+
+    if not os.path.exists(path):
+        invalidate_decoded_asset(source)
+        os.makedirs(app.config["DECODED_CACHE_DIR"], exist_ok=True)
+
+        # Decode under a private name, so a worker never reads a half-written file
+        partial_path = f"{path}.{os.getpid()}.partial"
+        try:
+            _run(decode_command(source, partial_path))
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    _decoded_assets[key] = path
+    return path
+
+
+def invalidate_decoded_asset(source):
+    """Remove every cached decoding of `source`."""
+    _decoded_assets.clear()
+
+    cache_dir = app.config["DECODED_CACHE_DIR"]
+    if not os.path.isdir(cache_dir):
+        return
+
+    prefix = _decoded_prefix(source)
+    for entry in os.scandir(cache_dir):
+        if entry.name.startswith(prefix) and entry.name.endswith(".wav"):
+            os.remove(entry.path)
+
+
+def top_and_tail():
+    """The decoded top and tail jingles, as paths to feed to ffmpeg."""
+    return (
+        decoded_asset(os.path.join(app.config["UPLOAD_DIR"], "top.mp3")),
+        decoded_asset(os.path.join(app.config["UPLOAD_DIR"], "tail.mp3")),
+    )
+
+
+def measure_loudness(inputs):
+    """Run the analysis pass and return loudnorm's measurements."""
+    return parse_loudnorm_stats(_run(measure_command(inputs)).stderr)
+
+
+def render_talk(inputs, measured, mp3_paths, cd_dir):
+    """Run the final pass, writing the MP3s and CD tracks."""
+    _run(render_command(inputs, measured, mp3_paths, cd_dir))
+    fold_short_final_track(cd_dir)
+
+
+def _wav_data_chunk(wav):
+    """(offset of the data chunk's size field, size) in an open WAV file."""
+    riff, _, form = struct.unpack("<4sI4s", wav.read(12))
+    if riff != b"RIFF" or form != b"WAVE":
+        raise AudioProcessingError(f"{wav.name} is not a WAV file")
+
+    while True:
+        header = wav.read(8)
+        if len(header) < 8:
+            raise AudioProcessingError(f"{wav.name} has no data chunk")
+
+        chunk_id, size = struct.unpack("<4sI", header)
+        if chunk_id == b"data":
+            return wav.tell() - 4, size
+
+        wav.seek(size + (size & 1), os.SEEK_CUR)
+
+
+def fold_short_final_track(cd_dir):
+    """Append a final CD track under four seconds onto the track before it.
+
+    Only the short track's few seconds of audio are copied; the previous track
+    is extended in place and its RIFF and data sizes rewritten.
+    """
+    tracks = sorted(name for name in os.listdir(cd_dir) if name.endswith(".wav"))
+    if len(tracks) < 2:
+        return
+
+    last_path = os.path.join(cd_dir, tracks[-1])
+    previous_path = os.path.join(cd_dir, tracks[-2])
+
+    with open(last_path, "rb") as last:
+        size_offset, size = _wav_data_chunk(last)
+        if size >= CD_MIN_TRACK_SECONDS * SAMPLE_RATE * 4:
+            return
+        last.seek(size_offset + 4)
+        tail = last.read(size)
+
+    with open(previous_path, "r+b") as previous:
+        size_offset, size = _wav_data_chunk(previous)
+        if size_offset + 4 + size != os.fstat(previous.fileno()).st_size:
+            raise AudioProcessingError(f"{previous_path} has chunks after its audio")
+
+        file_size = previous.seek(0, os.SEEK_END) + len(tail)
+        previous.write(tail)
+        previous.seek(size_offset)
+        previous.write(struct.pack("<I", size + len(tail)))
+        previous.seek(4)
+        previous.write(struct.pack("<I", file_size - 8))
+
+    os.remove(last_path)
+
+
+def tag_processed_mp3(path, talk):
+    """Write the ID3 frames every processed talk carries."""
+    gb_year = app.config["GB_FRIDAY"][0:4]
+
+    try:
+        mp3 = ID3(path)
+    except ID3NoHeaderError:
+        mp3 = ID3()
+
+    mp3["TALB"] = TALB(text="Greenbelt Festival Talks " + gb_year)
+    mp3["TCOP"] = TCOP(text=gb_year + " Greenbelt Festivals")
+    mp3["TIT2"] = TIT2(text=talk.title)
+    mp3["TPE1"] = TPE1(text=talk.speaker)
+    mp3["TPE2"] = TPE2(text=talk.speaker)
+    mp3["TRCK"] = TRCK(text=str(talk.id))
+    mp3["TDRC"] = TDRC(text=gb_year)
+    mp3["COMM"] = COMM(text=talk.description)
+    mp3["TCMP"] = TCMP(text="1")
+
+    with open(app.config["IMG_DIR"] + "/alltalksicon.png", "rb") as albumart:
+        mp3["APIC"] = APIC(
+            mime="image/png", type=3, desc="Front cover", data=albumart.read()
+        )
+
+    mp3.save(path)
+
+
+def retag_talk(talk):
+    """Bring an already-processed talk's name and tags up to date.
+
+    Renames the processed MP3 to match the talk's current title and speaker and
+    rewrites its ID3 frames, then republishes the web and USB gold copies. The
+    audio is untouched. Returns the processed path, or None if the talk hasn't
+    been processed yet.
+    """
+    existing = find_processed_files(talk.id)
+    if not existing:
+        return None
+
+    processed_path = get_path_for_file(talk.id, "processed", talk.title, talk.speaker)
+
+    if existing[0] != processed_path:
+        os.replace(existing[0], processed_path)
+
+    # Anything else is left over from an older title
+    for stale_path in existing[1:]:
+        if stale_path != processed_path:
+            os.remove(stale_path)
+
+    tag_processed_mp3(processed_path, talk)
+
+    # Hard-linked copies already have the new tags; anything else is remade
+    publish_talk(talk.id, processed_path)
+
+    return processed_path
@@ -1,157 +1,319 @@
 import csv
+import json
+import multiprocessing
 import os
 import pprint
-import shutil
 import subprocess
 from datetime import datetime
-from multiprocessing import Pool
 
 import click
 from flask import current_app as app
 from flask.cli import with_appcontext
-from mutagen.id3 import APIC, COMM, ID3, TALB, TCMP, TCOP, TDRC, TIT2, TPE1, TPE2, TRCK
-from pydub import AudioSegment
 from tendo import singleton
 
-from .libgbtalks import get_cd_dir_for_talk, get_path_for_file
-from .models import Editor, Recorder, Talk, db
+from . import scheduling
+from .audio import (
+    measure_loudness,
+    render_talk,
+    retag_talk,
+    tag_processed_mp3,
+    top_and_tail,
+)
+from .conversion import find_unprocessed_talks, requeue_abandoned_jobs, run_worker
+from .distribution import publish_processed_talks, publish_talk
+from .libgbtalks import file_sha256, get_cd_dir_for_talk, get_path_for_file
+from .models import Editor, LoudnessMeasurement, Recorder, Talk, db
+from .rota import engine as rota_engine
+from .rota.optimise import optimise
+from .rota.simulate import ScenarioError, simulate
+from .scratch import estimate_scratch_bytes, move_into_place, scratch_job, sweep_scratch
 from .talks_csv import parse_talks_csv
 
 
 def process_talk(talk_id):
-    top = AudioSegment.from_file(os.path.join(app.config["UPLOAD_DIR"], "top.mp3"))
-    tail = AudioSegment.from_file(os.path.join(app.config["UPLOAD_DIR"], "tail.mp3"))
-
     talk = db.session.get(Talk, talk_id)
 
-    # Add the top and tail, create a high-quality mp3
-    hq_mp3 = top + AudioSegment.from_file(get_path_for_file(talk.id, "edited")) + tail
+    # Add the top and tail, and normalise to a fixed level
+    top, tail = top_and_tail()
+    edited_path = get_path_for_file(talk.id, "edited")
+    inputs = [top, edited_path, tail]
 
-    # Export a WAV file of the top/tailed audio into /tmp for further processing
-    toptail_path = "/tmp/toptailed" + str(talk.id) + ".wav"
-    hq_mp3.export(toptail_path, format="wav")
+    # Only measure the loudness if this audio hasn't been measured before
+    content_hash = file_sha256(edited_path)
+    jingles = os.path.basename(top) + "|" + os.path.basename(tail)
 
-    # Normalise to a fixed level
-    normalized_path = "/tmp/normalized" + str(talk.id) + ".wav"
-    subprocess.call(
-        [
-            "ffmpeg-normalize",
-            toptail_path,
-            "-o",
-            normalized_path,
-            "--loudness-range-target",
-            "3",
-            "-t",
-            "-13",
-            "-f",
-            "-ar",
-            "44100",
-        ]
+    measurement = LoudnessMeasurement.lookup(content_hash, jingles)
+    was_cached = measurement is not None
+    if not was_cached:
+        measurement = LoudnessMeasurement.record(
+            content_hash, jingles, talk.id, measure_loudness(inputs)
+        )
+
+    processed_path = get_path_for_file(talk.id, "processed", talk.title, talk.speaker)
+    needed = estimate_scratch_bytes(scheduling.talk_duration(edited_path))
+
+    # Everything is written in scratch space first, so a processed MP3 only
+    # appears once the whole talk is done
+    with scratch_job(talk.id, needed) as job_dir:
+        mp3_path = os.path.join(job_dir, os.path.basename(processed_path))
+        cd_dir = os.path.join(job_dir, "cd")
+        os.makedirs(cd_dir)
+
+        # Encode the MP3 and split the CD audio into 5 minute tracks in one pass
+        render_talk(inputs, measurement.as_loudnorm_stats(), [mp3_path], cd_dir)
+
+        # Put appropriate metadata on the resultant mp3
+        tag_processed_mp3(mp3_path, talk)
+
+        # CD files for later burning, then the MP3, published to the web and
+        # USB gold directories (filename format gbXX-XXXmp3.mp3)
+        move_into_place(cd_dir, get_cd_dir_for_talk(talk.id))
+        move_into_place(mp3_path, processed_path)
+        publish_talk(talk.id, processed_path)
+
+    return {
+        "talk_id": talk.id,
+        "integrated": measurement.input_i,
+        "range": measurement.input_lra,
+        "true_peak": measurement.input_tp,
+        "cached": was_cached,
+    }
+
+
+def format_loudness_report(result):
+    """One line of the convert-talks summary"""
+    return (
+        f"Talk {result['talk_id']}: {result['integrated']:.1f} LUFS, "
+        f"range {result['range']:.1f} LU, true peak {result['true_peak']:.1f} dBTP"
+        + (" (measured previously)" if result["cached"] else "")
     )
 
-    # Load the normalised file back in
-    hq_mp3 = AudioSegment.from_file(normalized_path)
 
-    # Create a reduced-bitrate MP3 from the normalized file
-    hq_mp3.export(
-        get_path_for_file(talk.id, "processed", talk.title, talk.speaker),
-        format="mp3",
-        bitrate="128k",
-    )
+@click.command()
+@click.option("--workers", "-w", type=int, help="Talks to convert at once [default: from CPUs and memory]")
+@click.option("--memory-budget", type=int, help="MB conversions may use [default: from free memory]")
+@with_appcontext
+def convert_talks(workers, memory_budget):
+    """Create production files (MP3 and CD) from edited files"""
 
-    # Put appropriate metadata on the resultant mp3
-    mp3 = ID3(get_path_for_file(talk.id, "processed", talk.title, talk.speaker))
-
-    mp3["TALB"] = TALB(text="Greenbelt Festival Talks " + app.config["GB_FRIDAY"][0:4])
-    mp3["TCOP"] = TCOP(text=app.config["GB_FRIDAY"][0:4] + " Greenbelt Festivals")
-    mp3["TIT2"] = TIT2(text=talk.title)
-    mp3["TPE1"] = TPE1(text=talk.speaker)
-    mp3["TPE2"] = TPE2(text=talk.speaker)
-    mp3["TRCK"] = TRCK(text=str(talk.id))
-    mp3["TDRC"] = TDRC(text=str(app.config["GB_FRIDAY"][0:4]))
-    mp3["COMM"] = COMM(text=talk.description)
-    mp3["TCMP"] = TCMP(text="1")
-
-    with open(app.config["IMG_DIR"] + "/alltalksicon.png", "rb") as albumart:
-        mp3["APIC"] = APIC(
-            mime="image/png", type=3, desc="Front cover", data=albumart.read()
-        )
-    mp3.save()
+    # Make sure we only run one of these at a time. The instance must stay
+    # referenced for the lifetime of the command - it releases the lock when it
+    # is garbage collected, so this binding is deliberate and load-bearing.
+    only_once_preventer = singleton.SingleInstance(flavor_id="convert_talks")  # noqa: F841
+
+    # Work out which files need to be converted by looking at the filesystem
+    # If a talk has an edited file but no converted file, convert it!
+    talks = find_unprocessed_talks()
+
+    talks_to_process = [x for x in list(talks) if Talk.query.where(Talk.id==x, Talk.is_cleared)] or []
 
+    pprint.pprint("Processing Talks:")
+    pprint.pprint(talks_to_process)
 
+    if not talks_to_process:
+        return
 
-    # Clean up
-    if os.path.exists(toptail_path):
-        os.remove(toptail_path)
+    # Decode the top and tail once here, rather than once in each worker
+    top_and_tail()
+    sweep_scratch()
 
-    if os.path.exists(normalized_path):
-        os.remove(normalized_path)
+    budget = scheduling.memory_budget(memory_budget)
+    workers = scheduling.worker_count(workers, budget)
+    jobs = scheduling.order_for_conversion(talks_to_process)
+    print(f"Converting {len(jobs)} talk(s), {workers} at a time")
 
-    # Copy the file to the web_mp3 directory with filename format gbXX-XXXmp3.mp3
-    shutil.copy(get_path_for_file(str(talk.id), "processed", talk.title, talk.speaker), get_path_for_file(str(talk.id), "web_mp3"))
+    results = []
+    for talk_id, result, error in scheduling.run_scheduled(process_talk, jobs, workers, budget):
+        if error is not None:
+            print(f"Talk {talk_id} failed: {error}")
+        else:
+            results.append(result)
 
-    # Create files for later CD burning
-    cd_dir = get_cd_dir_for_talk(talk.id)
-    if os.path.exists(cd_dir):
-        shutil.rmtree(cd_dir)
+    print("Loudness before normalisation:")
+    for result in results:
+        print(format_loudness_report(result))
 
-    os.makedirs(cd_dir)
 
-    # Split the mp3 into 5min (300k ms) slices
-    for idx, cd_file in enumerate(hq_mp3[::300000]):
-        cd_file.export(
-            cd_dir + "/" + str(idx).zfill(2) + ".wav",
-            format="wav",
+@click.command(name="conversion-worker")
+@click.option("--processes", "-p", type=int, help="Talks to convert at once [default: from CPUs and memory]")
+@click.option("--poll-interval", default=5, show_default=True, help="Seconds between queue checks")
+@click.option("--once", is_flag=True, help="Exit when the queue is empty instead of waiting")
+@with_appcontext
+def conversion_worker(processes, poll_interval, once):
+    """Convert talks from the conversion queue as they are uploaded"""
+
+    # As for convert_talks, the lock lasts as long as this binding does
+    only_once_preventer = singleton.SingleInstance(flavor_id="conversion_worker")  # noqa: F841
+
+    # Only one worker runs at a time, so anything still marked running was
+    # interrupted part-way and needs doing again
+    requeued = requeue_abandoned_jobs()
+    if requeued:
+        print(f"Requeued {requeued} interrupted conversion(s)")
+
+    top_and_tail()
+    sweep_scratch()
+
+    processes = scheduling.worker_count(processes, scheduling.memory_budget())
+    print(f"Starting {processes} conversion worker(s)")
+
+    flask_app = app._get_current_object()
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(
+            target=_conversion_worker_process,
+            args=(flask_app, poll_interval, once, index == 0),
         )
+        for index in range(processes)
+    ]
 
+    for worker in workers:
+        worker.start()
 
-@click.command()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+def _conversion_worker_process(flask_app, poll_interval, once, scans):
+    with flask_app.app_context():
+        # Connections inherited from the parent must not be shared
+        db.engine.dispose(close=False)
+
+        scan_interval = flask_app.config["CONVERSION_SCAN_INTERVAL"] if scans else None
+        run_worker(process_talk, poll_interval=poll_interval, scan_interval=scan_interval, once=once)
+
+
+@click.command(name="retag-talks")
+@click.argument("talk_ids", nargs=-1, type=int)
 @with_appcontext
-def convert_talks():
-    """Create production files (MP3 and CD) from edited files"""
+def retag_talks(talk_ids):
+    """Update processed MP3 names and tags to match the talks database"""
 
-    # Make sure we only run one of these at a time. The instance must stay
-    # referenced for the lifetime of the command - it releases the lock when it
-    # is garbage collected, so this binding is deliberate and load-bearing.
-    only_once_preventer = singleton.SingleInstance(flavor_id="convert_talks")  # noqa: F841
+    talks = (
+        Talk.query.filter(Talk.id.in_(talk_ids)) if talk_ids else Talk.query
+    ).order_by(Talk.id)
 
-    gb_year = str(app.config["GB_FRIDAY"][2:4])
-    gb_prefix = "gb" + gb_year + "-"
+    retagged = 0
+    for talk in talks:
+        processed_path = retag_talk(talk)
+        if processed_path:
+            print(f"Talk {talk.id}: {os.path.basename(processed_path)}")
+            retagged += 1
 
-    # Work out which files need to be converted by looking at the filesystem
-    # If a talk has an edited file but no converted file, convert it!
+    print(f"Retagged {retagged} processed talk(s)")
 
-    edited_files = (
-        {
 
-                x.name.replace("_EDITED.mp3", "").replace(gb_prefix, "")
-                for x in os.scandir(app.config["UPLOAD_DIR"])
-                if x.name.endswith("EDITED.mp3")
+@click.command(name="publish-talks")
+@click.argument("talk_ids", nargs=-1, type=int)
+@with_appcontext
+def publish_talks(talk_ids):
+    """Bring the web and USB gold copies of processed talks up to date"""
 
-        }
-        or set()
-    )
-    processed_files = (
-        {
+    published = publish_processed_talks(talk_ids or None)
 
-                x.name.split("_")[1]
-                for x in os.scandir(app.config["PROCESSED_DIR"])
-                if x.name.endswith(".mp3")
+    for talk_id, changed in published.items():
+        methods = ", ".join(f"{destination} ({method})" for destination, method in changed.items())
+        print(f"Talk {talk_id}: {methods}")
 
-        }
-        or set()
-    )
+    print(f"Published {len(published)} talk(s)")
 
-    talks = edited_files
-    talks.difference_update(processed_files)
 
-    talks_to_process = [x for x in list(talks) if Talk.query.where(Talk.id==x, Talk.is_cleared)] or []
+@click.command(name="generate-rota")
+@click.option("--optimise", "optimise_rota", is_flag=True, help="Improve on the standard rota by local search")
+@click.option("--seconds", type=float, help="Time optimising may take [default: ROTA_OPTIMISE_SECONDS]")
+@with_appcontext
+def generate_rota(optimise_rota, seconds):
+    """Clear the rota and generate a new one, as the rota page does"""
+
+    rota = rota_engine.load_rota()
+    rota.clear()
+    rota_engine.generate(rota)
+
+    if optimise_rota:
+        before = rota_engine.coverage(rota)
+        moves = optimise(rota, seconds if seconds is not None else app.config["ROTA_OPTIMISE_SECONDS"])
+        print(f"Optimising made {moves} change(s) to the standard rota of "
+              f"{before['priority'][0]} priority and {before['additional'][0]} additional talks")
+
+    changes = rota_engine.save_rota(rota)
+    coverage = rota_engine.coverage(rota)
+
+    print(f"Assigned {coverage['priority'][0]}/{coverage['priority'][1]} priority talks and "
+          f"{coverage['additional'][0]}/{coverage['additional'][1]} additional talks "
+          f"({len(changes)} assignment(s) changed)")
+
+
+@click.command(
+    name="bench-pipeline",
+    context_settings={"ignore_unknown_options": True, "allow_extra_args": True, "help_option_names": []},
+    add_help_option=False,
+)
+@click.pass_context
+def bench_pipeline(ctx):
+    """Benchmark each stage of processing a talk (see benchmarks/pipeline.py)"""
+
+    # The benchmarks live outside the package, alongside config.py, so they
+    # are only imported when asked for, never by the web server
+    from benchmarks.pipeline import bench_pipeline as command
+
+    command.main(ctx.args, prog_name=ctx.command_path, obj=ctx.obj, standalone_mode=False)
+
+
+def parse_scenario_settings(text):
+    """Settings from "key=value,key=value", e.g. "break_between_shifts=1,shift_length=4" """
+    settings = {}
+    for pair in filter(None, (part.strip() for part in text.split(","))):
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise click.BadParameter(f"{pair!r} should be setting=value")
+        settings[key.strip()] = value.strip()
+    return settings
+
+
+@click.command(name="simulate-rota")
+@click.option("--scenario", "-s", "scenarios", multiple=True,
+              help="Settings to try, e.g. break_between_shifts=1,shift_length=4; may be repeated")
+@click.option("--optimise", "optimise_seconds", type=float,
+              help="Also optimise each rota, for up to this many seconds")
+@click.option("--workers", type=int, help="Scenarios run at once [default: ROTA_SIMULATION_WORKERS or CPUs]")
+@click.option("--json", "as_json", is_flag=True, help="Print the full results as JSON")
+@with_appcontext
+def simulate_rota(scenarios, optimise_seconds, workers, as_json):
+    """Show what the rota would be with other settings, without changing it
 
-    pprint.pprint("Processing Talks:")
-    pprint.pprint(talks_to_process)
+    The current settings are always run first, for comparison.
+    """
+
+    runs = [{"name": "current settings"}] + [
+        {"name": scenario, "settings": parse_scenario_settings(scenario)} for scenario in scenarios
+    ]
+    for run in runs:
+        run["optimise"] = optimise_seconds
+
+    try:
+        # Nothing else is running here, so the scenarios can be forked off
+        results = simulate(runs, workers or app.config["ROTA_SIMULATION_WORKERS"] or scheduling.available_cpus())
+    except ScenarioError as e:
+        raise click.ClickException(str(e)) from None
+
+    if as_json:
+        print(json.dumps(results, indent=2))
+        return
 
-    with Pool(5) as p:
-        p.map(process_talk, talks_to_process)
+    for result in results:
+        priority = result["coverage"]["priority"]
+        additional = result["coverage"]["additional"]
+        busiest = max((load["talks"] for load in result["load"].values()), default=0)
+        print(f"{result['name']}: {priority['assigned']}/{priority['total']} priority, "
+              f"{additional['assigned']}/{additional['total']} additional, "
+              f"busiest recorder {busiest} talk(s), "
+              f"{len(result['changes'])} talk(s) differ from the live rota")
 
 
 def burn_cd(talk_id, cd_index, cd_writer):
@@ -276,6 +438,110 @@ def add_recorder_time_constraints():
         print(f"Note: latest_end_time column may already exist: {e}")
 
 
+def create_loudness_measurements_table():
+    """Migration: Create loudness_measurements table"""
+    from .models import LoudnessMeasurement
+    LoudnessMeasurement.__table__.create(db.engine, checkfirst=True)
+
+
+def create_conversion_jobs_table():
+    """Migration: Create conversion_jobs table"""
+    from .models import ConversionJob
+    ConversionJob.__table__.create(db.engine, checkfirst=True)
+
+
+def add_conversion_job_duration():
+    """Migration: Add duration to conversion_jobs"""
+    from sqlalchemy import text
+
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE conversion_jobs ADD COLUMN duration FLOAT'))
+        print("Added duration column to conversion_jobs table")
+    except Exception as e:
+        print(f"Note: duration column may already exist: {e}")
+
+
+def create_published_files_table():
+    """Migration: Create published_files table"""
+    from .models import PublishedFile
+    PublishedFile.__table__.create(db.engine, checkfirst=True)
+
+
+def create_uploaded_files_table():
+    """Migration: Create uploaded_files table, indexing the files already uploaded"""
+    from .models import UploadedFile
+    from .uploads import index_existing_uploads
+
+    UploadedFile.__table__.create(db.engine, checkfirst=True)
+    print(f"Indexed {index_existing_uploads()} existing upload(s)")
+
+
+def create_upload_sessions_tables():
+    """Migration: Create upload_sessions and upload_chunks tables"""
+    from .models import UploadChunk, UploadSession
+    UploadSession.__table__.create(db.engine, checkfirst=True)
+    UploadChunk.__table__.create(db.engine, checkfirst=True)
+
+
+def add_upload_session_updated_at():
+    """Migration: Add updated_at to upload_sessions"""
+    from sqlalchemy import text
+
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE upload_sessions ADD COLUMN updated_at DATETIME'))
+            conn.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_upload_sessions_updated_at ON upload_sessions (updated_at)'
+            ))
+            conn.execute(text('UPDATE upload_sessions SET updated_at = created_at'))
+        print("Added updated_at column to upload_sessions table")
+    except Exception as e:
+        print(f"Note: updated_at column may already exist: {e}")
+
+
+def create_media_jobs_table():
+    """Migration: Create media_jobs table"""
+    from .models import MediaJob
+    MediaJob.__table__.create(db.engine, checkfirst=True)
+
+
+def add_media_job_result():
+    """Migration: Add result to media_jobs"""
+    from sqlalchemy import text
+
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE media_jobs ADD COLUMN result TEXT'))
+        print("Added result column to media_jobs table")
+    except Exception as e:
+        print(f"Note: result column may already exist: {e}")
+
+
+def add_uploaded_file_mtime():
+    """Migration: Add mtime to uploaded_files"""
+    from sqlalchemy import text
+
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE uploaded_files ADD COLUMN mtime FLOAT'))
+        print("Added mtime column to uploaded_files table")
+    except Exception as e:
+        print(f"Note: mtime column may already exist: {e}")
+
+
+def add_recorder_has_dropped_out():
+    """Migration: Add has_dropped_out to recorders"""
+    from sqlalchemy import text
+
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE recorders ADD COLUMN has_dropped_out BOOLEAN DEFAULT 0'))
+        print("Added has_dropped_out column to recorders table")
+    except Exception as e:
+        print(f"Note: has_dropped_out column may already exist: {e}")
+
+
 def add_talk_cancelled_field():
     """Migration: Add is_cancelled field to talks table"""
     from sqlalchemy import text
@@ -343,9 +609,145 @@ MIGRATIONS = [
         )
     ),
 
+    Migration(
+        version="004_create_loudness_measurements",
+        description="Create loudness_measurements table to cache loudnorm analysis",
+        up_func=create_loudness_measurements_table,
+        notes=(
+            "Stores the integrated loudness, loudness range, true peak and threshold "
+            "measured for each edited file, keyed by its content hash and the top/tail "
+            "jingles. convert-talks uses it to skip the analysis pass when a talk is "
+            "re-processed without its audio changing. "
+            "No existing data is affected; the table starts empty."
+        )
+    ),
+
+    Migration(
+        version="005_create_conversion_jobs",
+        description="Create conversion_jobs table for the conversion queue",
+        up_func=create_conversion_jobs_table,
+        notes=(
+            "Adds the queue that flask conversion-worker takes talks from. Uploading "
+            "an edited file adds a job; the worker also queues any talk with an edited "
+            "file but no processed file, so talks uploaded before this migration are "
+            "picked up on its first scan. Replaces the convert-talks cron job. "
+            "No existing data is affected; the table starts empty."
+        )
+    ),
+
+    Migration(
+        version="006_add_conversion_job_duration",
+        description="Add duration to conversion_jobs so the queue runs shortest first",
+        up_func=add_conversion_job_duration,
+        notes=(
+            "Adds a nullable duration column (seconds, read from the edited MP3's "
+            "header when the job is queued). conversion-worker takes priority talks "
+            "first and then the shortest. Jobs queued before this migration have no "
+            "duration and run after those that do. "
+            "Run after 005_create_conversion_jobs."
+        )
+    ),
+
+    Migration(
+        version="007_create_published_files",
+        description="Create published_files table recording the web and USB gold copies",
+        up_func=create_published_files_table,
+        notes=(
+            "Records, for each talk, where its processed MP3 has been published and "
+            "whether as a hard link, reflink or copy, so republishing after a retag "
+            "only touches stale copies. The table starts empty: run "
+            "`flask publish-talks` once afterwards to record existing copies, "
+            "replacing any that are full copies with hard links where possible."
+        )
+    ),
+
+    Migration(
+        version="008_create_uploaded_files",
+        description="Create uploaded_files table for duplicate upload detection",
+        up_func=create_uploaded_files_table,
+        notes=(
+            "Records the talk, file type, path, size and sha256 of every file uploaded "
+            "into UPLOAD_DIR. The upload pages look duplicates up here by content hash "
+            "instead of walking UPLOAD_DIR for files of the same size. "
+            "Hashes every raw, edited and video file already in UPLOAD_DIR, so allow "
+            "a minute or so per few GB of uploads."
+        )
+    ),
+
+    Migration(
+        version="009_create_upload_sessions",
+        description="Create upload_sessions and upload_chunks tables for chunked uploads",
+        up_func=create_upload_sessions_tables,
+        notes=(
+            "Chunked upload sessions, and the chunks received for each, were kept in "
+            "a metadata.json per session under /tmp and are now kept here. Uploads "
+            "in progress when this is run can't be resumed; start them again."
+        )
+    ),
+
+    Migration(
+        version="010_add_upload_session_updated_at",
+        description="Add updated_at to upload_sessions so abandoned uploads can expire",
+        up_func=add_upload_session_updated_at,
+        notes=(
+            "Records when each chunked upload last received a chunk. Sessions "
+            "untouched for UPLOAD_SESSION_TTL hours are deleted, along with their "
+            "partial files, whenever a chunked upload starts."
+        )
+    ),
+
+    Migration(
+        version="011_create_media_jobs",
+        description="Create media_jobs table for background upload and video work",
+        up_func=create_media_jobs_table,
+        notes=(
+            "Finishing chunked uploads and extracting audio from videos are now "
+            "queued here and run by a bounded pool of threads in the web server, "
+            "instead of a new thread each. Jobs interrupted by a restart are run "
+            "again when the server starts."
+        )
+    ),
+
+    Migration(
+        version="012_add_media_job_result",
+        description="Add result to media_jobs, to record what each job did",
+        up_func=add_media_job_result,
+        notes=(
+            "Audio extraction now copies an MP3 track out of a video unchanged "
+            "and only encodes other codecs. Each extraction job records which it "
+            "did, the source codec and how long it took here, as JSON."
+        )
+    ),
+
+    Migration(
+        version="013_add_uploaded_file_mtime",
+        description="Add mtime to uploaded_files, to spot files replaced since they were hashed",
+        up_func=add_uploaded_file_mtime,
+        notes=(
+            "Duplicate detection took an indexed file to be unchanged if its size "
+            "still matched, so a replacement of the same size was reported as a "
+            "duplicate. The modification time is now recorded when a file is "
+            "hashed, and a file modified since is hashed again before it counts. "
+            "Files indexed before this have no mtime and are hashed again the "
+            "first time they match an upload."
+        )
+    ),
+
+    Migration(
+        version="014_add_recorder_has_dropped_out",
+        description="Add has_dropped_out to recorders, so the rota leaves them out",
+        up_func=add_recorder_has_dropped_out,
+        notes=(
+            "Repairing the rota for a recorder who dropped out used to give their "
+            "talks away only until the rota was next generated. Dropping out is now "
+            "recorded on the recorder, and generating, optimising and repairing the "
+            "rota never give them talks. Existing recorders are not dropped out."
+        )
+    ),
+
     # Template for future migrations:
     # Migration(
-    #     version="004_descriptive_name",
+    #     version="015_descriptive_name",
     #     description="Brief description of what this migration does",
     #     up_func=your_migration_function,
     #     down_func=your_rollback_function,  # Optional
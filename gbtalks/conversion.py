@@ -0,0 +1,225 @@
+"""The conversion job queue.
+
+Every edited upload enqueues a ConversionJob, and `flask conversion-worker`
+runs them. Jobs live in the database rather than being worked out from the
+filesystem, so a worker that crashes part-way leaves a record of what it was
+doing, and a failed conversion is retried rather than silently skipped:
+
+    queued -> running -> done
+                      -> queued again, after a delay, until it has failed
+                         CONVERSION_MAX_ATTEMPTS times
+                      -> failed
+
+A job is claimed by a conditional UPDATE from queued to running, so any number
+of worker processes can share the queue without two of them taking the same
+job.
+
+The worker also scans for edited files with no processed file every
+CONVERSION_SCAN_INTERVAL seconds, which picks up files that arrived some other
+way than through the upload pages.
+"""
+
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app as app
+from sqlalchemy import func, or_, select, update
+
+from .libgbtalks import get_path_for_file
+from .models import ConversionJob, Talk, db
+from .scheduling import talk_duration
+
+
+def find_unprocessed_talks():
+    """Talk ids with an edited file but no processed file, from the filesystem"""
+
+    gb_year = str(app.config["GB_FRIDAY"][2:4])
+    gb_prefix = "gb" + gb_year + "-"
+
+    edited_files = {
+        x.name.replace("_EDITED.mp3", "").replace(gb_prefix, "")
+        for x in os.scandir(app.config["UPLOAD_DIR"])
+        if x.name.endswith("EDITED.mp3")
+    }
+    processed_files = {
+        x.name.split("_")[1]
+        for x in os.scandir(app.config["PROCESSED_DIR"])
+        if x.name.endswith(".mp3")
+    }
+
+    return edited_files - processed_files
+
+
+def enqueue_conversion(talk_id):
+    """Queue a talk for conversion, unless it is already waiting or running"""
+
+    talk_id = int(talk_id)
+    duration = talk_duration(get_path_for_file(talk_id, "edited"))
+
+    pending = ConversionJob.query.filter(
+        ConversionJob.talk_id == talk_id,
+        ConversionJob.state.in_([ConversionJob.QUEUED, ConversionJob.RUNNING]),
+    ).first()
+
+    if pending is not None:
+        if pending.state == ConversionJob.QUEUED:
+            pending.duration = duration
+            db.session.commit()
+        return pending
+
+    job = ConversionJob(
+        talk_id=talk_id,
+        state=ConversionJob.QUEUED,
+        duration=duration,
+        queued_at=datetime.now(),
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next_job(worker=None):
+    """Take the next runnable job and mark it running, or return None
+
+    Priority talks go first, then the shortest, so the order matches
+    scheduling.order_for_conversion.
+    """
+
+    while True:
+        now = datetime.now()
+
+        job_id = db.session.execute(
+            select(ConversionJob.id)
+            .outerjoin(Talk, Talk.id == ConversionJob.talk_id)
+            .where(
+                ConversionJob.state == ConversionJob.QUEUED,
+                or_(ConversionJob.not_before.is_(None), ConversionJob.not_before <= now),
+            )
+            .order_by(
+                func.coalesce(Talk.is_priority, False).desc(),
+                ConversionJob.duration.is_(None),
+                ConversionJob.duration,
+                ConversionJob.id,
+            )
+            .limit(1)
+        ).scalar()
+
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        # Only one process can move a given job out of queued
+        claimed = db.session.execute(
+            update(ConversionJob)
+            .where(ConversionJob.id == job_id, ConversionJob.state == ConversionJob.QUEUED)
+            .values(
+                state=ConversionJob.RUNNING,
+                started_at=now,
+                finished_at=None,
+                worker=worker or worker_name(),
+                attempts=ConversionJob.attempts + 1,
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+
+        if claimed:
+            job = db.session.get(ConversionJob, job_id)
+            db.session.refresh(job)
+            return job
+
+
+def complete_job(job):
+    job.state = ConversionJob.DONE
+    job.finished_at = datetime.now()
+    job.error = None
+    db.session.commit()
+
+
+def fail_job(job, error):
+    """Record a failure, and queue the job to be retried if it has tries left"""
+
+    job.finished_at = datetime.now()
+    job.error = str(error)[-2000:]
+
+    if job.attempts < app.config["CONVERSION_MAX_ATTEMPTS"]:
+        job.state = ConversionJob.QUEUED
+        job.not_before = job.finished_at + timedelta(
+            seconds=app.config["CONVERSION_RETRY_DELAY"] * job.attempts
+        )
+    else:
+        job.state = ConversionJob.FAILED
+
+    db.session.commit()
+
+
+def requeue_abandoned_jobs():
+    """Put jobs left running by a worker that has gone away back on the queue"""
+
+    requeued = ConversionJob.query.filter(
+        ConversionJob.state == ConversionJob.RUNNING
+    ).update(
+        {ConversionJob.state: ConversionJob.QUEUED, ConversionJob.worker: None},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return requeued
+
+
+def enqueue_unprocessed_talks():
+    """Queue every talk the filesystem says still needs converting"""
+
+    queued = []
+    for talk_id in sorted(find_unprocessed_talks()):
+        if db.session.get(Talk, int(talk_id)) is None:
+            continue
+
+        # A talk that has used up its retries waits for a new edit (which
+        # enqueues it directly) rather than failing again every scan
+        latest = (
+            ConversionJob.query.filter(ConversionJob.talk_id == int(talk_id))
+            .order_by(ConversionJob.id.desc())
+            .first()
+        )
+        if latest is not None and latest.state == ConversionJob.FAILED:
+            continue
+
+        queued.append(enqueue_conversion(talk_id).talk_id)
+    return queued
+
+
+def run_worker(process_talk, poll_interval=5, scan_interval=None, once=False):
+    """Claim and run jobs until stopped, or until the queue is empty if `once`"""
+
+    last_scan = None
+
+    while True:
+        if scan_interval and (last_scan is None or time.monotonic() - last_scan >= scan_interval):
+            enqueue_unprocessed_talks()
+            last_scan = time.monotonic()
+
+        job = claim_next_job()
+
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        print(f"Converting talk {job.talk_id} (attempt {job.attempts})")
+
+        try:
+            process_talk(job.talk_id)
+        except Exception as e:
+            db.session.rollback()
+            fail_job(job, e)
+            print(f"Talk {job.talk_id} failed: {e}")
+        else:
+            complete_job(job)
+            print(f"Talk {job.talk_id} converted")
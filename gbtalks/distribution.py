@@ -0,0 +1,150 @@
+"""Publishing processed MP3s to the web and USB gold directories.
+
+There is one processed MP3 per talk. The web copy (gbXX-XXXmp3.mp3 in
+WEB_MP3_DIR) and the USB gold copy (the same name in USB_GOLD_DIR) are hard
+links to it where possible, reflinks where the filesystem can share blocks but
+not inodes, and full copies only when they are on another device.
+
+Each copy is recorded in the published_files table. Republishing a talk, after
+a retag say, only touches copies that have gone stale: a hard link already has
+the new tags, so nothing is done for it at all.
+"""
+
+import errno
+import fcntl
+import os
+import shutil
+from datetime import datetime
+
+from flask import current_app as app
+
+from .libgbtalks import find_processed_files, get_path_for_file
+from .models import PublishedFile, db
+
+# ioctl from linux/fs.h that makes one file share another's blocks
+FICLONE = 0x40049409
+
+DESTINATIONS = ("web", "usb_gold")
+
+
+def destination_path(talk_id, destination):
+    web_path = get_path_for_file(talk_id, "web_mp3")
+
+    if destination == "web":
+        return web_path
+    if destination == "usb_gold":
+        return os.path.join(app.config["USB_GOLD_DIR"], os.path.basename(web_path))
+    raise ValueError(f"Unknown destination {destination!r}")
+
+
+def _reflink(source, destination):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            os.remove(destination)
+            raise
+
+
+def place_file(source, destination):
+    """Put a hard link, reflink or copy of `source` at `destination`.
+
+    The new file is put in place with an atomic rename, so anyone reading
+    `destination` sees either the old file or the new one. Returns the method
+    used.
+    """
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return "hardlink"
+
+    partial_path = f"{destination}.{os.getpid()}.partial"
+    try:
+        try:
+            os.link(source, partial_path)
+            method = "hardlink"
+        except OSError:
+            try:
+                _reflink(source, partial_path)
+                method = "reflink"
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL):
+                    raise
+                shutil.copy2(source, partial_path)
+                method = "copy"
+
+        os.replace(partial_path, destination)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    return method
+
+
+def _is_current(published, source):
+    if not os.path.exists(published.path):
+        return False
+
+    if published.method == "hardlink":
+        return os.path.samefile(source, published.path)
+
+    stat = os.stat(source)
+    return (published.source_size, published.source_mtime_ns) == (
+        stat.st_size,
+        stat.st_mtime_ns,
+    )
+
+
+def publish_talk(talk_id, processed_path, destinations=DESTINATIONS):
+    """Make every destination's copy of a talk match its processed MP3.
+
+    Returns {destination: method} for the copies that had to be (re)made.
+    """
+    talk_id = int(talk_id)
+    changed = {}
+
+    for destination in destinations:
+        path = destination_path(talk_id, destination)
+        published = db.session.get(PublishedFile, (talk_id, destination))
+
+        if published is None or published.path != path or not _is_current(published, processed_path):
+            published = published or PublishedFile(talk_id=talk_id, destination=destination)
+            published.path = path
+            published.method = place_file(processed_path, path)
+            published.published_at = datetime.now()
+            changed[destination] = published.method
+
+        stat = os.stat(processed_path)
+        published.source_path = processed_path
+        published.source_size = stat.st_size
+        published.source_mtime_ns = stat.st_mtime_ns
+        db.session.add(published)
+
+    db.session.commit()
+    return changed
+
+
+def publish_processed_talks(talk_ids=None):
+    """Publish every processed talk, or those in `talk_ids`.
+
+    Returns {talk_id: changes} for the talks that needed anything doing.
+    """
+    if talk_ids is None:
+        prefix = "GB" + app.config["GB_SHORT_YEAR"] + "_"
+        talk_ids = sorted(
+            {
+                int(entry.name.split("_")[1])
+                for entry in os.scandir(app.config["PROCESSED_DIR"])
+                if entry.name.startswith(prefix) and entry.name.endswith(".mp3")
+            }
+        )
+
+    published = {}
+    for talk_id in talk_ids:
+        processed = find_processed_files(talk_id)
+        if not processed:
+            continue
+
+        changed = publish_talk(talk_id, processed[0])
+        if changed:
+            published[talk_id] = changed
+
+    return published
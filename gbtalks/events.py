@@ -0,0 +1,151 @@
+"""Progress events from background work, streamed to browsers over SSE.
+
+Uploads, chunked upload sessions and video audio extraction publish what they
+are doing here, and /events sends it on to every page that is listening:
+
+    publish("chunk", session_id="abc", talk_id=7, chunks_received=3, total_chunks=8)
+
+arrives in the browser as
+
+    id: 42
+    event: chunk
+    data: {"session_id": "abc", "talk_id": 7, "chunks_received": 3, "total_chunks": 8}
+
+The bus lives in the web server process, which is where all of this work runs.
+It keeps the last EVENT_HISTORY events, so a browser that reconnects with
+Last-Event-ID catches up on whatever it missed.
+
+Each open stream holds one of uWSGI's threads, which uploads need too, so only
+SSE_MAX_STREAMS are streamed at once. Past that, /events sends whatever is
+waiting and closes, telling the browser to come back in POLL_INTERVAL seconds:
+EventSource reconnects by itself, so those pages poll instead.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+EVENT_HISTORY = 500
+
+# Seconds between keepalive comments, so proxies don't time the stream out
+HEARTBEAT_INTERVAL = 15
+
+# Streams end after this long, and the browser reconnects; this frees the
+# server thread of any client that went away without closing the connection
+STREAM_LIFETIME = 300
+
+# Seconds between polls for browsers turned away from streaming
+POLL_INTERVAL = 10
+
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+
+class EventBus:
+    """A thread-safe log of recent events that subscribers can wait on."""
+
+    def __init__(self, history=EVENT_HISTORY):
+        self._events = deque(maxlen=history)
+        self._last_id = 0
+        self._condition = threading.Condition()
+
+    def publish(self, event_type, **data):
+        """Record an event and wake every subscriber; returns its id"""
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, event_type, data))
+            self._condition.notify_all()
+            return self._last_id
+
+    @property
+    def last_id(self):
+        with self._condition:
+            return self._last_id
+
+    def events_after(self, event_id, timeout=None):
+        """Events with ids after `event_id`, waiting up to `timeout` for one"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._last_id > event_id, timeout=timeout)
+            return [event for event in self._events if event[0] > event_id]
+
+
+bus = EventBus()
+
+
+def publish(event_type, **data):
+    return bus.publish(event_type, **data)
+
+
+def format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def _start_after(last_event_id):
+    # An id from before the server restarted means nothing now
+    if last_event_id is None or last_event_id > bus.last_id:
+        return bus.last_id
+    return last_event_id
+
+
+def event_stream(last_event_id=None, lifetime=None, heartbeat=None):
+    """Server-Sent Events text for everything published after `last_event_id`.
+
+    Without one, the stream starts from now.
+    """
+    lifetime = STREAM_LIFETIME if lifetime is None else lifetime
+    heartbeat = HEARTBEAT_INTERVAL if heartbeat is None else heartbeat
+
+    event_id = _start_after(last_event_id)
+    ends_at = time.monotonic() + lifetime
+
+    # Tell the browser how soon to reconnect when the stream ends
+    yield "retry: 2000\n\n"
+
+    while (remaining := ends_at - time.monotonic()) > 0:
+        events = bus.events_after(event_id, timeout=min(heartbeat, remaining))
+
+        if not events:
+            yield ": keepalive\n\n"
+            continue
+
+        for event in events:
+            event_id = event[0]
+            yield format_event(*event)
+
+
+def poll_events(last_event_id=None):
+    """The events waiting after `last_event_id`, all at once, for a browser to
+    come back for in POLL_INTERVAL seconds"""
+    event_id = _start_after(last_event_id)
+
+    yield f"retry: {POLL_INTERVAL * 1000}\n\n"
+
+    for event in bus.events_after(event_id, timeout=0):
+        event_id = event[0]
+        yield format_event(*event)
+
+    # Sets Last-Event-ID for the next poll even if nothing was sent
+    yield f"id: {event_id}\n\n"
+
+
+def capped_event_stream(last_event_id, max_streams):
+    """event_stream() if fewer than `max_streams` are open, or else poll_events()"""
+    global _open_streams
+
+    # Counted once the response starts, so it's always uncounted by the
+    # finally below when the response is closed
+    with _open_streams_lock:
+        streaming = _open_streams < max_streams
+        if streaming:
+            _open_streams += 1
+
+    if not streaming:
+        yield from poll_events(last_event_id)
+        return
+
+    try:
+        yield from event_stream(last_event_id)
+    finally:
+        with _open_streams_lock:
+            _open_streams -= 1
@@ -0,0 +1,176 @@
+"""Which files each talk has, without scanning directories on every page load.
+
+The front desk and editing pages need to know, for every talk, whether its
+raw, edited and processed MP3s, video and recorder notes photo exist:
+
+    raw, edited, video  UPLOAD_DIR/gb26-007_RAW.mp3, _EDITED.mp3, _VIDEO.mp4
+    processed           PROCESSED_DIR/GB26_007_<title>_<speaker>.mp3
+    notes               IMG_DIR/gb26-7recorder_notes.jpg
+
+They used to scan UPLOAD_DIR each time. Instead this process keeps the answer.
+Uploads tell it about each file as it's recorded (note_file). Anything else,
+such as the conversion workers or a file copied in by hand, changes the mtime
+of the directory it lands in. Each read stats the three directories, and only
+a directory whose mtime changed is scanned again.
+
+Every change to a talk's files bumps a version number and is published as a
+"files" event. A page that has seen version N can ask for only the talks that
+changed since then (changes_since), which /file_state serves. Versions are
+"<epoch>-<N>", the epoch made up afresh by each process, as a version from
+before a restart, or from another uWSGI worker, says nothing about this
+process's changes; a page that sends one gets every talk.
+"""
+
+import os
+import re
+import threading
+import time
+import uuid
+
+from flask import current_app as app
+
+from .events import publish
+
+# An mtime this close to when we scanned might hide a change made in the same
+# clock tick, so the directory is scanned again on the next read
+SETTLE_NS = 1_000_000_000
+
+
+def _locations():
+    """{directory: [(pattern, kind), ...]}, each pattern capturing the talk id"""
+    year = re.escape(app.config["GB_SHORT_YEAR"])
+    locations = {}
+
+    for directory, pattern, kind in (
+        (app.config["UPLOAD_DIR"], rf"gb{year}-(\d+)_RAW\.mp3", "raw"),
+        (app.config["UPLOAD_DIR"], rf"gb{year}-(\d+)_EDITED\.mp3", "edited"),
+        (app.config["UPLOAD_DIR"], rf"gb{year}-(\d+)_VIDEO\.\w+", "video"),
+        (app.config["PROCESSED_DIR"], rf"GB{year}_(\d+)_.*\.mp3", "processed"),
+        (app.config["IMG_DIR"], rf"gb{year}-(\d+)recorder_notes\.jpg", "notes"),
+    ):
+        locations.setdefault(os.path.realpath(directory), []).append((re.compile(pattern), kind))
+
+    return locations
+
+
+def _classify(name, patterns):
+    for pattern, kind in patterns:
+        match = pattern.fullmatch(name)
+        if match:
+            return int(match.group(1)), kind
+    return None
+
+
+class FileStateCache:
+    """Each talk's files, rescanning only the directories that have changed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # directory -> (mtime_ns, settled, {talk_id: {kind, ...}})
+        self._directories = {}
+        self._talks = {}
+        self._changed_at = {}  # talk_id -> version
+        self._version = 0
+        self._epoch = uuid.uuid4().hex[:8]
+
+    def _stamp(self, version):
+        return f"{self._epoch}-{version}"
+
+    def _scan(self, directory, patterns):
+        """(mtime_ns, settled, files) for a directory, reusing the last scan if unchanged"""
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return None, True, {}
+
+        previous = self._directories.get(directory)
+        if previous is not None and previous[0] == mtime_ns and previous[1]:
+            return previous
+
+        scanned_at = time.time_ns()
+        files = {}
+        for entry in os.scandir(directory):
+            found = _classify(entry.name, patterns)
+            if found is not None:
+                files.setdefault(found[0], set()).add(found[1])
+
+        return mtime_ns, scanned_at - mtime_ns > SETTLE_NS, files
+
+    def _update(self, talks):
+        """Replace the talks' files, bumping the version for each that changed"""
+        for talk_id in set(self._talks) | set(talks):
+            kinds = talks.get(talk_id, frozenset())
+            if kinds == self._talks.get(talk_id, frozenset()):
+                continue
+
+            self._version += 1
+            self._changed_at[talk_id] = self._version
+            publish("files", talk_id=talk_id, files=sorted(kinds), version=self._stamp(self._version))
+
+        self._talks = {talk_id: kinds for talk_id, kinds in talks.items() if kinds}
+
+    def refresh(self):
+        """Catch up with any directory that changed since it was last read"""
+        with self._lock:
+            talks = {}
+            for directory, patterns in _locations().items():
+                self._directories[directory] = snapshot = self._scan(directory, patterns)
+                for talk_id, kinds in snapshot[2].items():
+                    talks[talk_id] = talks.get(talk_id, frozenset()) | kinds
+
+            self._update(talks)
+
+    def note_file(self, path):
+        """Record a file that's just been put in place, without waiting for a rescan"""
+        directory, name = os.path.split(os.path.realpath(path))
+
+        with self._lock:
+            found = _classify(name, _locations().get(directory, []))
+            if found is None:
+                return
+
+            talk_id, kind = found
+            talks = dict(self._talks)
+            talks[talk_id] = talks.get(talk_id, frozenset()) | {kind}
+            self._update(talks)
+
+    def talk_files(self):
+        """{talk_id: frozenset of kinds} for every talk with any files"""
+        self.refresh()
+        with self._lock:
+            return dict(self._talks)
+
+    def changes_since(self, version=None):
+        """(current version, {talk_id: sorted kinds}) for talks changed after `version`
+
+        Without a version, or with one this process didn't give out, every
+        talk with files. A talk whose files have all gone is included with none.
+        """
+        self.refresh()
+        with self._lock:
+            epoch, _, number = (version or "").partition("-")
+            if epoch != self._epoch or not number.isdigit() or int(number) > self._version:
+                talks = {talk_id: sorted(kinds) for talk_id, kinds in self._talks.items()}
+            else:
+                talks = {
+                    talk_id: sorted(self._talks.get(talk_id, ()))
+                    for talk_id, changed_at in self._changed_at.items()
+                    if changed_at > int(number)
+                }
+            return self._stamp(self._version), talks
+
+
+cache = FileStateCache()
+
+
+def talks_with(kind):
+    """The ids of talks that have a `kind` file"""
+    return {talk_id for talk_id, kinds in cache.talk_files().items() if kind in kinds}
+
+
+def note_file(path):
+    cache.note_file(path)
+
+
+def changes_since(version=None):
+    return cache.changes_since(version)
@@ -1,4 +1,7 @@
+import hashlib
+import os
 import subprocess
+import time
 from datetime import datetime, timedelta
 
 from flask import current_app as app
@@ -87,6 +90,23 @@ def get_path_for_file(talk_id, file_type, title=None, speaker=None):
     return path
 
 
+def find_processed_files(talk_id):
+    """Processed MP3s on disk for a talk, newest first, whatever their title"""
+    prefix = "GB" + app.config["GB_SHORT_YEAR"] + "_" + str(talk_id).zfill(3) + "_"
+    directory = app.config["TALKS_DIRS"]["processed"]["directory"]
+
+    if not os.path.isdir(directory):
+        return []
+
+    matches = [
+        entry
+        for entry in os.scandir(directory)
+        if entry.name.startswith(prefix) and entry.name.endswith(".mp3")
+    ]
+    matches.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [entry.path for entry in matches]
+
+
 def get_path_for_video_file(talk_id, file_extension):
     """Get the path for storing video files"""
     path = (
@@ -102,80 +122,92 @@ def get_path_for_video_file(talk_id, file_extension):
 
 
 def extract_audio_from_video(video_path, audio_output_path):
-    """Extract high-quality audio from video file using ffmpeg"""
-    try:
-        # Use ffmpeg to extract audio at high quality
-        cmd = [
-            '/usr/bin/ffmpeg',
-            '-i', video_path,
-            '-vn',  # No video
-            '-acodec', 'libmp3lame',  # MP3 codec
-            '-ab', '320k',  # High bitrate
-            '-ar', '44100',  # 44.1kHz sample rate
-            '-y',  # Overwrite output file
-            audio_output_path
-        ]
-
-        result = subprocess.run(cmd, capture_output=True, text=True)
+    """Extract the audio from a video file into an MP3 using ffmpeg
 
-        if result.returncode == 0:
-            return True, "Audio extracted successfully"
-        else:
-            return False, f"FFmpeg error: {result.stderr}"
+    The audio is copied out as it is if it's already MP3, and encoded
+    otherwise, AAC included; see gbtalks.audio.extraction_command. Returns
+    (success, message, extraction), where extraction records which was done
+    and how long it took.
+    """
+    from .audio import extraction_command, probe_audio
+    from .metrics import AUDIO_EXTRACTION_SECONDS
+
+    stream = probe_audio(video_path)
+    method, cmd = extraction_command(video_path, audio_output_path, stream)
+    extraction = {
+        "method": method,
+        "codec": stream.get("codec_name") if stream else None,
+        "duration": float(stream["duration"]) if stream and stream.get("duration") else None,
+    }
 
+    started = time.monotonic()
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
     except FileNotFoundError:
-        return False, "FFmpeg not found. Please install ffmpeg."
+        return False, "FFmpeg not found. Please install ffmpeg.", extraction
     except Exception as e:
-        return False, f"Error extracting audio: {str(e)}"
+        return False, f"Error extracting audio: {str(e)}", extraction
+    finally:
+        extraction["seconds"] = round(time.monotonic() - started, 3)
 
+    if result.returncode != 0:
+        return False, f"FFmpeg error: {result.stderr}", extraction
 
-def extract_audio_from_video_async(video_path, audio_output_path):
-    """Start background audio extraction from video file using ffmpeg"""
-    import threading
+    AUDIO_EXTRACTION_SECONDS.observe(extraction["seconds"], method=method)
 
-    # Create a status file to track progress
-    status_file = audio_output_path + ".status"
+    if method == "copy":
+        message = f"Audio copied from the video in {extraction['seconds']:.1f}s"
+    else:
+        message = f"Audio encoded from the video's {extraction['codec'] or 'unknown'} track in {extraction['seconds']:.1f}s"
+    return True, message, extraction
 
-    def background_extraction():
-        try:
-            # Write status: processing
-            with open(status_file, 'w') as f:
-                f.write("processing")
-
-            # Use ffmpeg to extract audio at high quality
-            cmd = [
-                '/usr/bin/ffmpeg',
-                '-i', video_path,
-                '-vn',  # No video
-                '-acodec', 'libmp3lame',  # MP3 codec
-                '-ab', '320k',  # High bitrate
-                '-ar', '44100',  # 44.1kHz sample rate
-                '-y',  # Overwrite output file
-                audio_output_path
-            ]
-
-            result = subprocess.run(cmd, capture_output=True, text=True)
-
-            if result.returncode == 0:
-                # Write status: success
-                with open(status_file, 'w') as f:
-                    f.write("success")
-            else:
-                # Write status: error with message
-                with open(status_file, 'w') as f:
-                    f.write(f"error: FFmpeg error: {result.stderr}")
-
-        except FileNotFoundError:
-            with open(status_file, 'w') as f:
-                f.write("error: FFmpeg not found. Please install ffmpeg.")
-        except Exception as e:
-            with open(status_file, 'w') as f:
-                f.write(f"error: Error extracting audio: {str(e)}")
-
-    # Start background thread
-    thread = threading.Thread(target=background_extraction)
-    thread.daemon = True
-    thread.start()
+
+def _set_video_processing_status(audio_output_path, status, talk_id=None, **details):
+    """Record how extraction is going in a status file next to the audio,
+    and publish it as a "video" event for talk_id"""
+    from .events import publish
+
+    with open(audio_output_path + ".status", 'w') as f:
+        f.write(status)
+
+    state, _, message = status.partition(":")
+    publish("video", talk_id=talk_id, status=state, message=message.strip(), **details)
+
+
+def run_audio_extraction(video_path, audio_output_path, talk_id=None):
+    """Extract the audio from a video, recording how it went; run as a media job"""
+    _set_video_processing_status(audio_output_path, "processing", talk_id)
+
+    success, message, extraction = extract_audio_from_video(video_path, audio_output_path)
+
+    if not success:
+        _set_video_processing_status(audio_output_path, f"error: {message}", talk_id, **extraction)
+        raise RuntimeError(message)
+
+    app.logger.info(f"Extracted audio for talk {talk_id} from {video_path}: {message}")
+    _set_video_processing_status(audio_output_path, "success", talk_id, **extraction)
+
+    # Kept with the job, to see how long extraction takes and how often it can copy
+    return extraction
+
+
+def extract_audio_from_video_async(video_path, audio_output_path, talk_id=None):
+    """Queue audio extraction from a video file, to run in the background
+
+    Extractions are run one or two at a time by gbtalks.media_jobs; until then
+    the talk's status is "queued", with its place in the queue.
+    """
+    from .media_jobs import EXTRACT_AUDIO, queue_position, submit
+
+    job = submit(
+        EXTRACT_AUDIO,
+        talk_id,
+        video_path=video_path,
+        audio_output_path=audio_output_path,
+    )
+    _set_video_processing_status(
+        audio_output_path, "queued", talk_id, position=queue_position(job)
+    )
 
     return True, "Audio extraction started in background"
 
@@ -193,7 +225,9 @@ def get_video_processing_status(audio_output_path):
         with open(status_file) as f:
             status_content = f.read().strip()
 
-        if status_content == "processing":
+        if status_content == "queued":
+            return "queued", "Waiting for audio extraction"
+        elif status_content == "processing":
             return "processing", "Audio extraction in progress"
         elif status_content == "success":
             # Clean up status file
@@ -210,6 +244,15 @@ def get_video_processing_status(audio_output_path):
         return "error", f"Error reading status: {str(e)}"
 
 
+def file_sha256(path, block_size=1024 * 1024):
+    """Hash a file's contents without reading it all into memory"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def get_cd_dir_for_talk(talk_id):
     """Get the CD directory path for a talk"""
     return (
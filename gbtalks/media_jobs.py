@@ -0,0 +1,245 @@
+"""Background media work done by the web server.
+
+Uploads hand off their slow parts as MediaJobs: finishing a chunked upload
+(hashing and moving it into place), and extracting the audio from an uploaded
+video with ffmpeg. They are run by a small pool of threads in the web server
+rather than a thread each, so however many cameras upload at once:
+
+- at most MEDIA_JOB_WORKERS jobs run at a time, and at most
+  MEDIA_EXTRACT_CONCURRENCY of those are ffmpeg extractions, which leaves a
+  thread for the quick jobs and leaves the CPU to the conversion workers;
+- jobs are taken in priority order (finishing uploads first), then oldest
+  first, and anything waiting can be told its place in the queue;
+- jobs are database rows, so those interrupted by the server restarting are
+  queued again when it starts back up, rather than being lost.
+
+Every change of state is published as a "media_job" event (see events.py).
+The pool starts with the first request the server handles; with
+MEDIA_JOB_WORKERS set to 0 nothing runs in the background, and jobs can be run
+with run_pending_media_jobs() instead. Whatever a handler returns is kept as
+the job's result, such as how an extraction was done and how long it took.
+"""
+
+import json
+import threading
+from datetime import datetime
+
+from flask import current_app as app
+from sqlalchemy import func, select, update
+
+from .events import publish
+from .metrics import MEDIA_JOB_RUN_SECONDS, MEDIA_JOB_WAIT_SECONDS
+from .models import MediaJob, db
+
+FINISH_UPLOAD = "finish_upload"
+EXTRACT_AUDIO = "extract_audio"
+
+# Lower runs first
+PRIORITIES = {FINISH_UPLOAD: 0, EXTRACT_AUDIO: 10}
+
+# How often idle workers look for jobs queued by another process, seconds
+POLL_INTERVAL = 30
+
+_claim_lock = threading.Lock()
+_wakeup = threading.Event()
+_started = False
+_start_lock = threading.Lock()
+
+
+def _handlers():
+    # Imported here as both modules queue jobs themselves
+    from .libgbtalks import run_audio_extraction
+    from .uploads import finish_chunked_upload
+
+    return {
+        FINISH_UPLOAD: finish_chunked_upload,
+        EXTRACT_AUDIO: run_audio_extraction,
+    }
+
+
+def _kind_limits():
+    return {EXTRACT_AUDIO: app.config["MEDIA_EXTRACT_CONCURRENCY"]}
+
+
+def queue_position(job):
+    """1 for the next job to run, 2 for the one after, ...; None unless queued"""
+    if job.state != MediaJob.QUEUED:
+        return None
+
+    ahead = MediaJob.query.filter(
+        MediaJob.state == MediaJob.QUEUED,
+        (MediaJob.priority < job.priority)
+        | ((MediaJob.priority == job.priority) & (MediaJob.id < job.id)),
+    ).count()
+    return ahead + 1
+
+
+def _publish(job):
+    publish(
+        "media_job",
+        job_id=job.id,
+        kind=job.kind,
+        talk_id=job.talk_id,
+        session_id=job.arguments.get("upload_session_id"),
+        state=job.state,
+        position=queue_position(job),
+        error=job.error,
+    )
+
+
+def _publish_queue():
+    """Tell everyone waiting where they now are in the queue"""
+    for job in MediaJob.query.filter_by(state=MediaJob.QUEUED).order_by(
+        MediaJob.priority, MediaJob.id
+    ):
+        _publish(job)
+
+
+def submit(kind, talk_id=None, **arguments):
+    """Queue a job, to be run by the handler for `kind` with talk_id and `arguments`"""
+    job = MediaJob(
+        kind=kind,
+        talk_id=int(talk_id) if talk_id is not None else None,
+        args=json.dumps(arguments),
+        priority=PRIORITIES.get(kind, 100),
+        state=MediaJob.QUEUED,
+        queued_at=datetime.now(),
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    _publish(job)
+    _wakeup.set()
+    return job
+
+
+def latest_job(kind, talk_id):
+    return (
+        MediaJob.query.filter_by(kind=kind, talk_id=int(talk_id))
+        .order_by(MediaJob.id.desc())
+        .first()
+    )
+
+
+def claim_next_media_job():
+    """Mark the next job that may run now as running, and return it, or None"""
+    with _claim_lock:
+        running = dict(
+            db.session.execute(
+                select(MediaJob.kind, func.count())
+                .where(MediaJob.state == MediaJob.RUNNING)
+                .group_by(MediaJob.kind)
+            ).all()
+        )
+        full = [kind for kind, limit in _kind_limits().items() if running.get(kind, 0) >= limit]
+
+        job_id = db.session.execute(
+            select(MediaJob.id)
+            .where(MediaJob.state == MediaJob.QUEUED, MediaJob.kind.notin_(full))
+            .order_by(MediaJob.priority, MediaJob.id)
+            .limit(1)
+        ).scalar()
+
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        claimed = db.session.execute(
+            update(MediaJob)
+            .where(MediaJob.id == job_id, MediaJob.state == MediaJob.QUEUED)
+            .values(state=MediaJob.RUNNING, started_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+
+    if not claimed:
+        return None
+
+    job = db.session.get(MediaJob, job_id)
+    db.session.refresh(job)
+    return job
+
+
+def run_media_job(job):
+    """Run a claimed job, recording how it went"""
+    _publish(job)
+    _publish_queue()
+
+    if job.queued_at and job.started_at:
+        MEDIA_JOB_WAIT_SECONDS.observe((job.started_at - job.queued_at).total_seconds(), kind=job.kind)
+
+    try:
+        outcome = _handlers()[job.kind](talk_id=job.talk_id, **job.arguments)
+        job.result = json.dumps(outcome) if outcome is not None else None
+        job.state = MediaJob.DONE
+    except Exception as e:
+        app.logger.exception("Media job %s (%s) failed", job.id, job.kind)
+        db.session.rollback()
+        job.state = MediaJob.FAILED
+        job.error = str(e)
+
+    job.finished_at = datetime.now()
+    db.session.commit()
+    _publish(job)
+
+    MEDIA_JOB_RUN_SECONDS.observe((job.finished_at - job.started_at).total_seconds(), kind=job.kind)
+
+
+def run_pending_media_jobs():
+    """Run queued jobs in this thread until there are none; returns how many ran"""
+    ran = 0
+    while (job := claim_next_media_job()) is not None:
+        run_media_job(job)
+        ran += 1
+    return ran
+
+
+def requeue_interrupted_media_jobs():
+    """Queue again the jobs that were running when the server last stopped"""
+    requeued = db.session.execute(
+        update(MediaJob)
+        .where(MediaJob.state == MediaJob.RUNNING)
+        .values(state=MediaJob.QUEUED, started_at=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return requeued
+
+
+def _worker(flask_app):
+    with flask_app.app_context():
+        while True:
+            try:
+                run_pending_media_jobs()
+            except Exception:
+                flask_app.logger.exception("Media job worker error")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def start_media_jobs(flask_app):
+    """Start the worker threads, once per process, after requeueing lost jobs"""
+    global _started
+
+    workers = flask_app.config["MEDIA_JOB_WORKERS"]
+    if workers <= 0:
+        return
+
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+
+        with flask_app.app_context():
+            requeued = requeue_interrupted_media_jobs()
+            if requeued:
+                flask_app.logger.info(f"Requeued {requeued} interrupted media job(s)")
+
+        for number in range(workers):
+            threading.Thread(
+                target=_worker, args=(flask_app,), name=f"media-job-{number}", daemon=True
+            ).start()
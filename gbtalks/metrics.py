@@ -0,0 +1,281 @@
+"""Timings and byte counts for uploads and media work.
+
+On the day, a slow upload could be the venue wifi, the disk or the CPU. These
+measurements tell them apart:
+
+    network     how long each chunk's data took to arrive, and each upload's
+                average speed
+    disk        how long each chunk, or each streamed upload, took to write
+    CPU         how long finishing an upload (hashing it) and extracting audio
+                with ffmpeg took, and how long media jobs waited to start
+
+They are kept in memory by the web server process, which is where all of this
+work is done. /metrics serves them in Prometheus' text format, and /health
+summarises them. Each histogram also keeps its last RECENT observations, for
+the medians and 95th percentiles on /health.
+
+There's no Prometheus client library here; counters and histograms are all
+we need.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Upper bounds of histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)  # seconds
+THROUGHPUT_BUCKETS = tuple(2**power for power in range(16, 30, 2))  # bytes per second, 64K-256M
+
+# Observations kept for each histogram's summary on /health
+RECENT = 100
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, not {tuple(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    """A total that only goes up, such as bytes received."""
+
+    type = "counter"
+
+    def __init__(self, name, description, labels=(), unit=None):
+        super().__init__(name, description, labels)
+        self.unit = unit
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def totals(self):
+        """[(labels, value), ...] for every set of labels counted"""
+        with self._lock:
+            return [
+                (", ".join(f"{name}={value}" for name, value in key), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}"]
+
+
+class _Observations:
+    def __init__(self, buckets):
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT)
+
+
+class Histogram(Metric):
+    """How long things took, or how fast they went, counted into buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DURATION_BUCKETS, unit="seconds"):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.unit = unit
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            observations = self._values.get(key)
+            if observations is None:
+                observations = self._values[key] = _Observations(self.buckets)
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    observations.counts[index] += 1
+                    break
+            observations.count += 1
+            observations.sum += value
+            observations.recent.append(value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the `with` block takes"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, key, observations):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, observations.counts, strict=True):
+            cumulative += count
+            bucket_key = key + (("le", _format_value(bound)),)
+            lines.append(f"{self.name}_bucket{_format_labels(bucket_key)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(observations.sum)}")
+        lines.append(f"{self.name}_count{_format_labels(key)} {observations.count}")
+        return lines
+
+    def summary(self):
+        """[{labels, count, mean, median, p95, max}, ...]; median, p95 and max are of recent observations"""
+        rows = []
+        with self._lock:
+            for key, observations in sorted(self._values.items()):
+                recent = sorted(observations.recent)
+                rows.append(
+                    {
+                        "labels": ", ".join(f"{name}={value}" for name, value in key),
+                        "count": observations.count,
+                        "mean": observations.sum / observations.count,
+                        "median": recent[len(recent) // 2],
+                        "p95": recent[min(len(recent) - 1, math.ceil(len(recent) * 0.95) - 1)],
+                        "max": recent[-1],
+                    }
+                )
+        return rows
+
+
+UPLOAD_BYTES = Counter(
+    "gbtalks_upload_bytes_total", "Bytes of talk uploads received", ("method",), unit="bytes"
+)
+UPLOADS = Counter("gbtalks_uploads_total", "Talk uploads put in place", ("method",))
+UPLOAD_SECONDS = Histogram(
+    "gbtalks_upload_seconds", "Time from the start of each upload to its end", ("method",)
+)
+UPLOAD_SPEED = Histogram(
+    "gbtalks_upload_bytes_per_second",
+    "Average speed of each upload",
+    ("method",),
+    THROUGHPUT_BUCKETS,
+    unit="bytes/s",
+)
+UPLOAD_WRITE_SECONDS = Histogram(
+    "gbtalks_upload_write_seconds",
+    "Time spent writing each streamed upload to disk",
+    (),
+    LATENCY_BUCKETS + DURATION_BUCKETS[4:],
+)
+CHUNK_RECEIVE_SECONDS = Histogram(
+    "gbtalks_chunk_receive_seconds",
+    "Time spent waiting for each upload chunk's data to arrive",
+    (),
+    LATENCY_BUCKETS + DURATION_BUCKETS[4:],
+)
+CHUNK_WRITE_SECONDS = Histogram(
+    "gbtalks_chunk_write_seconds", "Time spent writing each upload chunk to disk", (), LATENCY_BUCKETS
+)
+UPLOAD_VERIFY_SECONDS = Histogram(
+    "gbtalks_upload_verify_seconds", "Time to hash a chunked upload and move it into place"
+)
+AUDIO_EXTRACTION_SECONDS = Histogram(
+    "gbtalks_audio_extraction_seconds", "ffmpeg time extracting audio from a video", ("method",)
+)
+MEDIA_JOB_WAIT_SECONDS = Histogram(
+    "gbtalks_media_job_wait_seconds", "Time media jobs spent queued before running", ("kind",)
+)
+MEDIA_JOB_RUN_SECONDS = Histogram(
+    "gbtalks_media_job_run_seconds", "Time media jobs spent running", ("kind",)
+)
+
+
+def render():
+    """Every metric, in Prometheus' text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _humanise(value, unit):
+    if unit is None:
+        return str(value)
+
+    if unit == "bytes":
+        for scale, suffix in ((1024**3, "GB"), (1024**2, "MB"), (1024, "KB")):
+            if value >= scale:
+                return f"{value / scale:.1f} {suffix}"
+        return f"{value} bytes"
+
+    if unit == "bytes/s":
+        for scale, suffix in ((1024**2, "MB/s"), (1024, "KB/s")):
+            if value >= scale:
+                return f"{value / scale:.1f} {suffix}"
+        return f"{value:.0f} B/s"
+
+    if value < 1:
+        return f"{value * 1000:.0f} ms"
+    if value < 120:
+        return f"{value:.1f} s"
+    return f"{value / 60:.1f} min"
+
+
+def summary():
+    """What /health shows: a row for each histogram and set of labels observed"""
+    rows = []
+    for metric in REGISTRY:
+        if not isinstance(metric, Histogram):
+            continue
+
+        for row in metric.summary():
+            for field in ("mean", "median", "p95", "max"):
+                row[field] = _humanise(row[field], metric.unit)
+            rows.append({"name": metric.name, "description": metric.description, **row})
+
+    totals = [
+        {
+            "name": counter.name,
+            "description": counter.description,
+            "labels": labels,
+            "value": _humanise(value, counter.unit),
+        }
+        for counter in REGISTRY
+        if isinstance(counter, Counter)
+        for labels, value in counter.totals()
+    ]
+    return {"timings": rows, "totals": totals}
@@ -1,3 +1,6 @@
+import json
+from datetime import datetime
+
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
 from flask_login import LoginManager, UserMixin
 
@@ -54,6 +57,7 @@ class Recorder(db.Model):
     max_shifts_per_day = db.Column(db.Integer)
     earliest_start_time = db.Column(db.Time, nullable=True)
     latest_end_time = db.Column(db.Time, nullable=True)
+    has_dropped_out = db.Column(db.Boolean, default=False)
 
     talks = db.relationship("Talk", backref="recorded_by", order_by="Talk.start_time")
 
@@ -139,6 +143,234 @@ class RotaSettings(db.Model):
         return settings
 
 
+class LoudnessMeasurement(db.Model):
+    """loudnorm's analysis of a talk, so re-processing can skip that pass.
+
+    The analysis covers the whole of top + edited + tail, so it is keyed by the
+    edited file's content hash and by the decoded jingles it was measured with.
+    """
+
+    __tablename__ = "loudness_measurements"
+
+    content_hash = db.Column(db.String, primary_key=True)  # sha256 of the edited file
+    jingles = db.Column(db.String, primary_key=True)
+    talk_id = db.Column(db.Integer)
+
+    input_i = db.Column(db.Float)  # integrated loudness, LUFS
+    input_lra = db.Column(db.Float)  # loudness range, LU
+    input_tp = db.Column(db.Float)  # true peak, dBTP
+    input_thresh = db.Column(db.Float)  # gating threshold, LUFS
+    target_offset = db.Column(db.Float)
+
+    measured_at = db.Column(db.DateTime)
+
+    @staticmethod
+    def lookup(content_hash, jingles):
+        """Get the stored measurement for this audio, or None"""
+        return db.session.get(LoudnessMeasurement, (content_hash, jingles))
+
+    @staticmethod
+    def record(content_hash, jingles, talk_id, stats):
+        """Store loudnorm's statistics, replacing any earlier measurement"""
+        measurement = LoudnessMeasurement.lookup(content_hash, jingles) or LoudnessMeasurement(
+            content_hash=content_hash, jingles=jingles
+        )
+        measurement.talk_id = talk_id
+        for key in ("input_i", "input_lra", "input_tp", "input_thresh", "target_offset"):
+            setattr(measurement, key, float(stats[key]))
+        measurement.measured_at = datetime.now()
+
+        db.session.add(measurement)
+        db.session.commit()
+        return measurement
+
+    def as_loudnorm_stats(self):
+        """The measurement in the form loudnorm's second pass takes"""
+        return {
+            "input_i": self.input_i,
+            "input_lra": self.input_lra,
+            "input_tp": self.input_tp,
+            "input_thresh": self.input_thresh,
+            "target_offset": self.target_offset,
+        }
+
+
+class ConversionJob(db.Model):
+    """A request to run process_talk for a talk, claimed by conversion-worker."""
+
+    __tablename__ = "conversion_jobs"
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id = db.Column(db.Integer, primary_key=True)
+    talk_id = db.Column(db.Integer, index=True, nullable=False)
+    state = db.Column(db.String, index=True, nullable=False, default=QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    duration = db.Column(db.Float)  # seconds of edited audio, for shortest-first
+
+    queued_at = db.Column(db.DateTime)
+    not_before = db.Column(db.DateTime)  # retries wait until then
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    worker = db.Column(db.String)  # hostname:pid of the process running it
+    error = db.Column(db.String)
+
+    def __repr__(self):
+        return (
+            f"<ConversionJob(id='{self.id}', talk_id='{self.talk_id}', "
+            f"state='{self.state}', attempts='{self.attempts}')>"
+        )
+
+
+class PublishedFile(db.Model):
+    """Where a talk's processed MP3 has been published, and how.
+
+    Hard links share the processed file's inode, so retagging updates them for
+    free; reflinks and copies are only current while the processed file's size
+    and modification time match those recorded here.
+    """
+
+    __tablename__ = "published_files"
+
+    talk_id = db.Column(db.Integer, primary_key=True)
+    destination = db.Column(db.String, primary_key=True)  # "web" or "usb_gold"
+    path = db.Column(db.String, nullable=False)
+    method = db.Column(db.String, nullable=False)  # "hardlink", "reflink" or "copy"
+
+    source_path = db.Column(db.String)
+    source_size = db.Column(db.Integer)
+    source_mtime_ns = db.Column(db.Integer)
+    published_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return (
+            f"<PublishedFile(talk_id='{self.talk_id}', destination='{self.destination}', "
+            f"method='{self.method}')>"
+        )
+
+
+class UploadedFile(db.Model):
+    """A file uploaded into UPLOAD_DIR, with the hash of its contents.
+
+    Used to spot the same recording being uploaded twice.
+    """
+
+    __tablename__ = "uploaded_files"
+
+    path = db.Column(db.String, primary_key=True)
+    talk_id = db.Column(db.Integer, index=True)
+    file_type = db.Column(db.String)  # "raw", "edited", ...
+    size = db.Column(db.Integer)
+    mtime = db.Column(db.Float)  # st_mtime when hashed, to spot replaced files
+    sha256 = db.Column(db.String, index=True, nullable=False)
+    uploaded_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return (
+            f"<UploadedFile(path='{self.path}', talk_id='{self.talk_id}', "
+            f"file_type='{self.file_type}')>"
+        )
+
+
+class UploadSession(db.Model):
+    """A chunked upload, from /init_chunked_upload until the file is in place.
+
+    Each chunk that arrives is a row in upload_chunks, and chunks_received is
+    only bumped when that row is new, so chunks can be recorded by concurrent
+    requests without losing any.
+
+    The id is derived from the talk, file type, size and the client's
+    fingerprint of the file, so starting the same upload again resumes it.
+    """
+
+    __tablename__ = "upload_sessions"
+
+    UPLOADING = "uploading"
+    STARTING = "starting"
+    VERIFYING = "verifying"
+    SUCCESS = "success"
+    ERROR = "error"
+
+    # Still being uploaded or finished off, so worth warning the front desk about
+    ACTIVE = (UPLOADING, STARTING, VERIFYING)
+
+    id = db.Column(db.String, primary_key=True)
+    talk_id = db.Column(db.Integer, index=True, nullable=False)
+    file_type = db.Column(db.String, nullable=False)
+    file_name = db.Column(db.String)
+    file_extension = db.Column(db.String)
+    is_video = db.Column(db.Boolean, nullable=False, default=False)
+
+    file_size = db.Column(db.Integer, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    total_chunks = db.Column(db.Integer, nullable=False)
+    chunks_received = db.Column(db.Integer, nullable=False, default=0)
+
+    state = db.Column(db.String, index=True, nullable=False, default=UPLOADING)
+    error = db.Column(db.String)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, index=True)  # last chunk, for expiry
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return (
+            f"<UploadSession(id='{self.id}', talk_id='{self.talk_id}', state='{self.state}', "
+            f"chunks='{self.chunks_received}/{self.total_chunks}')>"
+        )
+
+
+class UploadChunk(db.Model):
+    """A chunk of an UploadSession that has been written to disk."""
+
+    __tablename__ = "upload_chunks"
+
+    session_id = db.Column(db.String, db.ForeignKey("upload_sessions.id"), primary_key=True)
+    chunk_number = db.Column(db.Integer, primary_key=True)
+    received_at = db.Column(db.DateTime)
+
+
+class MediaJob(db.Model):
+    """Background media work for the web server, run by gbtalks.media_jobs."""
+
+    __tablename__ = "media_jobs"
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String, nullable=False)  # "finish_upload", "extract_audio"
+    talk_id = db.Column(db.Integer, index=True)
+    args = db.Column(db.Text, nullable=False, default="{}")  # JSON keyword arguments
+    priority = db.Column(db.Integer, nullable=False, default=100)  # lower runs first
+    state = db.Column(db.String, index=True, nullable=False, default=QUEUED)
+
+    queued_at = db.Column(db.DateTime)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    error = db.Column(db.String)
+    result = db.Column(db.Text)  # JSON, whatever the handler returned
+
+    @property
+    def arguments(self):
+        return json.loads(self.args or "{}")
+
+    @property
+    def outcome(self):
+        return json.loads(self.result) if self.result else None
+
+    def __repr__(self):
+        return (
+            f"<MediaJob(id='{self.id}', kind='{self.kind}', talk_id='{self.talk_id}', "
+            f"state='{self.state}')>"
+        )
+
+
 # Models for Google login
 
 
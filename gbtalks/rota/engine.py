@@ -0,0 +1,484 @@
+"""The rota solver, run entirely in memory.
+
+Generating the rota used to work on ORM objects: every candidate check
+re-queried the recorders or the recorder's talks for the day, and every
+assignment was committed on its own, holding SQLite's write lock for the whole
+POST. Instead:
+
+    rota = load_rota()        # talks, recorders and settings, one query each
+    rota.clear()
+    generate(rota)            # pure Python
+    save_rota(rota)           # the assignments that changed, in one UPDATE
+
+The rules are the ones the rota has always followed; see generate(). Each
+recorder's talks are kept in a Timeline, so checking a candidate talk against
+them is a bisect rather than a walk through all of them. The checks only need
+start_time and end_time from talks, so recorder_from() lets the helpers in
+routes.py use them with Recorder and Talk rows too.
+"""
+
+from datetime import timedelta
+
+from sqlalchemy import select, update
+
+from gbtalks.models import Recorder, RotaSettings, Talk, db
+
+from .timeline import Timeline
+
+# RotaSettings keys the solver follows, and their defaults
+DEFAULT_RULES = {
+    "minimum_time_between_talks": 20,  # minutes
+    "max_talks_per_shift": 2,
+    "shift_length": 3,  # hours
+    "break_between_shifts": 2,  # hours
+    "max_shifts_per_day_limit": 2,
+    "same_venue_assignment_window": 3,  # hours
+    "additional_talk_search_window": 1,  # hours
+    "additional_talk_minimum_gap": 20,  # minutes
+}
+
+
+class RotaRules:
+    """The rota settings, as attributes; anything not given keeps its default."""
+
+    def __init__(self, **settings):
+        for key, default in DEFAULT_RULES.items():
+            value = settings.get(key)
+            setattr(self, key, default if value is None else value)
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in DEFAULT_RULES}
+
+
+class RotaTalk:
+    """The parts of a Talk the solver needs, and who is recording it."""
+
+    def __init__(
+        self, id, start_time, end_time, venue=None, is_priority=None, is_rotaed=None, is_cancelled=False
+    ):
+        self.id = id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.venue = venue
+        self.is_priority = is_priority
+        self.is_rotaed = is_rotaed
+        self.is_cancelled = is_cancelled
+        self.recorder = None
+
+    @property
+    def recorder_name(self):
+        return self.recorder.name if self.recorder is not None else None
+
+    def __repr__(self):
+        return f"<RotaTalk({self.id}, {self.start_time:%a %H:%M}, {self.recorder_name})>"
+
+
+class RotaRecorder:
+    """The parts of a Recorder the solver needs, and their talks by start time."""
+
+    def __init__(
+        self,
+        name,
+        max_shifts_per_day=None,
+        earliest_start_time=None,
+        latest_end_time=None,
+        talks=(),
+        has_dropped_out=False,
+    ):
+        self.name = name
+        self.max_shifts_per_day = max_shifts_per_day
+        self.earliest_start_time = earliest_start_time
+        self.latest_end_time = latest_end_time
+        self.has_dropped_out = has_dropped_out
+        self.timeline = Timeline(talks)
+
+    @property
+    def talks(self):
+        return self.timeline.talks
+
+    def __repr__(self):
+        return f"<RotaRecorder({self.name!r}, {len(self.talks)} talks)>"
+
+
+class Rota:
+    """Every talk and recorder, and who is recording what."""
+
+    def __init__(self, talks=(), recorders=(), rules=None):
+        self.talks = {talk.id: talk for talk in talks}
+        self.recorders = list(recorders)
+        self.rules = rules or RotaRules()
+        # Who was recording each talk when it was loaded, for save_rota()
+        self.loaded = {talk.id: talk.recorder_name for talk in self.talks.values()}
+
+    def recorder(self, name):
+        return next((recorder for recorder in self.recorders if recorder.name == name), None)
+
+    def by_start_time(self):
+        return sorted(self.talks.values(), key=lambda talk: (talk.start_time, talk.id))
+
+    def assign(self, recorder, talk):
+        """Give `talk` to `recorder`, taking it from whoever had it"""
+        if talk.recorder is recorder:
+            return
+        self.unassign(talk)
+
+        talk.recorder = recorder
+        recorder.timeline.add(talk)
+
+    def unassign(self, talk):
+        if talk.recorder is not None:
+            talk.recorder.timeline.remove(talk)
+            talk.recorder = None
+
+    def clear(self):
+        for talk in self.talks.values():
+            talk.recorder = None
+        for recorder in self.recorders:
+            recorder.timeline.clear()
+
+    def assignments(self):
+        """{talk id: recorder name or None}"""
+        return {talk_id: talk.recorder_name for talk_id, talk in self.talks.items()}
+
+    def changes(self):
+        """{talk id: recorder name or None} for the talks whose recorder changed since loading"""
+        return {
+            talk_id: talk.recorder_name
+            for talk_id, talk in self.talks.items()
+            if talk.recorder_name != self.loaded.get(talk_id)
+        }
+
+
+def _start_time(talk):
+    return talk.start_time
+
+
+def load_rules():
+    """The current RotaSettings, in one query"""
+    return RotaRules(**dict(db.session.execute(select(RotaSettings.key, RotaSettings.value)).all()))
+
+
+def load_rota(rules=None):
+    """Snapshot the talks, recorders and rota settings into a Rota"""
+    recorders = [
+        RotaRecorder(
+            name=row.name,
+            max_shifts_per_day=row.max_shifts_per_day,
+            earliest_start_time=row.earliest_start_time,
+            latest_end_time=row.latest_end_time,
+            has_dropped_out=bool(row.has_dropped_out),
+        )
+        for row in db.session.execute(
+            select(
+                Recorder.name,
+                Recorder.max_shifts_per_day,
+                Recorder.earliest_start_time,
+                Recorder.latest_end_time,
+                Recorder.has_dropped_out,
+            )
+        )
+    ]
+    rota = Rota(recorders=recorders, rules=rules or load_rules())
+    by_name = {recorder.name: recorder for recorder in recorders}
+
+    for row in db.session.execute(
+        select(
+            Talk.id,
+            Talk.start_time,
+            Talk.end_time,
+            Talk.venue,
+            Talk.is_priority,
+            Talk.is_rotaed,
+            Talk.is_cancelled,
+            Talk.recorder_name,
+        )
+    ):
+        talk = RotaTalk(
+            id=row.id,
+            start_time=row.start_time,
+            end_time=row.end_time,
+            venue=row.venue,
+            is_priority=row.is_priority,
+            is_rotaed=row.is_rotaed,
+            is_cancelled=row.is_cancelled,
+        )
+        rota.talks[talk.id] = talk
+        rota.loaded[talk.id] = row.recorder_name
+
+        if row.recorder_name in by_name:
+            talk.recorder = by_name[row.recorder_name]
+            talk.recorder.timeline.add(talk)
+
+    return rota
+
+
+def save_rota(rota):
+    """Write the assignments that changed since loading, in one transaction.
+
+    Returns {talk id: recorder name or None} for the talks changed.
+    """
+    changes = rota.changes()
+
+    if changes:
+        db.session.execute(
+            update(Talk),
+            [{"id": talk_id, "recorder_name": name} for talk_id, name in changes.items()],
+        )
+    db.session.commit()
+
+    rota.loaded.update(changes)
+    return changes
+
+
+def recorder_from(recorder):
+    """A RotaRecorder for a Recorder row, holding its Talk rows"""
+    return RotaRecorder(
+        recorder.name,
+        recorder.max_shifts_per_day,
+        recorder.earliest_start_time,
+        recorder.latest_end_time,
+        talks=recorder.talks,
+        has_dropped_out=bool(recorder.has_dropped_out),
+    )
+
+
+# The checks
+
+
+def would_clash(recorder, talk, rules):
+    """Whether `talk` starts or ends while the recorder is recording, or within
+    minimum_time_between_talks of one of their talks ending.
+
+    For example, with an existing talk at 16:00-17:00 and a 20 minute gap, a
+    talk at 17:00 clashes, as it starts before 17:20; so does one at 15:00-16:00,
+    as it ends after 16:00. A talk at 17:30 doesn't.
+    """
+    gap = timedelta(minutes=rules.minimum_time_between_talks)
+    return bool(recorder.timeline.clashes(talk, gap))
+
+
+def is_maxed_out_for_day(recorder, talk, rules):
+    """Whether the recorder already has max_shifts_per_day * max_talks_per_shift
+    talks on the day of `talk`"""
+    max_talks = recorder.max_shifts_per_day * rules.max_talks_per_shift
+    return recorder.timeline.count_on(talk.start_time.date()) >= max_talks
+
+
+def would_break_shift_pattern(recorder, candidate_talk, rules, max_talks_per_shift=None):
+    """Whether the recorder's day, with `candidate_talk` added, no longer splits
+    into shifts of shift_length hours, break_between_shifts hours apart, no
+    more of them than they (and max_shifts_per_day_limit) allow, and, if
+    given, no more than max_talks_per_shift talks in any of them"""
+    # What the candidate's day would look like if the talk was assigned
+    day = recorder.timeline.on_day(candidate_talk.start_time.date())
+    day.append(candidate_talk)
+    day.sort(key=_start_time)
+
+    return not _splits_into_shifts(recorder, day, rules, max_talks_per_shift)
+
+
+def breaks_shift_pattern(recorder, day, rules):
+    """Whether the recorder's talks on `day`, a date, as they stand, don't
+    split into shifts. Taking a talk away can do this, as shifts are counted
+    from the first talk of the day."""
+    talks = recorder.timeline.on_day(day)
+    return bool(talks) and not _splits_into_shifts(recorder, talks, rules)
+
+
+def _splits_into_shifts(recorder, day, rules, max_talks_per_shift=None):
+    """Whether a day's talks, in start order, fit in the recorder's shifts"""
+    shift_length = timedelta(hours=rules.shift_length)
+    break_between_shifts = timedelta(hours=rules.break_between_shifts)
+
+    # The first shift is all talks that end within shift_length of the first one starting
+    first_shift = [talk for talk in day if talk.end_time <= day[0].start_time + shift_length]
+
+    max_allowed_shifts = min(recorder.max_shifts_per_day, rules.max_shifts_per_day_limit)
+
+    all_shifts = [first_shift]
+    remaining_talks = day[len(first_shift):]
+
+    for _shift_number in range(2, max_allowed_shifts + 1):
+        if not remaining_talks:
+            break
+
+        shift_start_time = remaining_talks[0].start_time
+
+        # Each shift must start a full break after the one before ends
+        previous_shift = all_shifts[-1]
+        if previous_shift and shift_start_time < previous_shift[-1].end_time + break_between_shifts:
+            return False
+
+        # Talks starting in the shift's first shift_length - 1 hours
+        shift_end = shift_start_time + shift_length - timedelta(hours=1)
+        current_shift = [talk for talk in remaining_talks if shift_start_time <= talk.start_time <= shift_end]
+        remaining_talks = [talk for talk in remaining_talks if talk not in current_shift]
+
+        if current_shift:
+            all_shifts.append(current_shift)
+        else:
+            break
+
+    if max_talks_per_shift is not None and any(len(shift) > max_talks_per_shift for shift in all_shifts):
+        return False
+
+    # Any talks left over don't fit in the recorder's shifts
+    return sum(len(shift) for shift in all_shifts) == len(day)
+
+
+def is_available(recorder, talk):
+    """Whether the talk is within the recorder's earliest start and latest end
+    times. A recorder who has dropped out isn't available at all."""
+    if recorder.has_dropped_out:
+        return False
+    if recorder.earliest_start_time and talk.start_time.time() < recorder.earliest_start_time:
+        return False
+    if recorder.latest_end_time and talk.end_time.time() > recorder.latest_end_time:
+        return False
+    return True
+
+
+def can_take(recorder, talk, rules):
+    """Whether the recorder may be given `talk` on top of the talks they have"""
+    if not is_available(recorder, talk):
+        return False
+
+    # The rest only matter if the recorder already has some talks
+    if not recorder.timeline:
+        return True
+
+    if would_clash(recorder, talk, rules):
+        return False
+
+    # The talk must start a full break after the recorder's last talk ended
+    if talk.start_time < recorder.timeline.last().end_time + timedelta(hours=rules.break_between_shifts):
+        return False
+
+    if is_maxed_out_for_day(recorder, talk, rules):
+        return False
+
+    return not would_break_shift_pattern(recorder, talk, rules)
+
+
+def can_fit(recorder, talk, rules):
+    """Whether `talk` fits in the recorder's day wherever it falls, rather than
+    only after their last talk as can_take() requires"""
+    # would_clash() only leaves a gap after the recorder's talks, which is all
+    # that matters when talks are taken in start order. Shifts are capped at
+    # max_talks_per_shift here but not in can_take(), so the greedy rota
+    # comes out as it always has
+    gap = timedelta(minutes=rules.minimum_time_between_talks)
+
+    return (
+        is_available(recorder, talk)
+        and not would_clash(recorder, talk, rules)
+        and not recorder.timeline.within(talk, gap)
+        and not is_maxed_out_for_day(recorder, talk, rules)
+        and not would_break_shift_pattern(recorder, talk, rules, rules.max_talks_per_shift)
+    )
+
+
+def fewest_talks_first(recorder):
+    """Recorders with fewer talks first. Between recorders with as many talks,
+    the one whose first talk is earliest, and then the one added first: the
+    order the rota has always considered them in."""
+    if not recorder.timeline:
+        return (0,)
+    return (len(recorder.timeline), recorder.timeline.first().start_time)
+
+
+def find_recorder(rota, talk):
+    """Give `talk` to the recorder with fewest talks that can take it, and
+    return them, or None if nobody can"""
+    for candidate in sorted(rota.recorders, key=fewest_talks_first):
+        if can_take(candidate, talk, rota.rules):
+            rota.assign(candidate, talk)
+            return candidate
+
+    return None
+
+
+def generate(rota):
+    """Find recorders for every talk that needs one, the way the rota always has.
+
+    Priority talks first, in start order, each to the recorder with fewest
+    talks who can take it. That recorder then stays on for later priority talks
+    in the same venue within same_venue_assignment_window hours.
+
+    Then additional talks the same way. After each, its recorder also picks up
+    any unassigned talk starting between additional_talk_minimum_gap minutes
+    and additional_talk_search_window hours after it ends. That talk need not
+    be flagged is_rotaed, as the recorder is there anyway.
+
+    Talks already assigned are left as they are, cancelled talks are never
+    given out, and recorders who have dropped out get nothing (see
+    is_available). Returns {talk id: recorder name} for the talks assigned.
+    """
+    rules = rota.rules
+    talks = rota.by_start_time()
+    # For finding the talks that follow on from each one
+    festival = Timeline(talks)
+    assigned = {}
+
+    def assign(recorder, talk):
+        rota.assign(recorder, talk)
+        assigned[talk.id] = recorder.name
+
+    for talk in [talk for talk in talks if talk.is_priority is True]:
+        if talk.recorder is not None or talk.is_rotaed is not True or talk.is_cancelled:
+            continue
+
+        recorder = find_recorder(rota, talk)
+        if recorder is None:
+            continue
+        assigned[talk.id] = recorder.name
+
+        window_end = talk.start_time + timedelta(hours=rules.same_venue_assignment_window - 1)
+        for future_talk in festival.starting_between(talk.end_time, window_end):
+            if (
+                future_talk.is_priority is True
+                and not future_talk.is_cancelled
+                and future_talk.venue == talk.venue
+                and not would_break_shift_pattern(recorder, future_talk, rules)
+                and not would_clash(recorder, future_talk, rules)
+            ):
+                assign(recorder, future_talk)
+
+    for talk in [talk for talk in talks if talk.is_priority is False]:
+        if talk.recorder is not None or talk.is_rotaed is not True or talk.is_cancelled:
+            continue
+
+        recorder = find_recorder(rota, talk)
+        if recorder is None:
+            continue
+        assigned[talk.id] = recorder.name
+
+        earliest = talk.end_time + timedelta(minutes=rules.additional_talk_minimum_gap)
+        latest = talk.end_time + timedelta(hours=rules.additional_talk_search_window)
+        for future_talk in festival.starting_between(max(talk.end_time, earliest), latest):
+            if (
+                future_talk.recorder is None
+                and not future_talk.is_cancelled
+                and not would_break_shift_pattern(recorder, future_talk, rules)
+                and not would_clash(recorder, future_talk, rules)
+            ):
+                assign(recorder, future_talk)
+
+    return assigned
+
+
+def coverage(rota):
+    """{"priority": (assigned, total), "additional": (assigned, total)}, not
+    counting cancelled talks"""
+    counts = {"priority": [0, 0], "additional": [0, 0]}
+
+    for talk in rota.talks.values():
+        if talk.is_priority is None or talk.is_cancelled:
+            continue
+        kind = counts["priority" if talk.is_priority else "additional"]
+        kind[1] += 1
+        if talk.recorder is not None:
+            kind[0] += 1
+
+    return {kind: tuple(count) for kind, count in counts.items()}
+
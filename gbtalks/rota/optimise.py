@@ -0,0 +1,158 @@
+"""Improving on the greedy rota, within a time budget.
+
+generate() gives each talk, in start order, to the first recorder who can take
+it. An early choice can leave a later priority talk with nobody, when giving
+the early talk to someone else would have fitted both. optimise() starts from
+that rota and searches nearby ones for something better:
+
+    insert      give an unassigned talk to a recorder it fits
+    make room   move one of a recorder's talks that day to someone else, so
+                an unassigned talk fits; or, for a priority talk, drop an
+                additional one that can't be moved
+    balance     move a talk from a busy recorder to one with at least two
+                fewer talks
+
+A talk fits a recorder when they're available then, it doesn't clash with
+their talks, they aren't at their daily limit, and their day still splits into
+shifts (see engine.can_fit), and the day it leaves still does. Unlike
+generate(), talks needn't be taken in start order.
+
+Every move improves the rota: first by recording more priority talks, then more
+additional talks, then by spreading them more evenly. When no move does, or
+the time is up, the search stops. Only talks flagged is_rotaed are given out.
+
+There's no ILP or constraint solver here. A few hundred talks and a few dozen
+recorders are small enough for local search, and there's nothing to install.
+"""
+
+import random
+import time
+
+from . import engine
+
+
+def _needs_recorder(talk):
+    return (
+        talk.recorder is None
+        and talk.is_rotaed is True
+        and talk.is_priority is not None
+        and not talk.is_cancelled
+    )
+
+
+def score(rota):
+    """(priority talks recorded, additional talks recorded, -sum of squared
+    talks per recorder); higher is better"""
+    coverage = engine.coverage(rota)
+    balance = -sum(len(recorder.talks) ** 2 for recorder in rota.recorders)
+    return coverage["priority"][0], coverage["additional"][0], balance
+
+
+class _Search:
+    def __init__(self, rota, deadline, seed):
+        self.rota = rota
+        self.rules = rota.rules
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.moves = 0
+
+    def out_of_time(self):
+        return time.monotonic() >= self.deadline
+
+    def fits(self, recorder, talk):
+        return engine.can_fit(recorder, talk, self.rules)
+
+    def recorders_by_load(self):
+        recorders = list(self.rota.recorders)
+        self.random.shuffle(recorders)
+        recorders.sort(key=lambda recorder: len(recorder.talks))
+        return recorders
+
+    def insert(self, talk):
+        for recorder in self.recorders_by_load():
+            if self.fits(recorder, talk):
+                self.rota.assign(recorder, talk)
+                return True
+        return False
+
+    def make_room(self, talk):
+        """Give `talk` to a recorder by moving, or for a priority talk
+        dropping, one of their talks that day"""
+        day = talk.start_time.date()
+
+        for recorder in self.recorders_by_load():
+            if not engine.is_available(recorder, talk):
+                continue
+
+            for blocking_talk in recorder.timeline.on_day(day):
+                self.rota.unassign(blocking_talk)
+
+                if self.fits(recorder, talk):
+                    self.rota.assign(recorder, talk)
+                    if self.rehome(blocking_talk, recorder):
+                        return True
+                    # Losing an additional talk for a priority one is still better
+                    if talk.is_priority and not blocking_talk.is_priority:
+                        return True
+                    self.rota.unassign(talk)
+
+                self.rota.assign(recorder, blocking_talk)
+
+        return False
+
+    def rehome(self, talk, previous_recorder):
+        for recorder in self.recorders_by_load():
+            if recorder is not previous_recorder and self.fits(recorder, talk):
+                self.rota.assign(recorder, talk)
+                return True
+        return False
+
+    def balance(self):
+        """Move talks from busier recorders to ones with at least two fewer"""
+        moved = False
+        for busy in sorted(self.rota.recorders, key=lambda recorder: -len(recorder.talks)):
+            for talk in list(busy.talks):
+                if self.out_of_time():
+                    return moved
+
+                for quiet in self.recorders_by_load():
+                    if len(quiet.talks) > len(busy.talks) - 2:
+                        break
+                    if not self.fits(quiet, talk):
+                        continue
+
+                    self.rota.assign(quiet, talk)
+                    if engine.breaks_shift_pattern(busy, talk.start_time.date(), self.rules):
+                        self.rota.assign(busy, talk)
+                        continue
+
+                    self.moves += 1
+                    moved = True
+                    break
+        return moved
+
+    def run(self):
+        improved = True
+        while improved and not self.out_of_time():
+            improved = False
+
+            unassigned = [talk for talk in self.rota.by_start_time() if _needs_recorder(talk)]
+            # Priority talks first
+            unassigned.sort(key=lambda talk: not talk.is_priority)
+
+            for talk in unassigned:
+                if self.out_of_time():
+                    break
+                if talk.recorder is None and (self.insert(talk) or self.make_room(talk)):
+                    self.moves += 1
+                    improved = True
+
+            if not self.out_of_time() and self.balance():
+                improved = True
+
+
+def optimise(rota, seconds, seed=0):
+    """Improve the rota in place for up to `seconds`; returns the moves made"""
+    search = _Search(rota, time.monotonic() + seconds, seed)
+    search.run()
+    return search.moves
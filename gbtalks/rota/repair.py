@@ -0,0 +1,110 @@
+"""Mending the rota after a change, without changing anyone else's shifts.
+
+Regenerating the rota for one cancelled talk or one recorder dropping out
+changes nearly everybody's printed shifts. repair() only touches the talks the
+change affects:
+
+    a talk that changed       is taken from its recorder, then given back to
+                              them if it still fits, or else to whoever it
+                              fits; a cancelled talk is just taken away. If
+                              the rest of the recorder's day no longer splits
+                              into shifts, it's refitted as for a recorder
+                              that changed
+    a recorder that changed   keeps the talks that still fit their times and
+                              limits; the rest go to whoever they fit
+    a recorder dropping out   gives up all of their talks, and is given none
+                              here or by generate() and optimise() from
+                              then on (Recorder.has_dropped_out)
+    a recorder that's gone    (deleted from the database) gives up theirs
+
+Released talks are only given to recorders they fit as things stand (see
+engine.can_fit); nobody else's talks are moved to make room. A talk that fits
+nobody is left unassigned. It all runs in memory, so a repair takes a few
+milliseconds plus loading and saving the rota.
+"""
+
+from . import engine
+
+
+def repair(rota, talk_ids=(), recorder_names=(), dropped_out=()):
+    """Repair the rota in place after the talks and recorders given changed.
+
+    Recorders named in `dropped_out` are marked as having dropped out. Returns
+    {talk id: (old recorder name, new recorder name)} for the talks whose
+    recorder changed, either name possibly None.
+    """
+    changed = set(recorder_names) | set(dropped_out)
+    dropped_out = [recorder for recorder in rota.recorders if recorder.name in dropped_out]
+    for recorder in dropped_out:
+        recorder.has_dropped_out = True
+    released = {}  # talk -> the recorder it had
+
+    for talk_id in talk_ids:
+        talk = rota.talks.get(talk_id)
+        if talk is not None and talk.recorder is not None:
+            recorder = talk.recorder
+            released[talk] = recorder
+            rota.unassign(talk)
+
+            # Shifts are counted from the day's first talk, so what's left of
+            # the day may no longer split into shifts
+            day = talk.start_time.date()
+            if engine.breaks_shift_pattern(recorder, day, rota.rules):
+                _keep_what_fits(rota, recorder, recorder.timeline.on_day(day), released)
+        elif talk is not None:
+            released[talk] = None
+
+    for recorder in [recorder for recorder in rota.recorders if recorder.name in changed]:
+        if recorder in dropped_out:
+            for talk in list(recorder.talks):
+                released[talk] = recorder
+                rota.unassign(talk)
+        else:
+            _keep_what_fits(rota, recorder, recorder.talks, released)
+
+    # Talks whose recorder was deleted
+    for talk_id, name in rota.loaded.items():
+        talk = rota.talks[talk_id]
+        if name is not None and talk.recorder is None and rota.recorder(name) is None:
+            released.setdefault(talk, None)
+
+    candidates = [recorder for recorder in rota.recorders if not recorder.has_dropped_out]
+
+    # Priority talks first, then in start order
+    for talk in sorted(released, key=lambda talk: (not talk.is_priority, talk.start_time, talk.id)):
+        # A talk not flagged for the rota only gets a recorder if it had one
+        if talk.is_cancelled or (talk.is_rotaed is not True and released[talk] is None):
+            continue
+
+        previous = released[talk]
+        if previous in candidates and engine.can_fit(previous, talk, rota.rules):
+            rota.assign(previous, talk)
+            continue
+
+        for recorder in sorted(candidates, key=engine.fewest_talks_first):
+            if engine.can_fit(recorder, talk, rota.rules):
+                rota.assign(recorder, talk)
+                break
+
+    return {talk_id: (rota.loaded.get(talk_id), name) for talk_id, name in rota.changes().items()}
+
+
+def _keep_what_fits(rota, recorder, talks, released):
+    """Take `talks` from the recorder and give back, in start order, the ones
+    that still fit; the rest are added to `released`"""
+    talks = list(talks)
+    for talk in talks:
+        rota.unassign(talk)
+    for talk in talks:
+        if engine.can_fit(recorder, talk, rota.rules):
+            rota.assign(recorder, talk)
+        else:
+            released[talk] = recorder
+
+
+def describe(changes):
+    """A line for each talk a repair changed, e.g. "Talk 7: Ann → Bob" """
+    return [
+        f"Talk {talk_id}: {old or 'nobody'} → {new or 'nobody'}"
+        for talk_id, (old, new) in sorted(changes.items())
+    ]
@@ -1,366 +1,159 @@
-from datetime import datetime, timedelta
-
 from flask import current_app as app
 from flask import (
     flash,
+    jsonify,
     render_template,
     request,
 )
 from flask_login import current_user
-from sqlalchemy.orm import joinedload
+from sqlalchemy import update
 
-from gbtalks.models import Recorder, RotaSettings, Talk, db
+from gbtalks.models import Recorder, Talk, db
 
-from . import rota_blueprint
+from . import engine, rota_blueprint
+from .optimise import optimise
+from .simulate import ScenarioError, simulate
 
+# These take ORM objects, for code that has a Recorder and a Talk to hand. The
+# rules live in engine.py, which the rota itself is generated with.
 
-def talk_would_clash(recorder, talk, settings_cache=None):
-    # A talk clashes if it starts while the recorder is currently recording, or within the configured gap
-    minimum_time_between_talks = settings_cache['minimum_time_between_talks'] if settings_cache else RotaSettings.get_value('minimum_time_between_talks', 20)
-
-# Examples:
-# Recorder has existing talk at 16:00. Candidate talk is at 17:00.
-# First condition:
-# Candidate talk clashes because:
-# * It starts after 16:00
-# AND
-# * It starts before 17:20 (assuming a 1h talk)
-#
-# Second condition:
-# Candidate talk clashes because:
-# * It ends after 16:00
-# AND
-# * It ends before 17:20 (assuming a 1h talk)
-#
-# A talk at 17:30 would not clash.
-#
-
-    for existing_talk in recorder.talks:
-        if existing_talk.start_time <= talk.start_time <= (
-            existing_talk.end_time + timedelta(minutes=minimum_time_between_talks)
-        ) or existing_talk.start_time <= talk.end_time <= (
-            existing_talk.end_time + timedelta(minutes=minimum_time_between_talks)
-        ):
-            return True
-
-    return False
 
+def _rules(settings_cache):
+    return engine.RotaRules(**settings_cache) if settings_cache else engine.load_rules()
 
-def recorder_is_maxed_out_for_day(recorder, talk, settings_cache=None):
-    # Maximum talks per day = max shifts per day * max talks per shift
-    max_talks_per_shift = settings_cache['max_talks_per_shift'] if settings_cache else RotaSettings.get_value('max_talks_per_shift', 2)
-    candidates_max_talks = recorder.max_shifts_per_day * max_talks_per_shift
-    candidates_talks_on_this_day = 0
-    for candidates_talk in recorder.talks:
-        if candidates_talk.start_time.day == talk.start_time.day:
-            candidates_talks_on_this_day += 1
-
-    if candidates_talks_on_this_day >= candidates_max_talks:
-        return True
-    else:
-        return False
 
+def talk_would_clash(recorder, talk, settings_cache=None):
+    return engine.would_clash(engine.recorder_from(recorder), talk, _rules(settings_cache))
 
-def talk_would_break_shift_pattern(recorder, candidate_talk, settings_cache=None):
-    # make sure that if this talk is assigned, we don't violate any of the shift rules
-    # - prepare the list of talks that would result if this talk were allocated
-    # - check that there are no more shift_length groups containing talks than the candidate is allowed shifts
-    # - check that the shift groups are more than break_between_shifts apart
-
-    shift_length = settings_cache['shift_length'] if settings_cache else RotaSettings.get_value('shift_length', 3)
-    break_between_shifts = settings_cache['break_between_shifts'] if settings_cache else RotaSettings.get_value('break_between_shifts', 2)
-
-    # Make a list of what the candidate's day would look like if the talk was assigned
-    talks_on_this_day_if_talk_assigned = []
-    for talk in Talk.query.filter(
-        Talk.recorded_by == recorder,
-        Talk.start_time
-        > datetime(
-            candidate_talk.start_time.year,
-            candidate_talk.start_time.month,
-            candidate_talk.start_time.day,
-            0,
-            0,
-            0,
-        ),
-        Talk.start_time
-        < datetime(
-            candidate_talk.start_time.year,
-            candidate_talk.start_time.month,
-            candidate_talk.start_time.day,
-            23,
-            59,
-            59,
-        ),
-    ):
-        talks_on_this_day_if_talk_assigned.append(talk)
-
-    talks_on_this_day_if_talk_assigned.append(candidate_talk)
-    talks_on_this_day_if_talk_assigned.sort(key=lambda x: x.start_time)
-
-    # The first shift is all talks that end in a period 0-3h after the start of the first talk
-    talks_in_first_shift = []
-    for talk in talks_on_this_day_if_talk_assigned:
-        if talk.end_time <= talks_on_this_day_if_talk_assigned[
-            0
-        ].start_time + timedelta(hours=shift_length):
-            talks_in_first_shift.append(talk)
-
-    # Build shifts dynamically based on max_shifts_per_day_limit
-    max_shifts_per_day_limit = settings_cache['max_shifts_per_day_limit'] if settings_cache else RotaSettings.get_value('max_shifts_per_day_limit', 2)
-    max_allowed_shifts = min(recorder.max_shifts_per_day, max_shifts_per_day_limit)
-
-    all_shifts = [talks_in_first_shift]
-    remaining_talks = talks_on_this_day_if_talk_assigned[len(talks_in_first_shift):]
-
-    # Build additional shifts up to the maximum allowed
-    for _shift_num in range(2, max_allowed_shifts + 1):
-        if not remaining_talks:
-            break
-
-        # Find the start time for this shift (first remaining talk)
-        shift_start_time = remaining_talks[0].start_time
-
-        # Check if this shift starts with adequate break after previous shift
-        previous_shift = all_shifts[-1]
-        if previous_shift and shift_start_time < previous_shift[-1].end_time + timedelta(hours=break_between_shifts):
-            return True  # Violates break rules
-
-        # Collect talks for this shift
-        current_shift = []
-        for talk in remaining_talks[:]:  # Copy list to avoid modification during iteration
-            if shift_start_time <= talk.start_time <= shift_start_time + timedelta(hours=shift_length - 1):
-                current_shift.append(talk)
-                remaining_talks.remove(talk)
-
-        if current_shift:
-            all_shifts.append(current_shift)
-        else:
-            break
-
-    # Check if all talks are accounted for in shifts
-    total_talks_in_shifts = sum(len(shift) for shift in all_shifts)
-    if len(talks_on_this_day_if_talk_assigned) == total_talks_in_shifts:
-        return False  # All talks fit within shift rules
-    else:
-        return True  # Some talks don't fit, violates rules
 
+def recorder_is_maxed_out_for_day(recorder, talk, settings_cache=None):
+    return engine.is_maxed_out_for_day(engine.recorder_from(recorder), talk, _rules(settings_cache))
 
-def assign_talk_to_recorder(recorder, talk):
-    recorder.talks.append(talk)
-    recorder.talks.sort(key=lambda x: x.start_time)
 
-    db.session.add(talk)
-    db.session.add(recorder)
-    db.session.commit()
-    db.session.flush()
+def talk_would_break_shift_pattern(recorder, candidate_talk, settings_cache=None):
+    return engine.would_break_shift_pattern(
+        engine.recorder_from(recorder), candidate_talk, _rules(settings_cache)
+    )
 
 
 def clear_rota():
-    for talk in Talk.query.all():
-        talk.recorded_by = None
-        db.session.add(talk)
-
+    db.session.execute(update(Talk).values(recorder_name=None))
     db.session.commit()
-    db.session.flush()
 
 
 def find_recorder_for_talk(talk, settings_cache=None):
-    # Eager load recorder talks to avoid N+1 queries
-    recorders = Recorder.query.options(joinedload(Recorder.talks)).all()
-
-    # Sort recorders once by current talk count, then maintain order by removing candidates
-    recorders.sort(key=lambda x: len(x.talks))
+    """Assign the talk to the recorder with fewest talks who can take it, and
+    return them, or None if it's already assigned or nobody can take it"""
+    rota = engine.load_rota(_rules(settings_cache))
+    rota_talk = rota.talks[talk.id]
+    if rota_talk.recorder is not None:
+        return None
 
-    candidate_recorder = None
-    while talk.recorded_by is None and len(recorders)>0:
-        # Pick the recorder with fewest talks first, consider them a candidate
-        candidate_recorder = recorders.pop(0)
+    recorder = engine.find_recorder(rota, rota_talk)
+    if recorder is None:
+        return None
 
-        # Check time constraints first (applies to all recorders, regardless of existing talks)
-        # Move on if talk starts before recorder's earliest start time
-        if candidate_recorder.earliest_start_time and talk.start_time.time() < candidate_recorder.earliest_start_time:
-            continue
+    engine.save_rota(rota)
+    return db.session.get(Recorder, recorder.name)
 
-        # Move on if talk ends after recorder's latest end time
-        if candidate_recorder.latest_end_time and talk.end_time.time() > candidate_recorder.latest_end_time:
-            continue
 
-        # Do some checks that only make sense if the recorder already has some talks assigned
-        if candidate_recorder.talks:
-            candidate_recorders_last_talk = candidate_recorder.talks[-1]
+def _report_coverage(rota):
+    """Flash how many priority and additional talks have a recorder"""
+    coverage = engine.coverage(rota)
+    assigned_priority_talks, priority_talks_count = coverage["priority"]
+    assigned_additional_talks, additional_talks_count = coverage["additional"]
 
-            # Move on if the recorder is currently recording
-            if talk_would_clash(candidate_recorder, talk, settings_cache):
-                continue
+    # Check if all talks were allocated
+    unallocated_priority = priority_talks_count - assigned_priority_talks
+    unallocated_additional = additional_talks_count - assigned_additional_talks
 
-            # Move on if the talk starts less than the required break after the recorders' last talk ended
-            break_between_shifts = settings_cache['break_between_shifts'] if settings_cache else RotaSettings.get_value('break_between_shifts', 2)
-            if talk.start_time < candidate_recorders_last_talk.end_time + timedelta(
-                hours=break_between_shifts
-            ):
-                continue
+    base_message = f"Rota generation completed! Assigned {assigned_priority_talks}/{priority_talks_count} priority talks and {assigned_additional_talks}/{additional_talks_count} additional talks."
 
-            # Move on if this talk would result in the recorder doing too many talks in one day
-            if recorder_is_maxed_out_for_day(candidate_recorder, talk, settings_cache):
-                continue
+    if unallocated_priority > 0 or unallocated_additional > 0:
+        warning_parts = []
+        if unallocated_priority > 0:
+            warning_parts.append(f"{unallocated_priority} priority talk{'s' if unallocated_priority != 1 else ''}")
+        if unallocated_additional > 0:
+            warning_parts.append(f"{unallocated_additional} additional talk{'s' if unallocated_additional != 1 else ''}")
 
-            # Move on if this talk doens't fit within the shift pattern
-            if talk_would_break_shift_pattern(candidate_recorder, talk, settings_cache):
-                continue
+        warning_message = f" WARNING: {' and '.join(warning_parts)} could not be allocated - check recorder availability and rota settings."
+        flash(base_message + warning_message, "warning")
+    else:
+        flash(base_message + " All talks successfully allocated!", "success")
 
-        # If we've got this far, we're ok to assign the talk to the candidate recorder
-        assign_talk_to_recorder(candidate_recorder, talk)
 
-    # Only report a recorder if the talk was actually assigned to one. Returning
-    # the last candidate considered would report success after every candidate
-    # had been rejected, and callers use this result to assign follow-on talks.
-    if talk.recorded_by is None:
-        return None
+def _report_optimisation(greedy_coverage, coverage, moves):
+    """Flash how much optimising improved on the greedy rota"""
+    extra_priority = coverage["priority"][0] - greedy_coverage["priority"][0]
+    extra_additional = coverage["additional"][0] - greedy_coverage["additional"][0]
 
-    return candidate_recorder
+    flash(
+        f"Optimising made {moves} change{'s' if moves != 1 else ''} to the rota, recording "
+        f"{extra_priority:+d} priority and {extra_additional:+d} additional talks compared to the standard rota.",
+        "info",
+    )
 
 
 @rota_blueprint.route("/rota", methods=["GET", "POST"])
 def rota():
     """Define a rota"""
 
-    # Initialize cache as None for GET requests
-    rota_settings_cache = None
-
-    if request.method == "POST":
-        # Regenerating the rota clears every existing recorder assignment, so it
-        # is restricted to team leaders. The read-only rota views below stay open
-        # so recorders can check their own shifts without signing in.
-        if (
-            not current_user.is_authenticated
-            or current_user.email not in app.config["TEAM_LEADERS_EMAILS"]
-        ):
-            return app.login_manager.unauthorized()
-
-        # If we've been asked to make a new rota, clear out the old one
-        clear_rota()
-
-        # Cache all RotaSettings at the start to avoid repeated database lookups
-        rota_settings_cache = {
-            'minimum_time_between_talks': RotaSettings.get_value('minimum_time_between_talks', 20),
-            'max_talks_per_shift': RotaSettings.get_value('max_talks_per_shift', 2),
-            'shift_length': RotaSettings.get_value('shift_length', 3),
-            'break_between_shifts': RotaSettings.get_value('break_between_shifts', 2),
-            'max_shifts_per_day_limit': RotaSettings.get_value('max_shifts_per_day_limit', 2),
-            'same_venue_assignment_window': RotaSettings.get_value('same_venue_assignment_window', 3),
-            'additional_talk_search_window': RotaSettings.get_value('additional_talk_search_window', 1),
-            'additional_talk_minimum_gap': RotaSettings.get_value('additional_talk_minimum_gap', 20),
-        }
+    # Viewing the rota changes nothing: generating it on every view undid
+    # repairs, such as a recorder dropping out, as soon as anyone looked
+    if request.method == "GET":
+        return render_template("rota.html")
+
+    # Regenerating the rota clears every existing recorder assignment, so it
+    # is restricted to team leaders. The read-only rota views stay open so
+    # recorders can check their own shifts without signing in.
+    if (
+        not current_user.is_authenticated
+        or current_user.email not in app.config["TEAM_LEADERS_EMAILS"]
+    ):
+        return app.login_manager.unauthorized()
 
-    talks = Talk.query.filter(Talk.is_priority.is_(True)).order_by(Talk.start_time)
+    # The whole rota is worked out in memory and written back in one go
+    rota = engine.load_rota()
+    rota.clear()
 
-    for talk in talks:
-        app.logger.error("Finding a recorder for priority talk " + str(talk.id))
+    assigned = engine.generate(rota)
 
-        # Move on if this talk is already being recorded
-        if talk.recorder_name is not None:
-            continue
+    # Optionally, search for a better rota than the greedy one
+    if request.form.get("mode") == "optimise":
+        greedy_coverage = engine.coverage(rota)
+        moves = optimise(rota, app.config["ROTA_OPTIMISE_SECONDS"])
+        _report_optimisation(greedy_coverage, engine.coverage(rota), moves)
 
-        # Move on if the talk has been externally rota-ed in some way
-        if talk.is_rotaed is not True:
-            continue
+    changes = engine.save_rota(rota)
+    app.logger.info(f"Rota: assigned {len(assigned)} talks, {len(changes)} changed")
 
-        # If we've got this far, find a recorder for the talk
-        assigned_recorder = find_recorder_for_talk(talk, rota_settings_cache)
-
-        if assigned_recorder is not None:
-            # If there are any other talks in the same venue starting within the configured window, assign them to the same recorder
-            same_venue_assignment_window = rota_settings_cache['same_venue_assignment_window'] if rota_settings_cache else RotaSettings.get_value('same_venue_assignment_window', 3)
-            for future_talk in Talk.query.filter(
-                Talk.start_time > talk.end_time,
-                Talk.start_time <= talk.start_time + timedelta(hours=same_venue_assignment_window - 1),
-                Talk.venue == talk.venue,
-                Talk.is_priority.is_(True),
-            ).order_by(Talk.start_time):
-                if (
-                    future_talk.start_time
-                    < talk.start_time + timedelta(hours=same_venue_assignment_window - 1)
-                    and talk_would_break_shift_pattern(assigned_recorder, future_talk, rota_settings_cache)
-                    is False
-                    and talk_would_clash(assigned_recorder, future_talk, rota_settings_cache) is False
-                ):
-                    assign_talk_to_recorder(assigned_recorder, future_talk)
-
-    additional_talks = Talk.query.filter(Talk.is_priority.is_(False)).order_by(
-        Talk.start_time
-    )
+    _report_coverage(rota)
 
-    for talk in additional_talks:
-        app.logger.error("Finding a recorder for additional talk " + str(talk.id))
+    return render_template("rota.html")
 
-        # Move on if this talk is already being recorded
-        if talk.recorder_name is not None:
-            continue
 
-        # Move on if the talk isn't to be rota-ed
-        if talk.is_rotaed is not True:
-            continue
+@rota_blueprint.route("/rota/simulate", methods=["POST"])
+def simulate_rota():
+    """What the rota would be with other settings, without changing it.
 
-        # If we've got this far, find a recorder for the talk
-        assigned_recorder = find_recorder_for_talk(talk, rota_settings_cache)
-
-        # If there is an unallocated talk starting after minimum gap within search window, and assigning it wouldn't exceed shift limits, assign it
-        if assigned_recorder is not None:
-            additional_talk_search_window = rota_settings_cache['additional_talk_search_window'] if rota_settings_cache else RotaSettings.get_value('additional_talk_search_window', 1)
-            additional_talk_minimum_gap = rota_settings_cache['additional_talk_minimum_gap'] if rota_settings_cache else RotaSettings.get_value('additional_talk_minimum_gap', 20)
-            for future_talk in (
-                Talk.query.filter(
-                    Talk.start_time > talk.end_time,
-                    Talk.start_time <= talk.end_time + timedelta(hours=additional_talk_search_window),
-                    # recorded_by is a relationship, not a column: comparing it
-                    # to None is the supported way to test for "unassigned".
-                    Talk.recorded_by == None,  # noqa: E711
-                )
-                .order_by(Talk.start_time)
-                .all()
-            ):
-                if (
-                    future_talk.start_time < talk.end_time + timedelta(hours=additional_talk_search_window)
-                    and future_talk.start_time > talk.end_time + timedelta(minutes=additional_talk_minimum_gap)
-                    and talk_would_break_shift_pattern(assigned_recorder, future_talk, rota_settings_cache)
-                    is False
-                    and talk_would_clash(assigned_recorder, future_talk, rota_settings_cache) is False
-                ):
-                    assign_talk_to_recorder(assigned_recorder, future_talk)
-
-    # Add completion message if this was a POST request (rota generation)
-    if request.method == "POST":
-        # Talk.recorded_by is a relationship, so != None is the supported test.
-        priority_talks_count = Talk.query.filter(Talk.is_priority.is_(True)).count()
-        assigned_priority_talks = Talk.query.filter(
-            Talk.is_priority.is_(True), Talk.recorded_by != None  # noqa: E711
-        ).count()
-
-        additional_talks_count = Talk.query.filter(Talk.is_priority.is_(False)).count()
-        assigned_additional_talks = Talk.query.filter(
-            Talk.is_priority.is_(False), Talk.recorded_by != None  # noqa: E711
-        ).count()
-
-        # Check if all talks were allocated
-        unallocated_priority = priority_talks_count - assigned_priority_talks
-        unallocated_additional = additional_talks_count - assigned_additional_talks
-
-        base_message = f"Rota generation completed! Assigned {assigned_priority_talks}/{priority_talks_count} priority talks and {assigned_additional_talks}/{additional_talks_count} additional talks."
-
-        if unallocated_priority > 0 or unallocated_additional > 0:
-            warning_parts = []
-            if unallocated_priority > 0:
-                warning_parts.append(f"{unallocated_priority} priority talk{'s' if unallocated_priority != 1 else ''}")
-            if unallocated_additional > 0:
-                warning_parts.append(f"{unallocated_additional} additional talk{'s' if unallocated_additional != 1 else ''}")
-
-            warning_message = f" WARNING: {' and '.join(warning_parts)} could not be allocated - check recorder availability and rota settings."
-            flash(base_message + warning_message, "warning")
-        else:
-            flash(base_message + " All talks successfully allocated!", "success")
+    Takes {"scenarios": [{"name": ..., "settings": {...}, "optimise": ...}]}
+    and returns a result for each; see simulate.py.
+    """
 
-    return render_template("rota.html")
+    if (
+        not current_user.is_authenticated
+        or current_user.email not in app.config["TEAM_LEADERS_EMAILS"]
+    ):
+        return app.login_manager.unauthorized()
+
+    data = request.get_json(silent=True) or {}
+
+    try:
+        results = simulate(data.get("scenarios"))
+    except ScenarioError as e:
+        return jsonify({"success": False, "error": str(e)})
+
+    return jsonify({"success": True, "scenarios": results})
 
 
 @rota_blueprint.route("/rota_by_venue", methods=["GET"])
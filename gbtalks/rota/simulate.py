@@ -0,0 +1,182 @@
+"""Trying out rota settings without touching the live rota.
+
+Seeing what break_between_shifts = 1 would do used to mean saving it and
+regenerating the rota everyone is working from. simulate() instead loads the
+talks, recorders, settings and live assignments once, then runs the solver on
+copies, one per scenario:
+
+    {"name": "shorter breaks", "settings": {"break_between_shifts": 1}}
+
+Each rota is made from scratch, as "Create New Rota" would. A scenario's
+settings override the saved ones, and "optimise" (true, or a number of
+seconds up to ROTA_OPTIMISE_SECONDS) improves on it as the rota page can. Each
+result has coverage, each recorder's load, and the talks whose recorder would
+differ from the live rota. Nothing is saved.
+
+The web page runs scenarios one after another in the request's own thread:
+each takes milliseconds unless optimised, far less than starting worker
+processes would, and under uWSGI sys.executable isn't Python, so a spawned or
+forkserver worker couldn't start anyway. Forking the server is no better, as
+a worker could inherit a lock some other thread was holding. The command
+line, which has no other threads, runs them in parallel in forked processes
+as conversions do (see scheduling.py); the solver is pure Python, so threads
+wouldn't help. The workers only see the snapshot, which is plain tuples, and
+never use the database.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import get_context
+
+from flask import current_app as app
+
+from gbtalks.models import db
+
+from . import engine
+from .optimise import optimise
+
+# Scenarios one request may run
+MAX_SCENARIOS = 16
+
+# Settings that can't be anything else; see update_rota_settings
+SETTING_LIMITS = {"max_shifts_per_day_limit": (1, 3)}
+
+
+class ScenarioError(ValueError):
+    """A scenario that can't be run, with a message to show the user."""
+
+
+def check_scenario(scenario, max_seconds):
+    """The scenario with its settings as ints and its optimising time in
+    seconds (None to not optimise), or ScenarioError"""
+    if not isinstance(scenario, dict):
+        raise ScenarioError("Each scenario must be an object")
+
+    settings = scenario.get("settings") or {}
+    if not isinstance(settings, dict):
+        raise ScenarioError("A scenario's settings must be an object")
+
+    checked = {}
+    for key, value in settings.items():
+        if key not in engine.DEFAULT_RULES:
+            raise ScenarioError(f"Unknown rota setting: {key}")
+        try:
+            checked[key] = int(value)
+        except (TypeError, ValueError):
+            raise ScenarioError(f"Invalid value for {key}: must be a whole number") from None
+
+        low, high = SETTING_LIMITS.get(key, (0, None))
+        if checked[key] < low:
+            raise ScenarioError(f"Invalid value for {key}: must be at least {low}")
+        if high is not None and checked[key] > high:
+            raise ScenarioError(f"Invalid value for {key}: cannot exceed {high}")
+
+    seconds = scenario.get("optimise")
+    if seconds is True:
+        seconds = max_seconds
+    elif seconds is False:
+        seconds = None
+    elif seconds is not None:
+        try:
+            seconds = min(float(seconds), max_seconds)
+        except (TypeError, ValueError):
+            raise ScenarioError("optimise must be true or a number of seconds") from None
+        if seconds < 0:
+            raise ScenarioError("optimise must be true or a number of seconds")
+
+    name = scenario.get("name") or ", ".join(f"{key}={value}" for key, value in checked.items()) or "current settings"
+    return {"name": str(name), "settings": checked, "optimise": seconds}
+
+
+def snapshot(rota):
+    """The rota as plain data, for sending to worker processes"""
+    return {
+        "talks": [
+            (talk.id, talk.start_time, talk.end_time, talk.venue, talk.is_priority, talk.is_rotaed, talk.is_cancelled)
+            for talk in rota.talks.values()
+        ],
+        "recorders": [
+            (recorder.name, recorder.max_shifts_per_day, recorder.earliest_start_time, recorder.latest_end_time)
+            for recorder in rota.recorders
+            if not recorder.has_dropped_out
+        ],
+        "rules": rota.rules.as_dict(),
+        "live": rota.assignments(),
+    }
+
+
+def run_scenario(snapshot, scenario):
+    """Generate a rota from the snapshot with the scenario's settings, and describe it"""
+    started = time.perf_counter()
+
+    rules = engine.RotaRules(**{**snapshot["rules"], **scenario["settings"]})
+    rota = engine.Rota(
+        [engine.RotaTalk(*talk) for talk in snapshot["talks"]],
+        [engine.RotaRecorder(*recorder) for recorder in snapshot["recorders"]],
+        rules,
+    )
+    engine.generate(rota)
+    if scenario["optimise"]:
+        optimise(rota, scenario["optimise"])
+
+    live = snapshot["live"]
+    coverage = engine.coverage(rota)
+
+    return {
+        "name": scenario["name"],
+        "settings": rules.as_dict(),
+        "coverage": {
+            kind: {"assigned": assigned, "total": total} for kind, (assigned, total) in coverage.items()
+        },
+        "load": {
+            recorder.name: {
+                "talks": len(recorder.talks),
+                "per_day": {
+                    day.isoformat(): recorder.timeline.count_on(day)
+                    for day in sorted({talk.start_time.date() for talk in recorder.talks})
+                },
+            }
+            for recorder in rota.recorders
+        },
+        "changes": {
+            talk_id: {"live": live.get(talk_id), "simulated": name}
+            for talk_id, name in sorted(rota.assignments().items())
+            if name != live.get(talk_id)
+        },
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _reset_db_connections():
+    # Connections inherited from the parent must not be shared
+    db.engine.dispose(close=False)
+
+
+def simulate(scenarios, workers=1):
+    """Run each scenario against the current talks, recorders and settings.
+
+    Needs an app context to load them; returns a result for each scenario, in
+    order. Raises ScenarioError for a scenario that can't be run. With more
+    than one worker they run in forked processes, so only ask for more from a
+    process with no other threads.
+    """
+    if not isinstance(scenarios, list) or not scenarios:
+        raise ScenarioError("Give a list of scenarios to run")
+    if len(scenarios) > MAX_SCENARIOS:
+        raise ScenarioError(f"At most {MAX_SCENARIOS} scenarios can be run at once")
+    max_seconds = app.config["ROTA_OPTIMISE_SECONDS"]
+    scenarios = [check_scenario(scenario, max_seconds) for scenario in scenarios]
+
+    data = snapshot(engine.load_rota())
+
+    workers = min(int(workers), len(scenarios))
+    if workers <= 1:
+        return [run_scenario(data, scenario) for scenario in scenarios]
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("fork"),
+        initializer=_reset_db_connections,
+    ) as executor:
+        return list(executor.map(run_scenario, repeat(data), scenarios))
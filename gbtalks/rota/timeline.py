@@ -0,0 +1,127 @@
+"""A recorder's talks in start order, for answering "is this recorder free?".
+
+Checking a candidate talk against a recorder used to mean walking every talk
+they had. The solver did this several times per candidate, and so did the
+manual assign and swap pages. A Timeline keeps the talks sorted, with their
+start times in a parallel list, so bisect finds the few talks near a time:
+
+    starting_between(a, b)    talks starting between two times
+    overlapping(start, end)   talks overlapping a period at all
+    clashes(talk, gap)        talks the candidate would clash with, allowing
+                              `gap` after each for the recorder to move on
+    within(talk, gap)         the same the other way round: talks starting or
+                              ending during the candidate, or `gap` after it
+    on_day(day)               the talks on a day, for grouping into shifts
+    count_on(day)             how many talks are on a day
+
+Talks can be of any length, so a search has to start early enough to include
+the longest talk that might still be running. The timeline keeps the longest
+duration it has held; removing talks never shortens it, which only makes
+searches look at a few more talks than they need to.
+
+It holds anything with start_time and end_time: the solver's RotaTalks or
+Talk rows.
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+
+
+class Timeline:
+    """Talks in start order, with start times kept alongside for bisecting."""
+
+    def __init__(self, talks=()):
+        # sorted() is stable, so talks starting together keep their order
+        self.talks = sorted(talks, key=lambda talk: talk.start_time)
+        self._starts = [talk.start_time for talk in self.talks]
+        self._per_day = {}
+        self._longest = timedelta(0)
+        for talk in self.talks:
+            self._noted(talk, 1)
+
+    def __len__(self):
+        return len(self.talks)
+
+    def __iter__(self):
+        return iter(self.talks)
+
+    def _noted(self, talk, change):
+        day = talk.start_time.date()
+        self._per_day[day] = self._per_day.get(day, 0) + change
+        self._longest = max(self._longest, talk.end_time - talk.start_time)
+
+    def add(self, talk):
+        # After any talks starting at the same time
+        index = bisect_right(self._starts, talk.start_time)
+        self._starts.insert(index, talk.start_time)
+        self.talks.insert(index, talk)
+        self._noted(talk, 1)
+
+    def remove(self, talk):
+        low = bisect_left(self._starts, talk.start_time)
+        high = bisect_right(self._starts, talk.start_time, low)
+        for index in range(low, high):
+            if self.talks[index] is talk:
+                del self._starts[index]
+                del self.talks[index]
+                self._noted(talk, -1)
+                return
+        raise ValueError(f"{talk!r} is not in the timeline")
+
+    def clear(self):
+        self.talks.clear()
+        self._starts.clear()
+        self._per_day.clear()
+        self._longest = timedelta(0)
+
+    def first(self):
+        return self.talks[0] if self.talks else None
+
+    def last(self):
+        return self.talks[-1] if self.talks else None
+
+    def starting_between(self, after, before):
+        """The talks starting after `after` and before `before`"""
+        low = bisect_right(self._starts, after)
+        high = bisect_left(self._starts, before, low)
+        return self.talks[low:high]
+
+    def overlapping(self, start_time, end_time):
+        """The talks running at some point between start_time and end_time"""
+        low = bisect_right(self._starts, start_time - self._longest)
+        high = bisect_left(self._starts, end_time)
+        return [talk for talk in self.talks[low:high] if talk.end_time > start_time]
+
+    def clashes(self, candidate, gap=timedelta(0)):
+        """The talks `candidate` would clash with: those it starts or ends
+        during, counting `gap` after each as part of it"""
+        low = bisect_left(self._starts, candidate.start_time - gap - self._longest)
+        high = bisect_right(self._starts, candidate.end_time)
+        return [
+            talk
+            for talk in self.talks[low:high]
+            if talk.start_time <= candidate.start_time <= talk.end_time + gap
+            or talk.start_time <= candidate.end_time <= talk.end_time + gap
+        ]
+
+    def within(self, candidate, gap=timedelta(0)):
+        """clashes() the other way round: the talks starting or ending during
+        `candidate`, or within `gap` after it"""
+        low = bisect_left(self._starts, candidate.start_time - self._longest)
+        high = bisect_right(self._starts, candidate.end_time + gap)
+        return [
+            talk
+            for talk in self.talks[low:high]
+            if candidate.start_time <= talk.start_time <= candidate.end_time + gap
+            or candidate.start_time <= talk.end_time <= candidate.end_time + gap
+        ]
+
+    def on_day(self, day):
+        """The talks starting on `day`, a date"""
+        midnight = datetime.combine(day, time.min)
+        low = bisect_left(self._starts, midnight)
+        high = bisect_left(self._starts, midnight + timedelta(days=1), low)
+        return self.talks[low:high]
+
+    def count_on(self, day):
+        return self._per_day.get(day, 0)
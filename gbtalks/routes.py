@@ -1,12 +1,13 @@
 import csv
+import hmac
 import os
-import shutil
 from datetime import datetime, timedelta
 from functools import wraps
 
 import filetype
 import shortuuid
 from flask import (
+    Response,
     current_app,
     flash,
     jsonify,
@@ -24,6 +25,10 @@ from sqlalchemy import asc
 from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
 
+from .audio import invalidate_decoded_asset, retag_talk
+from .conversion import enqueue_conversion
+from .events import capped_event_stream
+from .file_state import changes_since, note_file
 from .libgbtalks import (
     calculate_greenbelt_friday,
     extract_audio_from_video_async,
@@ -32,8 +37,29 @@ from .libgbtalks import (
     get_path_for_video_file,
     get_video_processing_status,
 )
-from .models import Editor, Recorder, Talk, db
+from .media_jobs import EXTRACT_AUDIO, FINISH_UPLOAD, latest_job, queue_position
+from .media_jobs import submit as submit_media_job
+from .metrics import render as render_metrics
+from .metrics import summary as metrics_summary
+from .models import Editor, Recorder, Talk, UploadSession, db
+from .rota.engine import load_rota, save_rota
+from .rota.repair import describe as describe_repair
+from .rota.repair import repair
 from .talks_csv import TalksCsvError, parse_talks_csv
+from .uploads import (
+    chunked_upload_path,
+    claim_upload_for_finishing,
+    expire_upload_sessions,
+    find_duplicate,
+    forget_upload,
+    open_upload_session,
+    record_chunk,
+    record_upload,
+    release_upload_claim,
+    upload_session_id_for,
+    write_chunk,
+    write_upload_status,
+)
 
 # Supported file formats for RAW uploads
 SUPPORTED_RAW_AUDIO_EXTENSIONS = ['mp3']
@@ -164,6 +190,9 @@ def edit_talk():
                 flash("End time must be after start time", "error")
                 return redirect(url_for("edit_talk", talk_id=talk_id))
 
+            # The processed MP3's name and tags are made from these
+            tagged_fields = (talk.title, talk.speaker, talk.description)
+
             # Update talk fields
             talk.title = request.form.get("title")
             talk.description = request.form.get("description")
@@ -181,6 +210,15 @@ def edit_talk():
 
             db.session.commit()
             flash(f"Successfully updated talk: '{talk.title}'", "success")
+
+            if (talk.title, talk.speaker, talk.description) != tagged_fields:
+                try:
+                    if retag_talk(talk):
+                        flash(f"Updated the processed MP3 for talk {talk_id}", "success")
+                except Exception as e:
+                    app.logger.error(f"Error retagging talk {talk_id}: {e}")
+                    flash(f"Could not update the processed MP3 - run flask retag-talks {talk_id}: {str(e)}", "warning")
+
             return redirect(url_for("talks") + "#talk_" +  talk_id)
 
         except ValueError:
@@ -451,7 +489,25 @@ def health_check_page():
 
     health_check = perform_health_check()
 
-    return render_template("health_check.html", health_check=health_check)
+    return render_template(
+        "health_check.html", health_check=health_check, metrics=metrics_summary()
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Upload and media job timings, for Prometheus to scrape"""
+
+    # Prometheus can't log in, so it may send METRICS_TOKEN instead
+    token = app.config.get("METRICS_TOKEN")
+    authorization = request.headers.get("Authorization", "")
+    if not (token and hmac.compare_digest(authorization, f"Bearer {token}")):
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+        if current_user.email not in app.config["TEAM_LEADERS_EMAILS"]:
+            return current_app.login_manager.unauthorized()
+
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.route("/put_alltalks_pdf", methods=["POST"])
@@ -505,6 +561,10 @@ def upload_top_tail():
             filepath = os.path.join(app.config["UPLOAD_DIR"], filename)
             file.save(filepath)
 
+            # Drop the decoded copy of the old jingle; the next talk processed
+            # decodes the new one
+            invalidate_decoded_asset(filepath)
+
             flash(f"Successfully uploaded {file_type}.mp3", "success")
         else:
             flash("File must be an MP3", "error")
@@ -1031,6 +1091,43 @@ def swap_recorder_assignments():
     return redirect(url_for("recorders"))
 
 
+@app.route("/repair_rota", methods=["POST"])
+@login_required
+@current_user_is_team_leader
+def repair_rota():
+    """Mend the rota after talks or recorders changed, leaving everyone else's shifts alone"""
+
+    next_page = "recorders" if request.form.get("next") == "recorders" else "talks"
+
+    try:
+        talk_ids = [int(talk_id) for talk_id in request.form.getlist("talk_id")]
+    except ValueError:
+        flash("Invalid talk ID", "error")
+        return redirect(url_for(next_page))
+
+    # Dropping out lasts, so regenerating the rota doesn't give them talks again
+    dropped_out = request.form.getlist("dropped_out")
+    returned = request.form.getlist("returned")
+    for recorder in Recorder.query.filter(Recorder.name.in_(dropped_out + returned)):
+        recorder.has_dropped_out = recorder.name in dropped_out
+
+    rota = load_rota()
+    changes = repair(
+        rota,
+        talk_ids=talk_ids,
+        recorder_names=request.form.getlist("recorder_name") + returned,
+        dropped_out=dropped_out,
+    )
+    save_rota(rota)
+
+    if changes:
+        flash("Repaired the rota. " + "; ".join(describe_repair(changes)), "success")
+    else:
+        flash("The rota needed no changes", "info")
+
+    return redirect(url_for(next_page))
+
+
 def check_swap_clashes(talk1, talk2, recorder1, recorder2):
     """Check if swapping the recorder assignments would create timing clashes"""
 
@@ -1062,19 +1159,9 @@ def talks_overlap(talk_a, talk_b):
 def front_desk():
     """Management functions for front desk"""
 
-    gb_year = str(app.config["GB_FRIDAY"][2:4])
-    gb_prefix = "gb" + gb_year + "-"
-
-    raw_files = (
-        {
-
-                int(x.name.replace("_RAW.mp3", "").replace(gb_prefix, ""))
-                for x in os.scandir(app.config["UPLOAD_DIR"])
-                if x.name.endswith("RAW.mp3")
-
-        }
-        or set()
-    )
+    # From the file state cache, which only rescans UPLOAD_DIR when it changes
+    file_state_version, talk_files = changes_since()
+    raw_files = {talk_id for talk_id, kinds in talk_files.items() if "raw" in kinds}
 
     past_horizon = datetime.now() + timedelta(minutes=30)
 
@@ -1086,6 +1173,7 @@ def front_desk():
         "front_desk.html",
         talks_to_upload=talks_to_upload,
         raw_talks_available=raw_files,
+        file_state_version=file_state_version,
         supported_audio_extensions=SUPPORTED_RAW_AUDIO_EXTENSIONS,
         supported_video_extensions=SUPPORTED_RAW_VIDEO_EXTENSIONS,
     )
@@ -1148,42 +1236,14 @@ def editing():
                 as_attachment=True,
             )
 
-    gb_year = str(app.config["GB_FRIDAY"][2:4])
-    gb_prefix = "gb" + gb_year + "-"
-
-    raw_files = (
-        {
-
-                x.name.replace("_RAW.mp3", "").replace(gb_prefix, "")
-                for x in os.scandir(app.config["UPLOAD_DIR"])
-                if x.name.endswith("RAW.mp3")
-
-        }
-        or set()
-    )
-    edited_files = (
-        {
-
-                x.name.replace("_EDITED.mp3", "").replace(gb_prefix, "")
-                for x in os.scandir(app.config["UPLOAD_DIR"])
-                if x.name.endswith("EDITED.mp3")
-
-        }
-        or set()
-    )
-    processed_files = (
-        {
-
-                x.name.replace("mp3.mp3", "").replace(gb_prefix, "")
-                for x in os.scandir(app.config["PROCESSED_DIR"])
-                if x.name.endswith("mp3.mp3")
-
-        }
-        or set()
-    )
+    # From the file state cache, which only rescans directories that changed
+    file_state_version, talk_files = changes_since()
+    raw_files = {talk_id for talk_id, kinds in talk_files.items() if "raw" in kinds}
+    edited_files = {talk_id for talk_id, kinds in talk_files.items() if "edited" in kinds}
+    processed_files = {talk_id for talk_id, kinds in talk_files.items() if "processed" in kinds}
 
     talks_to_edit = Talk.query.filter(
-        Talk.id.in_(set(raw_files.difference(edited_files)))
+        Talk.id.in_(raw_files - edited_files)
     ).order_by(asc(Talk.start_time))
 
     # - A way for someone to download raw files, assign a talk to an editor, upload the edited files
@@ -1195,9 +1255,29 @@ def editing():
         raw_talks_available=raw_files,
         edited_talks_available=edited_files,
         processed_talks_available=processed_files,
+        file_state_version=file_state_version,
     )
 
 
+@app.route("/file_state", methods=["GET"])
+@login_required
+@current_user_is_team_leader
+def file_state():
+    """Which files each talk has, for the talks that changed since `since`
+
+    Pages are rendered with the version they saw, so they can keep their rows
+    up to date without reloading.
+    """
+    since = request.args.get("since")
+    version, talks = changes_since(since)
+
+    return jsonify({
+        "success": True,
+        "version": version,
+        "talks": {str(talk_id): kinds for talk_id, kinds in talks.items()},
+    })
+
+
 @app.route("/getfile", methods=["GET"])
 @login_required
 @current_user_is_team_leader
@@ -1258,9 +1338,10 @@ def uploadtalk():
     file = request.files["file"]
 
     if file and file.filename:
-        # Save it to /tmp for now
-        uploaded_file_path = os.path.join("/tmp", shortuuid.uuid())
-        file.save(uploaded_file_path)
+        # Already on disk in UPLOAD_INCOMING_DIR, and hashed, by UploadRequest
+        upload = file.stream
+        uploaded_file_path = upload.path
+        uploaded_file_size, uploaded_file_hash = upload.size, upload.sha256
 
         # Get file extension from filename
         original_filename = file.filename.lower()
@@ -1273,43 +1354,35 @@ def uploadtalk():
         # Only allow video or audio files for raw uploads
         if file_type == "raw" and not (is_video or is_audio):
             flash("RAW files must be audio or video files", "error")
-            os.remove(uploaded_file_path)
             return redirect(url_for(source_path))
         elif file_type != "raw" and not is_audio:
             flash(f"{file_type} files must be audio files", "error")
-            os.remove(uploaded_file_path)
             return redirect(url_for(source_path))
 
-        # Check the size, and then see if another file of the same size exists in the relevant directory for the file type, error if so
-        uploaded_file_size = os.path.getsize(uploaded_file_path)
-
-        for root, _dirs, files in os.walk(app.config["UPLOAD_DIR"]):
-            for name in files:
-                if name.endswith((".mp3", ".mp4", ".mov", ".avi", ".mkv")):
-                    existing_file_path = os.path.join(root, name)
-                    existing_file_size = os.path.getsize(existing_file_path)
-
-                    if existing_file_size == uploaded_file_size:
-                        app.logger.error(
-                            "File size collision detected: %s has size %s bytes, which is the same as uploaded file %s",
-                            existing_file_path,
-                            existing_file_size,
-                            uploaded_file_path,
-                        )
+        # See if this exact file has been uploaded before, and error if so
+        duplicate = find_duplicate(uploaded_file_hash)
+
+        if duplicate is not None:
+            app.logger.error(
+                "Duplicate upload detected: %s has the same contents as uploaded file %s",
+                duplicate.path,
+                uploaded_file_path,
+            )
 
-                        error_message = f"""
-The file you uploaded had the same file size as an existing file: {existing_file_path}; {existing_file_size} bytes
+            error_message = f"""
+The file you uploaded is identical to the {duplicate.file_type} file already uploaded for Talk {duplicate.talk_id}: {duplicate.path}; {duplicate.size} bytes
 
-Your file has been uploaded to {uploaded_file_path}
+Your file has been uploaded to {uploaded_file_path}, and will be deleted after {app.config["UPLOAD_SESSION_TTL"]} hours
 
-This almost certainly means that the file has the same contents. Usually, this means that a mistake is in the process of being made.
+Usually, this means that a mistake is in the process of being made.
 
 Speak to your nearest team leader for advice.
 
-If you are the nearest team leader, check the contents of the existing file and the new file carefully, and make a decision as to which one is the correct one. You might need to delete the existing file to allow this one to be uploaded. Don't forget to clean up when you're done - such as checking for CD files, processed files, database entries, already-shipped USBs, etc.
+If you are the nearest team leader, check which talk this recording really belongs to, and make a decision as to which one is the correct one. You might need to delete the existing file to allow this one to be uploaded. Don't forget to clean up when you're done - such as checking for CD files, processed files, database entries, already-shipped USBs, etc.
 """
 
-                        return render_template("error.html", error_text=error_message)
+            upload.keep()
+            return render_template("error.html", error_text=error_message)
 
         talk = db.session.get(Talk, talk_id)
 
@@ -1318,11 +1391,12 @@ If you are the nearest team leader, check the contents of the existing file and
             try:
                 # Save the video file
                 video_file_path = get_path_for_video_file(talk_id, file_extension)
-                shutil.move(uploaded_file_path, video_file_path)
+                upload.move_to(video_file_path)
+                record_upload(talk_id, file_type, video_file_path, uploaded_file_size, uploaded_file_hash)
 
                 # Start background audio extraction
                 raw_audio_path = get_path_for_file(talk_id, file_type, talk.title, talk.speaker)
-                success, message = extract_audio_from_video_async(video_file_path, raw_audio_path)
+                success, message = extract_audio_from_video_async(video_file_path, raw_audio_path, talk_id)
 
                 if success:
                     flash(f"Successfully uploaded video file for Talk {talk_id}: {talk.title}. Audio extraction started in background.", "success")
@@ -1333,14 +1407,15 @@ If you are the nearest team leader, check the contents of the existing file and
                     flash(f"Failed to start audio extraction: {message}", "error")
 
             except Exception as e:
-                # Clean up on error
-                if os.path.exists(uploaded_file_path):
-                    os.remove(uploaded_file_path)
+                # The upload itself is removed when the request ends
                 flash(f"Error processing video file: {str(e)}", "error")
         else:
             # Handle regular audio files
             target_path = get_path_for_file(talk_id, file_type, talk.title, talk.speaker)
-            shutil.move(uploaded_file_path, target_path)
+            upload.move_to(target_path)
+            record_upload(talk_id, file_type, target_path, uploaded_file_size, uploaded_file_hash)
+            if file_type == "edited":
+                enqueue_conversion(talk_id)
             flash(f"Successfully uploaded {file_type} file for Talk {talk_id}: {talk.title}", "success")
     else:
         flash("No file selected", "error")
@@ -1369,13 +1444,21 @@ def check_video_status():
     # Check processing status
     status, message = get_video_processing_status(raw_audio_path)
 
-    return jsonify({
+    response = {
         "success": True,
         "talk_id": talk_id,
         "status": status,
         "message": message,
         "audio_file_exists": os.path.exists(raw_audio_path)
-    })
+    }
+
+    # Extractions run a few at a time, so say how long the wait is
+    if status == "queued":
+        job = latest_job(EXTRACT_AUDIO, talk_id)
+        if job is not None:
+            response["position"] = queue_position(job)
+
+    return jsonify(response)
 
 
 
@@ -1391,11 +1474,9 @@ def check_ongoing_uploads():
         # Find all upload status files in /tmp
         upload_status_files = glob.glob("/tmp/upload_*.status")
         video_status_files = glob.glob(f"{app.config['UPLOAD_DIR']}/*.status")
-        chunked_upload_dirs = glob.glob("/tmp/chunks_*")
 
         app.logger.info(f"Found upload status files: {upload_status_files}")
         app.logger.info(f"Found video status files: {video_status_files}")
-        app.logger.info(f"Found chunked upload dirs: {chunked_upload_dirs}")
 
         ongoing_uploads = {}
 
@@ -1441,7 +1522,7 @@ def check_ongoing_uploads():
                 with open(status_file) as f:
                     status_content = f.read().strip()
 
-                if status_content == 'processing':
+                if status_content in ('queued', 'processing'):
                     # Extract talk info from the status file path
                     # Status files are named like: gb24-001_RAW.mp3.status
                     base_name = status_file.replace('.status', '')
@@ -1464,50 +1545,28 @@ def check_ongoing_uploads():
                 continue
 
         # Check chunked uploads
-        for chunk_dir in chunked_upload_dirs:
-            try:
-                metadata_file = os.path.join(chunk_dir, "metadata.json")
-                if os.path.exists(metadata_file):
-                    import json
-                    with open(metadata_file) as f:
-                        metadata = json.load(f)
-
-                    session_id = metadata.get('upload_session_id')
-                    talk_id = metadata.get('talk_id')
-                    chunks_received = len(metadata.get('chunks_received', []))
-                    total_chunks = metadata.get('total_chunks', 0)
-
-                    if chunks_received < total_chunks:  # Upload still in progress
-                        ongoing_uploads[f"chunked_{session_id}"] = {
-                            'type': 'chunked_upload',
-                            'talk_id': talk_id,
-                            'chunks_received': chunks_received,
-                            'total_chunks': total_chunks,
-                            'progress_percent': round((chunks_received / total_chunks) * 100),
-                            'status': 'uploading',
-                            'file_name': metadata.get('file_name', 'Unknown'),
-                            'session_id': session_id
-                        }
-                    else:
-                        # Check if reassembly is in progress
-                        reassembly_status_file = os.path.join(chunk_dir, "reassembly.status")
-                        if os.path.exists(reassembly_status_file):
-                            try:
-                                with open(reassembly_status_file) as f:
-                                    reassembly_status = f.read().strip()
-
-                                if reassembly_status in ['starting', 'reassembling']:
-                                    ongoing_uploads[f"reassembly_{session_id}"] = {
-                                        'type': 'reassembly',
-                                        'talk_id': talk_id,
-                                        'status': reassembly_status,
-                                        'file_name': metadata.get('file_name', 'Unknown'),
-                                        'session_id': session_id
-                                    }
-                            except Exception:
-                                pass
-            except Exception:
-                continue
+        for upload_session in UploadSession.query.filter(UploadSession.state.in_(UploadSession.ACTIVE)):
+            session_id = upload_session.id
+
+            if upload_session.state == UploadSession.UPLOADING:
+                ongoing_uploads[f"chunked_{session_id}"] = {
+                    'type': 'chunked_upload',
+                    'talk_id': upload_session.talk_id,
+                    'chunks_received': upload_session.chunks_received,
+                    'total_chunks': upload_session.total_chunks,
+                    'progress_percent': round((upload_session.chunks_received / upload_session.total_chunks) * 100),
+                    'status': 'uploading',
+                    'file_name': upload_session.file_name or 'Unknown',
+                    'session_id': session_id
+                }
+            else:
+                ongoing_uploads[f"reassembly_{session_id}"] = {
+                    'type': 'reassembly',
+                    'talk_id': upload_session.talk_id,
+                    'status': upload_session.state,
+                    'file_name': upload_session.file_name or 'Unknown',
+                    'session_id': session_id
+                }
 
         response_data = {
             "success": True,
@@ -1532,7 +1591,11 @@ def check_ongoing_uploads():
 @login_required
 @current_user_is_team_leader
 def init_chunked_upload():
-    """Initialize a chunked upload session"""
+    """Initialize a chunked upload session, or resume one
+
+    Pass a fingerprint of the file, such as its name, size and modification
+    time, and starting the same upload again carries on where it left off.
+    """
 
     try:
         talk_id = request.form.get("talk_id")
@@ -1540,10 +1603,19 @@ def init_chunked_upload():
         file_name = request.form.get("file_name")
         file_size = request.form.get("file_size")
         total_chunks = request.form.get("total_chunks")
+        chunk_size = request.form.get("chunk_size")
+        fingerprint = request.form.get("fingerprint")
 
         if not all([talk_id, file_type, file_name, file_size, total_chunks]):
             return jsonify({"success": False, "error": "Missing required parameters"})
 
+        file_size = int(file_size)
+        total_chunks = int(total_chunks)
+        chunk_size = int(chunk_size) if chunk_size else -(-file_size // max(total_chunks, 1))
+
+        if chunk_size <= 0 or total_chunks != -(-file_size // chunk_size):
+            return jsonify({"success": False, "error": f"{total_chunks} chunks of {chunk_size} bytes can't make a {file_size} byte file"})
+
         talk = db.session.get(Talk, talk_id)
         if not talk:
             return jsonify({"success": False, "error": f"Talk {talk_id} not found"})
@@ -1559,37 +1631,29 @@ def init_chunked_upload():
         elif file_type != "raw" and not is_audio:
             return jsonify({"success": False, "error": f"{file_type} files must be audio files"})
 
-        # Create upload session
-        upload_session_id = shortuuid.uuid()
-        chunk_dir = os.path.join("/tmp", f"chunks_{upload_session_id}")
-        os.makedirs(chunk_dir, exist_ok=True)
-
-        # Store upload metadata
-        metadata = {
-            "upload_session_id": upload_session_id,
-            "talk_id": talk_id,
-            "file_type": file_type,
-            "file_name": file_name,
-            "file_size": int(file_size),
-            "total_chunks": int(total_chunks),
-            "file_extension": file_extension,
-            "is_video": is_video,
-            "is_audio": is_audio,
-            "chunks_received": [],
-            "created_at": datetime.now().isoformat()
-        }
+        # Tidy away uploads that were given up on
+        expire_upload_sessions()
 
-        metadata_file = os.path.join(chunk_dir, "metadata.json")
-        with open(metadata_file, 'w') as f:
-            import json
-            json.dump(metadata, f)
+        # The same file for the same talk gets the same session, so it can be resumed
+        if fingerprint:
+            upload_session_id = upload_session_id_for(talk_id, file_type, file_size, fingerprint)
+        else:
+            upload_session_id = shortuuid.uuid()
 
-        # Check for existing chunks (resume capability)
-        existing_chunks = []
-        for i in range(int(total_chunks)):
-            chunk_file = os.path.join(chunk_dir, f"chunk_{i}")
-            if os.path.exists(chunk_file):
-                existing_chunks.append(i)
+        try:
+            _, existing_chunks = open_upload_session(
+                upload_session_id,
+                talk_id=int(talk_id),
+                file_type=file_type,
+                file_name=file_name,
+                file_extension=file_extension,
+                is_video=is_video,
+                file_size=file_size,
+                chunk_size=chunk_size,
+                total_chunks=total_chunks,
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)})
 
         return jsonify({
             "success": True,
@@ -1607,56 +1671,60 @@ def init_chunked_upload():
 @login_required
 @current_user_is_team_leader
 def upload_chunk():
-    """Upload a single chunk"""
+    """Upload a single chunk
+
+    The chunk is the raw request body, and upload_session_id and chunk_number
+    are query parameters. Chunks can be sent concurrently and in any order.
+    """
 
     try:
-        upload_session_id = request.form.get("upload_session_id")
-        chunk_number = request.form.get("chunk_number")
+        upload_session_id = request.args.get("upload_session_id")
+        chunk_number = request.args.get("chunk_number")
 
         if not upload_session_id or chunk_number is None:
             return jsonify({"success": False, "error": "Missing upload_session_id or chunk_number"})
 
         chunk_number = int(chunk_number)
-        chunk_dir = os.path.join("/tmp", f"chunks_{upload_session_id}")
+        upload_session = db.session.get(UploadSession, upload_session_id)
 
-        if not os.path.exists(chunk_dir):
+        if upload_session is None:
             return jsonify({"success": False, "error": "Upload session not found"})
 
-        # Load metadata
-        metadata_file = os.path.join(chunk_dir, "metadata.json")
-        if not os.path.exists(metadata_file):
-            return jsonify({"success": False, "error": "Upload session metadata not found"})
+        if upload_session.state != UploadSession.UPLOADING:
+            return jsonify({"success": False, "error": f"Upload session is {upload_session.state}, not uploading"})
 
-        with open(metadata_file) as f:
-            import json
-            metadata = json.load(f)
+        if not 0 <= chunk_number < upload_session.total_chunks:
+            return jsonify({"success": False, "error": f"There is no chunk {chunk_number}"})
 
-        # Get the chunk data
-        if 'chunk' not in request.files:
-            return jsonify({"success": False, "error": "No chunk data provided"})
+        # Every chunk is chunk_size bytes, except perhaps the last
+        offset = chunk_number * upload_session.chunk_size
+        expected_length = min(upload_session.chunk_size, upload_session.file_size - offset)
 
-        chunk_file_obj = request.files['chunk']
-        chunk_path = os.path.join(chunk_dir, f"chunk_{chunk_number}")
+        if request.content_length != expected_length:
+            return jsonify({
+                "success": False,
+                "error": f"Chunk {chunk_number} should be {expected_length} bytes, not {request.content_length}"
+            })
 
-        # Save chunk to disk
-        chunk_file_obj.save(chunk_path)
+        # Write the chunk straight into its place in the upload
+        written = write_chunk(chunked_upload_path(upload_session_id), offset, request.stream, expected_length)
 
-        # Update metadata
-        if chunk_number not in metadata['chunks_received']:
-            metadata['chunks_received'].append(chunk_number)
-            metadata['chunks_received'].sort()
+        if written != expected_length:
+            return jsonify({
+                "success": False,
+                "error": f"Chunk {chunk_number} was cut short: {written} of {expected_length} bytes received"
+            })
 
-            with open(metadata_file, 'w') as f:
-                json.dump(metadata, f)
+        chunks_received = record_chunk(upload_session, chunk_number)
 
         # Check if all chunks received
-        all_chunks_received = len(metadata['chunks_received']) == metadata['total_chunks']
+        all_chunks_received = chunks_received == upload_session.total_chunks
 
         return jsonify({
             "success": True,
             "chunk_number": chunk_number,
-            "chunks_received": len(metadata['chunks_received']),
-            "total_chunks": metadata['total_chunks'],
+            "chunks_received": chunks_received,
+            "total_chunks": upload_session.total_chunks,
             "upload_complete": all_chunks_received,
             "message": f"Chunk {chunk_number} uploaded successfully"
         })
@@ -1670,7 +1738,7 @@ def upload_chunk():
 @login_required
 @current_user_is_team_leader
 def complete_chunked_upload():
-    """Complete a chunked upload by reassembling chunks"""
+    """Complete a chunked upload by checking it and moving it into place"""
 
     try:
         upload_session_id = request.form.get("upload_session_id")
@@ -1678,152 +1746,59 @@ def complete_chunked_upload():
         if not upload_session_id:
             return jsonify({"success": False, "error": "Missing upload_session_id"})
 
-        chunk_dir = os.path.join("/tmp", f"chunks_{upload_session_id}")
-        metadata_file = os.path.join(chunk_dir, "metadata.json")
+        upload_session = db.session.get(UploadSession, upload_session_id)
 
-        if not os.path.exists(metadata_file):
+        if upload_session is None:
             return jsonify({"success": False, "error": "Upload session not found"})
 
-        # Load metadata
-        with open(metadata_file) as f:
-            import json
-            metadata = json.load(f)
-
         # Verify all chunks are present
-        if len(metadata['chunks_received']) != metadata['total_chunks']:
+        if upload_session.chunks_received != upload_session.total_chunks:
             return jsonify({
                 "success": False,
-                "error": f"Missing chunks: {metadata['total_chunks'] - len(metadata['chunks_received'])} chunks not received"
+                "error": f"Missing chunks: {upload_session.total_chunks - upload_session.chunks_received} chunks not received"
             })
 
-        # Get talk info before background thread (while we have database context)
-        talk_id = metadata['talk_id']
-        file_type = metadata['file_type']
-        file_extension = metadata['file_extension']
-        is_video = metadata['is_video']
-        expected_file_size = metadata['file_size']
+        talk_id = upload_session.talk_id
+        file_type = upload_session.file_type
 
         talk = db.session.get(Talk, talk_id)
         if not talk:
             return jsonify({"success": False, "error": f"Talk {talk_id} not found"})
 
-        talk_title = talk.title
-        talk_speaker = talk.speaker
-
-        # Determine final file path
-        if file_type == "raw" and is_video:
-            final_path = get_path_for_video_file(talk_id, file_extension)
-        else:
-            final_path = get_path_for_file(talk_id, file_type, talk_title, talk_speaker)
-
-        # Create status file for tracking reassembly
-        reassembly_status_file = os.path.join(chunk_dir, "reassembly.status")
-
-        # Capture the current app instance for background thread
-        flask_app = current_app._get_current_object()
+        # Only one request gets to queue the job, however many are sent at
+        # once; the others (say a retry) are told how it's going
+        if not claim_upload_for_finishing(upload_session_id):
+            db.session.refresh(upload_session)
+            if upload_session.state == UploadSession.ERROR:
+                return jsonify({"success": False, "error": f"Upload failed: {upload_session.error}"})
 
-        # Reassemble file in background thread
-        import threading
-
-        def reassemble_file():
-            # Create Flask application context for background thread
-            with flask_app.app_context():
-                try:
-                    # Write status: starting
-                    with open(reassembly_status_file, 'w') as f:
-                        f.write("starting")
-
-                    # Verify all chunks exist before starting
-                    missing_chunks = []
-                    for chunk_num in range(metadata['total_chunks']):
-                        chunk_path = os.path.join(chunk_dir, f"chunk_{chunk_num}")
-                        if not os.path.exists(chunk_path):
-                            missing_chunks.append(chunk_num)
-
-                    if missing_chunks:
-                        error_msg = f"Missing chunks: {missing_chunks}"
-                        with open(reassembly_status_file, 'w') as f:
-                            f.write(f"error:{error_msg}")
-                        flask_app.logger.error(f"Reassembly failed for talk {talk_id}: {error_msg}")
-                        return
-
-                    # Write status: reassembling
-                    with open(reassembly_status_file, 'w') as f:
-                        f.write("reassembling")
-
-                    # Reassemble chunks
-                    flask_app.logger.info(f"Starting reassembly for talk {talk_id}: {final_path}")
-                    bytes_written = 0
-
-                    with open(final_path, 'wb') as output_file:
-                        for chunk_num in range(metadata['total_chunks']):
-                            chunk_path = os.path.join(chunk_dir, f"chunk_{chunk_num}")
-                            try:
-                                with open(chunk_path, 'rb') as chunk_file:
-                                    chunk_data = chunk_file.read()
-                                    output_file.write(chunk_data)
-                                    bytes_written += len(chunk_data)
-                            except Exception as e:
-                                error_msg = f"Error reading chunk {chunk_num}: {str(e)}"
-                                with open(reassembly_status_file, 'w') as f:
-                                    f.write(f"error:{error_msg}")
-                                flask_app.logger.error(f"Reassembly failed for talk {talk_id}: {error_msg}")
-                                # Clean up partial file
-                                if os.path.exists(final_path):
-                                    os.remove(final_path)
-                                return
-
-                    # Verify file size
-                    if bytes_written != expected_file_size:
-                        error_msg = f"File size mismatch: expected {expected_file_size}, got {bytes_written}"
-                        with open(reassembly_status_file, 'w') as f:
-                            f.write(f"error:{error_msg}")
-                        flask_app.logger.error(f"Reassembly failed for talk {talk_id}: {error_msg}")
-                        # Clean up incorrect file
-                        if os.path.exists(final_path):
-                            os.remove(final_path)
-                        return
-
-                    # Write status: success
-                    with open(reassembly_status_file, 'w') as f:
-                        f.write("success")
-
-                    flask_app.logger.info(f"Reassembly completed for talk {talk_id}: {final_path} ({bytes_written} bytes)")
-
-                    # Start video processing if needed
-                    if file_type == "raw" and is_video:
-                        raw_audio_path = get_path_for_file(talk_id, file_type, talk_title, talk_speaker)
-                        extract_audio_from_video_async(final_path, raw_audio_path)
-
-                    # Clean up chunks only after successful reassembly
-                    import shutil
-                    shutil.rmtree(chunk_dir)
-
-                except Exception as e:
-                    error_msg = f"Unexpected error during reassembly: {str(e)}"
-                    try:
-                        with open(reassembly_status_file, 'w') as f:
-                            f.write(f"error:{error_msg}")
-                    except Exception:
-                        pass
-                    flask_app.logger.error(f"Reassembly failed for talk {talk_id}: {error_msg}")
-                    # Clean up partial file
-                    if os.path.exists(final_path):
-                        try:
-                            os.remove(final_path)
-                        except Exception:
-                            pass
+            return jsonify({
+                "success": True,
+                "message": f"Upload is already {upload_session.state}.",
+                "status": upload_session.state,
+                "talk_id": talk_id,
+                "file_type": file_type,
+                "upload_session_id": upload_session_id
+            })
 
-        # Start reassembly in background
-        reassembly_thread = threading.Thread(target=reassemble_file)
-        reassembly_thread.daemon = True
-        reassembly_thread.start()
+        # Hashing reads the whole file, so leave it to the media job runner.
+        # If it can't be queued, nothing would ever move the session on from
+        # starting, so hand it back to be completed again
+        try:
+            submit_media_job(FINISH_UPLOAD, talk_id, upload_session_id=upload_session_id)
+        except Exception:
+            db.session.rollback()
+            job = latest_job(FINISH_UPLOAD, talk_id)
+            if job is None or job.arguments.get("upload_session_id") != upload_session_id:
+                release_upload_claim(upload_session_id)
+            raise
 
         return jsonify({
             "success": True,
-            "message": "Upload completed successfully. File is being reassembled.",
-            "talk_id": metadata['talk_id'],
-            "file_type": metadata['file_type'],
+            "message": "Upload completed successfully. File is being verified.",
+            "status": UploadSession.STARTING,
+            "talk_id": talk_id,
+            "file_type": file_type,
             "upload_session_id": upload_session_id
         })
 
@@ -1844,26 +1819,25 @@ def check_reassembly_status():
         return jsonify({"success": False, "error": "No session_id provided"})
 
     try:
-        chunk_dir = os.path.join("/tmp", f"chunks_{upload_session_id}")
-        reassembly_status_file = os.path.join(chunk_dir, "reassembly.status")
+        upload_session = db.session.get(UploadSession, upload_session_id)
 
-        if not os.path.exists(reassembly_status_file):
-            # Check if chunk dir exists at all
-            if not os.path.exists(chunk_dir):
-                return jsonify({
-                    "success": True,
-                    "status": "completed",
-                    "message": "Reassembly completed (chunks cleaned up)"
-                })
-            else:
-                return jsonify({
-                    "success": True,
-                    "status": "not_started",
-                    "message": "Reassembly not yet started"
-                })
+        if upload_session is None:
+            return jsonify({
+                "success": True,
+                "status": "error",
+                "message": "Upload session not found"
+            })
 
-        with open(reassembly_status_file) as f:
-            status_content = f.read().strip()
+        if upload_session.state == UploadSession.UPLOADING:
+            return jsonify({
+                "success": True,
+                "status": "not_started",
+                "message": "Reassembly not yet started"
+            })
+
+        status_content = upload_session.state
+        if status_content == UploadSession.ERROR:
+            status_content = f"error:{upload_session.error}"
 
         if status_content == "starting":
             return jsonify({
@@ -1871,11 +1845,11 @@ def check_reassembly_status():
                 "status": "starting",
                 "message": "Reassembly initializing..."
             })
-        elif status_content == "reassembling":
+        elif status_content == "verifying":
             return jsonify({
                 "success": True,
-                "status": "reassembling",
-                "message": "Reassembling file from chunks..."
+                "status": "verifying",
+                "message": "Verifying uploaded file..."
             })
         elif status_content == "success":
             return jsonify({
@@ -1901,6 +1875,25 @@ def check_reassembly_status():
         return jsonify({"success": False, "error": f"Error checking reassembly status: {str(e)}"})
 
 
+@app.route("/events", methods=["GET"])
+@login_required
+@current_user_is_team_leader
+def events():
+    """Stream upload, reassembly and video processing progress as Server-Sent Events"""
+
+    last_event_id = request.headers.get("Last-Event-ID", type=int)
+
+    return Response(
+        capped_event_stream(last_event_id, app.config["SSE_MAX_STREAMS"]),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Don't let nginx hold events back in its buffer
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
 @app.route("/upload_progress", methods=["GET"])
 @login_required
 @current_user_is_team_leader
@@ -1991,7 +1984,10 @@ def upload_progress():
 @login_required
 @current_user_is_team_leader
 def uploadtalk_ajax():
-    """AJAX endpoint for uploading talk files with JSON response"""
+    """AJAX endpoint for uploading talk files with JSON response
+
+    Pass ?upload_session_id=... to follow the upload with /upload_progress.
+    """
 
     file_type = request.form.get("file_type")
     talk_id = request.form.get("talk_id")
@@ -2004,13 +2000,29 @@ def uploadtalk_ajax():
     if not file or not file.filename:
         return jsonify({"success": False, "error": "No file selected"})
 
+    # Already on disk in UPLOAD_INCOMING_DIR, and hashed, by UploadRequest
+    upload = file.stream
+    write_upload_status(upload.upload_session_id, "processing", talk_id)
+
+    response = _store_ajax_upload(upload, file.filename, file_type, talk_id)
+
+    if response["success"]:
+        write_upload_status(upload.upload_session_id, f"success:{response['message']}", talk_id)
+    else:
+        write_upload_status(upload.upload_session_id, f"error:{response['error']}", talk_id)
+
+    return jsonify(response)
+
+
+def _store_ajax_upload(upload, filename, file_type, talk_id):
+    """Check a streamed upload and move it into place, for uploadtalk_ajax"""
+
     try:
-        # Save it to /tmp for now
-        uploaded_file_path = os.path.join("/tmp", shortuuid.uuid())
-        file.save(uploaded_file_path)
+        uploaded_file_path = upload.path
+        uploaded_file_size, uploaded_file_hash = upload.size, upload.sha256
 
         # Get file extension from filename
-        original_filename = file.filename.lower()
+        original_filename = filename.lower()
         file_extension = original_filename.split('.')[-1] if '.' in original_filename else ''
 
         # Determine file type based on extension
@@ -2019,75 +2031,66 @@ def uploadtalk_ajax():
 
         # Only allow video or audio files for raw uploads
         if file_type == "raw" and not (is_video or is_audio):
-            os.remove(uploaded_file_path)
-            return jsonify({"success": False, "error": "RAW files must be audio or video files"})
+            return {"success": False, "error": "RAW files must be audio or video files"}
         elif file_type != "raw" and not is_audio:
-            os.remove(uploaded_file_path)
-            return jsonify({"success": False, "error": f"{file_type} files must be audio files"})
+            return {"success": False, "error": f"{file_type} files must be audio files"}
 
-        # Check the size, and then see if another file of the same size exists in the relevant directory for the file type, error if so
-        uploaded_file_size = os.path.getsize(uploaded_file_path)
-
-        for root, _dirs, files in os.walk(app.config["UPLOAD_DIR"]):
-            for name in files:
-                if name.endswith((".mp3", ".mp4", ".mov", ".avi", ".mkv")):
-                    existing_file_path = os.path.join(root, name)
-                    existing_file_size = os.path.getsize(existing_file_path)
-
-                    if existing_file_size == uploaded_file_size:
-                        app.logger.error(
-                            "File size collision detected: %s has size %s bytes, which is the same as uploaded file %s",
-                            existing_file_path,
-                            existing_file_size,
-                            uploaded_file_path,
-                        )
+        # See if this exact file has been uploaded before, and error if so
+        duplicate = find_duplicate(uploaded_file_hash)
 
-                        os.remove(uploaded_file_path)
-                        return jsonify({
-                            "success": False,
-                            "error": f"File size collision detected with existing file: {existing_file_path} ({existing_file_size} bytes). This usually means duplicate content."
-                        })
+        if duplicate is not None:
+            app.logger.error(
+                "Duplicate upload detected: %s has the same contents as uploaded file %s",
+                duplicate.path,
+                uploaded_file_path,
+            )
+
+            return {
+                "success": False,
+                "error": f"This file is identical to the {duplicate.file_type} file already uploaded for Talk {duplicate.talk_id}: {duplicate.path} ({duplicate.size} bytes)."
+            }
 
         talk = db.session.get(Talk, talk_id)
         if not talk:
-            os.remove(uploaded_file_path)
-            return jsonify({"success": False, "error": f"Talk {talk_id} not found"})
+            return {"success": False, "error": f"Talk {talk_id} not found"}
 
         # Handle video files for raw uploads
         if file_type == "raw" and is_video:
             # Save the video file
             video_file_path = get_path_for_video_file(talk_id, file_extension)
-            shutil.move(uploaded_file_path, video_file_path)
+            upload.move_to(video_file_path)
+            record_upload(talk_id, file_type, video_file_path, uploaded_file_size, uploaded_file_hash)
 
             # Start background audio extraction
             raw_audio_path = get_path_for_file(talk_id, file_type, talk.title, talk.speaker)
-            success, message = extract_audio_from_video_async(video_file_path, raw_audio_path)
+            success, message = extract_audio_from_video_async(video_file_path, raw_audio_path, talk_id)
 
             if success:
-                return jsonify({
+                return {
                     "success": True,
                     "message": f"Successfully uploaded video file for Talk {talk_id}: {talk.title}. Audio extraction started in background."
-                })
+                }
             else:
                 # If we can't start background processing, clean up and report error
                 if os.path.exists(video_file_path):
                     os.remove(video_file_path)
-                return jsonify({"success": False, "error": f"Failed to start audio extraction: {message}"})
+                return {"success": False, "error": f"Failed to start audio extraction: {message}"}
         else:
             # Handle regular audio files
             target_path = get_path_for_file(talk_id, file_type, talk.title, talk.speaker)
-            shutil.move(uploaded_file_path, target_path)
-            return jsonify({
+            upload.move_to(target_path)
+            record_upload(talk_id, file_type, target_path, uploaded_file_size, uploaded_file_hash)
+            if file_type == "edited":
+                enqueue_conversion(talk_id)
+            return {
                 "success": True,
                 "message": f"Successfully uploaded {file_type} file for Talk {talk_id}: {talk.title}"
-            })
+            }
 
     except Exception as e:
-        # Clean up on error
-        if 'uploaded_file_path' in locals() and os.path.exists(uploaded_file_path):
-            os.remove(uploaded_file_path)
+        # The upload itself is removed when the request ends, unless it was moved
         app.logger.error(f"Error in uploadtalk_ajax: {str(e)}")
-        return jsonify({"success": False, "error": f"Error processing file: {str(e)}"})
+        return {"success": False, "error": f"Error processing file: {str(e)}"}
 
 
 @app.route("/uploadrecordernotes", methods=["POST"])
@@ -2109,7 +2112,7 @@ def uploadrecordernotes():
     if file and file.filename:
         kind = filetype.guess(file.read(261))
         if kind.extension == "jpg":
-            file.save(
+            notes_path = (
                 app.config["IMG_DIR"]
                 + "/gb"
                 + str(app.config["GB_FRIDAY"][2:4])
@@ -2117,6 +2120,8 @@ def uploadrecordernotes():
                 + talk_id
                 + "recorder_notes.jpg"
             )
+            file.save(notes_path)
+            note_file(notes_path)
             talk = db.session.get(Talk, talk_id)
             flash(f"Successfully uploaded recorder notes photo for Talk {talk_id}: {talk.title}", "success")
         else:
@@ -2138,7 +2143,9 @@ def deletetalk():
 
     talk = db.session.get(Talk, talk_id)
 
-    os.remove(get_path_for_file(talk_id, file_type, talk.title, talk.speaker))
+    path = get_path_for_file(talk_id, file_type, talk.title, talk.speaker)
+    os.remove(path)
+    forget_upload(path)
 
     source_path = request.referrer.split("/")[-1]
     return redirect(url_for(source_path))
@@ -0,0 +1,178 @@
+"""How many talks to convert at once, and in what order.
+
+The festival box also serves uploads, so conversion is sized from the cores
+and memory actually available rather than a fixed pool. Each conversion is one
+ffmpeg pipeline, which uses about a core and streams the audio through, so its
+footprint is mostly a fixed cost plus a little for every hour of audio.
+
+Work is ordered priority talks first, then shortest first, so the talks people
+are waiting for come out soonest after a busy session.
+"""
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app as app
+from mutagen import MutagenError
+from mutagen.mp3 import MP3
+
+from .libgbtalks import get_path_for_file
+from .models import Talk, db
+
+MB = 1024 * 1024
+
+# Rough resident size of one conversion: the worker process and its ffmpeg
+JOB_MEMORY_BASE = 250 * MB
+JOB_MEMORY_PER_HOUR = 50 * MB
+
+# Leave this much of MemAvailable for uwsgi, uploads and the page cache
+MEMORY_HEADROOM = 0.8
+
+
+def talk_duration(path):
+    """Length in seconds from the MP3 header, or None if it can't be read"""
+    try:
+        return MP3(path).info.length
+    except (MutagenError, OSError):
+        return None
+
+
+def estimate_job_memory(duration):
+    if duration is None:
+        duration = 3600
+    return JOB_MEMORY_BASE + int(JOB_MEMORY_PER_HOUR * duration / 3600)
+
+
+def available_memory():
+    """MemAvailable from /proc/meminfo in bytes, or None off Linux"""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def memory_budget(override_mb=None):
+    """Bytes conversions may use, from the override, config or free memory"""
+    override_mb = override_mb or app.config["CONVERSION_MEMORY_BUDGET_MB"]
+    if override_mb:
+        return int(override_mb) * MB
+
+    available = available_memory()
+    if available is None:
+        return None
+    return int(available * MEMORY_HEADROOM)
+
+
+def worker_count(override=None, budget=None):
+    """Talks to convert at once, from the override, config or the hardware"""
+    override = override or app.config["CONVERSION_WORKERS"]
+    if override:
+        return int(override)
+
+    # Keep a core back for the web app on anything bigger than a laptop
+    cpus = available_cpus()
+    count = cpus - 1 if cpus > 2 else cpus
+
+    if budget is not None:
+        count = min(count, budget // estimate_job_memory(None))
+
+    return max(1, count)
+
+
+def order_for_conversion(talk_ids):
+    """(talk_id, duration) pairs, priority talks first and then shortest first"""
+
+    talk_ids = [int(talk_id) for talk_id in talk_ids]
+    priority = {
+        talk.id
+        for talk in Talk.query.filter(Talk.id.in_(talk_ids), Talk.is_priority.is_(True))
+    }
+
+    jobs = [
+        (talk_id, talk_duration(get_path_for_file(talk_id, "edited")))
+        for talk_id in talk_ids
+    ]
+    return sorted(
+        jobs,
+        key=lambda job: (job[0] not in priority, job[1] is None, job[1] or 0, job[0]),
+    )
+
+
+def _reset_db_connections():
+    # Connections inherited from the parent must not be shared
+    db.engine.dispose(close=False)
+
+
+def run_scheduled(process, jobs, workers, budget=None):
+    """Run process(talk_id) for each (talk_id, duration) in `jobs`, in order.
+
+    No more than `workers` run at once, and a job only starts if its estimated
+    memory fits alongside the ones already running. Yields (talk_id, result,
+    error) as each one finishes.
+
+    If a worker dies, say killed for running out of memory, the pool can't be
+    used again. Every talk still running or waiting is then yielded as failed,
+    with a BrokenProcessPool error, and nothing more is started.
+    """
+
+    pending = deque(jobs)
+    running = {}
+    reserved = 0
+
+    # fork, so the workers inherit the app context as Pool's always have
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_reset_db_connections,
+    ) as executor:
+        while pending or running:
+            try:
+                while pending and len(running) < workers:
+                    talk_id, duration = pending[0]
+                    needed = estimate_job_memory(duration)
+
+                    # Something always runs, however big it is
+                    if running and budget is not None and reserved + needed > budget:
+                        break
+
+                    running[executor.submit(process, talk_id)] = (talk_id, needed)
+                    pending.popleft()
+                    reserved += needed
+            except BrokenProcessPool:
+                break
+
+            broken = False
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool):
+                    broken = True
+                    continue
+
+                talk_id, needed = running.pop(future)
+                reserved -= needed
+                yield talk_id, (None if error else future.result()), error
+
+            if broken:
+                break
+
+        # Only left if a worker died; which talk it was running can't be told
+        error = BrokenProcessPool(
+            "A conversion process died, perhaps killed for running out of memory, "
+            "so the talks still running or waiting were not converted"
+        )
+        for talk_id, _ in [*running.values(), *pending]:
+            yield talk_id, None, error
@@ -0,0 +1,236 @@
+"""Scratch space for talks being converted.
+
+Each conversion gets its own directory under SCRATCH_DIR, and the outputs are
+only moved into PROCESSED_DIR, WEB_MP3_DIR and CD_DIR once they are complete.
+A processed MP3 therefore always means a finished talk, however the worker
+that made it died.
+
+Before a job starts it reserves the disk space it is expected to need, mostly
+the CD audio at 10 MB a minute. The reservation is written into the job's
+directory, so every worker process can see what the others have claimed. A job
+that does not fit waits until enough earlier jobs have finished. The total can
+also be capped with SCRATCH_QUOTA_MB, for when SCRATCH_DIR is a tmpfs.
+
+Job directories are named after the process that owns them. Any whose process
+is no longer running are removed by sweep_scratch(), which the workers call
+when they start, and before every reservation.
+"""
+
+import errno
+import fcntl
+import json
+import os
+import shutil
+import socket
+import time
+from contextlib import contextmanager
+
+from flask import current_app as app
+
+MB = 1024 * 1024
+
+# Bytes per second of output: 16-bit stereo CD audio plus one 128k MP3
+CD_BYTES_PER_SECOND = 44100 * 2 * 2
+MP3_BYTES_PER_SECOND = 128000 // 8
+
+# Used when a talk's length can't be read from its header
+UNKNOWN_DURATION = 3 * 3600
+
+RESERVATION_FILE = ".reservation"
+
+
+class ScratchSpaceError(RuntimeError):
+    """Raised when a job cannot get the scratch space it needs."""
+
+
+def estimate_scratch_bytes(duration):
+    """Disk needed to convert a talk `duration` seconds long, with a margin"""
+    if duration is None:
+        duration = UNKNOWN_DURATION
+
+    # Allow for the top and tail, and a little over
+    seconds = duration + 120
+    return int(seconds * (CD_BYTES_PER_SECOND + MP3_BYTES_PER_SECOND) * 1.05)
+
+
+def _scratch_dir():
+    path = app.config["SCRATCH_DIR"]
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _owner_is_alive(reservation):
+    if reservation.get("host") != socket.gethostname():
+        # Can't tell, so leave it to that machine's sweep
+        return True
+
+    try:
+        os.kill(reservation["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_reservation(job_dir):
+    try:
+        with open(os.path.join(job_dir, RESERVATION_FILE)) as reservation:
+            return json.load(reservation)
+    except (OSError, ValueError):
+        return None
+
+
+def _directory_size(path):
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _live_jobs(scratch_dir):
+    """(path, reservation) for each job directory whose process is running"""
+    jobs = []
+    for entry in os.scandir(scratch_dir):
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+
+        reservation = _read_reservation(entry.path)
+        if reservation is not None and _owner_is_alive(reservation):
+            jobs.append((entry.path, reservation))
+    return jobs
+
+
+def sweep_scratch():
+    """Remove job directories left behind by processes that have gone away"""
+    scratch_dir = _scratch_dir()
+    removed = []
+
+    with _locked(scratch_dir):
+        live = {path for path, _ in _live_jobs(scratch_dir)}
+        for entry in os.scandir(scratch_dir):
+            if entry.is_dir(follow_symlinks=False) and entry.path not in live:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed.append(entry.name)
+
+    return removed
+
+
+@contextmanager
+def _locked(scratch_dir):
+    with open(os.path.join(scratch_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def scratch_capacity(scratch_dir, live_jobs):
+    """Bytes that are, or will be, free for new jobs once live ones finish
+    writing what they reserved."""
+    stat = os.statvfs(scratch_dir)
+    free = stat.f_bavail * stat.f_frsize
+
+    reserved = sum(reservation["bytes"] for _, reservation in live_jobs)
+    written = sum(_directory_size(path) for path, _ in live_jobs)
+
+    capacity = free + written - reserved - app.config["SCRATCH_HEADROOM_MB"] * MB
+
+    quota_mb = app.config["SCRATCH_QUOTA_MB"]
+    if quota_mb:
+        capacity = min(capacity, int(quota_mb) * MB - reserved)
+
+    return capacity
+
+
+def _try_reserve(scratch_dir, name, needed):
+    """Create the job directory if `needed` bytes fit, returning its path"""
+    with _locked(scratch_dir):
+        live_jobs = _live_jobs(scratch_dir)
+
+        if needed > scratch_capacity(scratch_dir, live_jobs):
+            if not live_jobs:
+                raise ScratchSpaceError(
+                    f"{needed // MB} MB of scratch space needed but only "
+                    f"{max(scratch_capacity(scratch_dir, []), 0) // MB} MB is available"
+                )
+            return None
+
+        job_dir = os.path.join(scratch_dir, name)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        os.makedirs(job_dir)
+
+        with open(os.path.join(job_dir, RESERVATION_FILE), "w") as reservation:
+            json.dump(
+                {"host": socket.gethostname(), "pid": os.getpid(), "bytes": needed},
+                reservation,
+            )
+        return job_dir
+
+
+@contextmanager
+def scratch_job(talk_id, needed, poll_interval=5):
+    """A scratch directory with `needed` bytes set aside for it.
+
+    Waits, up to SCRATCH_WAIT_TIMEOUT seconds, for other jobs to free enough
+    space. The directory and everything left in it are removed afterwards.
+    """
+    sweep_scratch()
+    scratch_dir = _scratch_dir()
+    name = f"talk{int(talk_id):03d}-{os.getpid()}"
+
+    deadline = time.monotonic() + app.config["SCRATCH_WAIT_TIMEOUT"]
+    while (job_dir := _try_reserve(scratch_dir, name, needed)) is None:
+        if time.monotonic() >= deadline:
+            raise ScratchSpaceError(
+                f"Timed out waiting for {needed // MB} MB of scratch space for talk {talk_id}"
+            )
+        time.sleep(poll_interval)
+
+    try:
+        yield job_dir
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def move_into_place(source, destination):
+    """Move a finished file or directory out of scratch space.
+
+    A rename where possible; across filesystems it is copied next to
+    `destination` and then renamed, so nothing is ever seen half-written.
+    An existing directory at `destination` is replaced.
+    """
+    destination = destination.rstrip("/")
+
+    if os.path.isdir(destination) and not os.path.islink(destination):
+        shutil.rmtree(destination)
+
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    partial_path = f"{destination}.{os.getpid()}.partial"
+    try:
+        if os.path.isdir(source):
+            shutil.copytree(source, partial_path)
+        else:
+            shutil.copy2(source, partial_path)
+        os.replace(partial_path, destination)
+    finally:
+        if os.path.isdir(partial_path):
+            shutil.rmtree(partial_path)
+        elif os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    if os.path.isdir(source):
+        shutil.rmtree(source)
+    else:
+        os.remove(source)
@@ -0,0 +1,638 @@
+"""Receiving uploaded recordings, and the index of what has been uploaded.
+
+Talk uploads are streamed straight to disk as the request body arrives: the
+multipart parser is handed a StreamedUpload rather than its usual temporary
+file, which writes each block into UPLOAD_INCOMING_DIR (on the same filesystem
+as UPLOAD_DIR) and hashes it on the way. Once the upload has been checked it is
+renamed into place, so a recording is written to disk exactly once.
+
+Every file that lands in UPLOAD_DIR through the upload pages is recorded in the
+uploaded_files table with that sha256. Spotting a second upload of the same
+recording is then an indexed lookup rather than a walk of the whole upload
+directory, and it only matches files that really are the same, not ones that
+happen to share a size. The modification time is recorded too, so a file that
+has been replaced since is hashed again before it counts as a match.
+
+If the client names an upload session (?upload_session_id=...), progress is
+published as "upload" events as the bytes arrive, and written to the session's
+status file for /upload_progress.
+
+Large files are sent in chunks, several at once and in any order. The file is
+allocated at its full size in UPLOAD_INCOMING_DIR when the session starts, and
+each chunk is written straight to its own offset in it, so finishing the upload
+is a hash and a rename rather than a second copy of every byte. The session,
+and which chunks have arrived, are kept in the upload_sessions and
+upload_chunks tables.
+
+A session's id comes from what is being uploaded, not chance: the talk, the
+file type, the size and a fingerprint of the file from the browser. Starting
+the same upload again after a dropped connection finds the same session, and
+only the chunks that never arrived are sent. Sessions nobody has touched for
+UPLOAD_SESSION_TTL hours are deleted, with their partial files.
+"""
+
+import errno
+import hashlib
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Request
+from flask import current_app as app
+from sqlalchemy import func, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+
+from .conversion import enqueue_conversion
+from .events import publish
+from .file_state import note_file
+from .libgbtalks import (
+    extract_audio_from_video_async,
+    file_sha256,
+    get_path_for_file,
+    get_path_for_video_file,
+)
+from .metrics import (
+    CHUNK_RECEIVE_SECONDS,
+    CHUNK_WRITE_SECONDS,
+    UPLOAD_BYTES,
+    UPLOAD_SECONDS,
+    UPLOAD_SPEED,
+    UPLOAD_VERIFY_SECONDS,
+    UPLOAD_WRITE_SECONDS,
+    UPLOADS,
+)
+from .models import Talk, UploadChunk, UploadedFile, UploadSession, db
+
+# gb26-007_RAW.mp3, gb26-007_EDITED.mp3, gb26-007_VIDEO.mp4
+UPLOAD_NAME = re.compile(r"^gb\d\d-(\d+)_(RAW|EDITED|VIDEO)\.\w+$")
+
+# Endpoints whose file uploads are streamed to UPLOAD_INCOMING_DIR
+STREAMED_ENDPOINTS = {"uploadtalk", "uploadtalk_ajax"}
+
+UPLOAD_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Write the progress status file every this many bytes
+PROGRESS_INTERVAL = 8 * 1024 * 1024
+
+# Chunks are copied from the request to disk this much at a time
+BLOCK_SIZE = 1024 * 1024
+
+
+def upload_status_path(upload_session_id):
+    return os.path.join("/tmp", f"upload_{upload_session_id}.status")
+
+
+def write_upload_status(upload_session_id, status, talk_id=None):
+    """Publish a streaming upload's status, and save it for /upload_progress"""
+    if not upload_session_id:
+        return
+
+    state, _, detail = status.partition(":")
+    event = {"session_id": upload_session_id, "talk_id": talk_id, "status": state}
+    if detail.startswith("bytes="):
+        event["bytes_uploaded"] = int(detail[len("bytes="):])
+    elif detail:
+        event["message"] = detail
+    publish("upload", **event)
+
+    path = upload_status_path(upload_session_id)
+    partial_path = f"{path}.{os.getpid()}.partial"
+    with open(partial_path, "w") as status_file:
+        status_file.write(status)
+    os.replace(partial_path, path)
+
+
+class StreamedUpload:
+    """A writable upload file that hashes what it is given.
+
+    Lives in UPLOAD_INCOMING_DIR until claimed with move_to(); if it never is,
+    it is deleted when the request is closed.
+    """
+
+    def __init__(self, directory, upload_session_id=None):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".partial")
+        self.file = os.fdopen(fd, "w+b")
+
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.upload_session_id = upload_session_id
+        self._reported = 0
+        self._kept = False
+
+        self._started = time.perf_counter()
+        self._write_seconds = 0.0
+
+        write_upload_status(upload_session_id, "uploading:bytes=0")
+
+    def write(self, data):
+        started = time.perf_counter()
+        self.file.write(data)
+        self._write_seconds += time.perf_counter() - started
+
+        self.digest.update(data)
+        self.size += len(data)
+
+        if self.size - self._reported >= PROGRESS_INTERVAL:
+            self._reported = self.size
+            write_upload_status(self.upload_session_id, f"uploading:bytes={self.size}")
+
+        return len(data)
+
+    @property
+    def sha256(self):
+        return self.digest.hexdigest()
+
+    def move_to(self, destination):
+        """Put the finished upload at `destination`, with an atomic rename"""
+        elapsed = time.perf_counter() - self._started
+
+        started = time.perf_counter()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._write_seconds += time.perf_counter() - started
+
+        os.replace(self.path, destination)
+        self.path = destination
+        self._kept = True
+
+        UPLOADS.inc(method="streamed")
+        UPLOAD_SECONDS.observe(elapsed, method="streamed")
+        UPLOAD_SPEED.observe(self.size / max(elapsed, 1e-6), method="streamed")
+        UPLOAD_WRITE_SECONDS.observe(self._write_seconds)
+
+    def keep(self):
+        """Leave the upload where it is when the request ends"""
+        self._kept = True
+
+    def close(self):
+        UPLOAD_BYTES.inc(self.size, method="streamed")
+        self.file.close()
+        if not self._kept and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read, seek, tell, flush and the rest go to the file itself
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    """Streams talk uploads to StreamedUploads instead of spooling them"""
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        if self.endpoint not in STREAMED_ENDPOINTS:
+            return super()._get_file_stream(
+                total_content_length, content_type, filename, content_length
+            )
+
+        upload_session_id = self.args.get("upload_session_id")
+        if upload_session_id and not UPLOAD_SESSION_ID.match(upload_session_id):
+            upload_session_id = None
+
+        return StreamedUpload(app.config["UPLOAD_INCOMING_DIR"], upload_session_id)
+
+
+def chunked_upload_path(upload_session_id):
+    """Where a chunked upload is assembled, on the same filesystem as UPLOAD_DIR"""
+    return os.path.join(app.config["UPLOAD_INCOMING_DIR"], f".chunked-{upload_session_id}.partial")
+
+
+def allocate_upload(path, size):
+    """Create `path` with `size` bytes of disk set aside for it"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError as e:
+            # Empty files, and filesystems that can't preallocate
+            if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS):
+                raise
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def write_chunk(path, offset, stream, length):
+    """Copy up to `length` bytes from `stream` to `offset` in `path`.
+
+    Only BLOCK_SIZE bytes are held in memory, whatever the size of the chunk.
+    Returns the number of bytes written.
+
+    The time spent waiting for the data and writing it are measured
+    separately, to tell a slow network from a slow disk.
+    """
+    written = 0
+    receive_seconds = write_seconds = 0.0
+
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        while written < length:
+            started = time.perf_counter()
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            receive_seconds += time.perf_counter() - started
+            if not block:
+                break
+
+            started = time.perf_counter()
+            view = memoryview(block)
+            while view:
+                done = os.pwrite(fd, view, offset + written)
+                view = view[done:]
+                written += done
+            write_seconds += time.perf_counter() - started
+    finally:
+        os.close(fd)
+
+    UPLOAD_BYTES.inc(written, method="chunked")
+    CHUNK_RECEIVE_SECONDS.observe(receive_seconds)
+    CHUNK_WRITE_SECONDS.observe(write_seconds)
+    return written
+
+
+def upload_session_id_for(talk_id, file_type, file_size, fingerprint):
+    """The session id for uploading this file, the same every time it's tried"""
+    key = f"{int(talk_id)}:{file_type}:{int(file_size)}:{fingerprint}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _discard_upload_session(upload_session):
+    UploadChunk.query.filter_by(session_id=upload_session.id).delete()
+    db.session.delete(upload_session)
+
+    path = chunked_upload_path(upload_session.id)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def open_upload_session(upload_session_id, **details):
+    """Start, or pick up again, the chunked upload with this id.
+
+    An unfinished session whose partial file is still there, and which is
+    being sent in the same sized chunks, is resumed. Anything else under this
+    id is started again from nothing. `details` are the UploadSession columns
+    describing the upload. Returns the session and the chunks it already has.
+    """
+    upload_session = db.session.get(UploadSession, upload_session_id)
+
+    if upload_session is not None:
+        if upload_session.state in (UploadSession.STARTING, UploadSession.VERIFYING):
+            raise ValueError("This upload is already being finished off")
+
+        resumable = (
+            upload_session.state == UploadSession.UPLOADING
+            and upload_session.chunk_size == details["chunk_size"]
+            and os.path.exists(chunked_upload_path(upload_session_id))
+        )
+        if resumable:
+            upload_session.updated_at = datetime.now()
+            db.session.commit()
+            return upload_session, received_chunks(upload_session_id)
+
+        _discard_upload_session(upload_session)
+        db.session.commit()
+
+    # Set aside the whole file now; chunks are written into it where they belong
+    allocate_upload(chunked_upload_path(upload_session_id), details["file_size"])
+
+    now = datetime.now()
+    upload_session = UploadSession(id=upload_session_id, created_at=now, updated_at=now, **details)
+    db.session.add(upload_session)
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same upload was started twice at once; use the other one
+        db.session.rollback()
+        upload_session = db.session.get(UploadSession, upload_session_id)
+
+    return upload_session, received_chunks(upload_session_id)
+
+
+def expire_upload_sessions(ttl_hours=None):
+    """Delete sessions untouched for UPLOAD_SESSION_TTL hours, and their files.
+
+    Also removes partial files that no session owns, and streamed uploads left
+    behind as duplicates for someone to look at. Returns the ids of the
+    sessions deleted.
+    """
+    if ttl_hours is None:
+        ttl_hours = app.config["UPLOAD_SESSION_TTL"]
+    cutoff = datetime.now() - timedelta(hours=ttl_hours)
+
+    expired = UploadSession.query.filter(
+        UploadSession.state.notin_((UploadSession.STARTING, UploadSession.VERIFYING)),
+        func.coalesce(UploadSession.updated_at, UploadSession.created_at) < cutoff,
+    ).all()
+
+    for upload_session in expired:
+        _discard_upload_session(upload_session)
+    db.session.commit()
+
+    incoming_dir = app.config["UPLOAD_INCOMING_DIR"]
+    if os.path.isdir(incoming_dir):
+        for entry in os.scandir(incoming_dir):
+            if not entry.name.endswith(".partial"):
+                continue
+            stale = datetime.fromtimestamp(entry.stat().st_mtime) < cutoff
+
+            if entry.name.startswith(".upload-"):
+                # A streamed upload being written isn't this old
+                if stale:
+                    os.remove(entry.path)
+            elif entry.name.startswith(".chunked-"):
+                upload_session_id = entry.name[len(".chunked-"):-len(".partial")]
+                if stale and db.session.get(UploadSession, upload_session_id) is None:
+                    os.remove(entry.path)
+
+    return [upload_session.id for upload_session in expired]
+
+
+def record_chunk(upload_session, chunk_number):
+    """Mark a chunk as received, returning how many chunks have been.
+
+    Safe to call from concurrent requests, and for a chunk that is sent again.
+    """
+    inserted = db.session.execute(
+        insert(UploadChunk)
+        .values(
+            session_id=upload_session.id,
+            chunk_number=chunk_number,
+            received_at=datetime.now(),
+        )
+        .on_conflict_do_nothing()
+    )
+
+    if inserted.rowcount:
+        db.session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == upload_session.id)
+            .values(
+                chunks_received=UploadSession.chunks_received + 1,
+                updated_at=datetime.now(),
+            )
+        )
+
+    db.session.commit()
+    db.session.refresh(upload_session)
+
+    publish(
+        "chunk",
+        session_id=upload_session.id,
+        talk_id=upload_session.talk_id,
+        chunks_received=upload_session.chunks_received,
+        total_chunks=upload_session.total_chunks,
+    )
+    return upload_session.chunks_received
+
+
+def received_chunks(upload_session_id):
+    """The numbers of the chunks of a session that have arrived, in order"""
+    return [
+        chunk.chunk_number
+        for chunk in UploadChunk.query.filter_by(session_id=upload_session_id).order_by(
+            UploadChunk.chunk_number
+        )
+    ]
+
+
+def set_upload_state(upload_session_id, state, error=None):
+    """Record how finishing off a chunked upload is going"""
+    values = {"state": state, "error": error}
+    if state in (UploadSession.SUCCESS, UploadSession.ERROR):
+        values["finished_at"] = datetime.now()
+
+    db.session.execute(
+        update(UploadSession).where(UploadSession.id == upload_session_id).values(**values)
+    )
+    db.session.commit()
+
+    upload_session = db.session.get(UploadSession, upload_session_id)
+    publish(
+        "reassembly",
+        session_id=upload_session_id,
+        talk_id=upload_session.talk_id if upload_session else None,
+        status=state,
+        error=error,
+    )
+
+
+def claim_upload_for_finishing(upload_session_id):
+    """Move a session from uploading to starting, returning whether this call
+    did. Only one of several requests to complete the same upload gets to."""
+    claimed = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload_session_id, UploadSession.state == UploadSession.UPLOADING)
+        .values(state=UploadSession.STARTING, error=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+
+    if claimed:
+        upload_session = db.session.get(UploadSession, upload_session_id)
+        publish(
+            "reassembly",
+            session_id=upload_session_id,
+            talk_id=upload_session.talk_id,
+            status=UploadSession.STARTING,
+            error=None,
+        )
+    return bool(claimed)
+
+
+def release_upload_claim(upload_session_id):
+    """Put a session claimed by claim_upload_for_finishing back to uploading,
+    when its job couldn't be queued, so completing it can be tried again"""
+    released = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload_session_id, UploadSession.state == UploadSession.STARTING)
+        .values(state=UploadSession.UPLOADING)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+
+    if released:
+        upload_session = db.session.get(UploadSession, upload_session_id)
+        publish(
+            "reassembly",
+            session_id=upload_session_id,
+            talk_id=upload_session.talk_id,
+            status=UploadSession.UPLOADING,
+            error=None,
+        )
+
+
+def finish_chunked_upload(upload_session_id, talk_id=None):
+    """Check a fully received chunked upload and move it into place.
+
+    Run as a media job, as hashing it reads the whole file. The chunks were
+    written in place, so there is nothing to reassemble.
+    """
+    upload_session = db.session.get(UploadSession, upload_session_id)
+    talk = db.session.get(Talk, upload_session.talk_id)
+    upload_path = chunked_upload_path(upload_session_id)
+
+    if upload_session.file_type == "raw" and upload_session.is_video:
+        final_path = get_path_for_video_file(talk.id, upload_session.file_extension)
+    else:
+        final_path = get_path_for_file(talk.id, upload_session.file_type, talk.title, talk.speaker)
+
+    def fail(error_msg):
+        set_upload_state(upload_session_id, UploadSession.ERROR, error_msg)
+        app.logger.error(f"Upload failed for talk {talk.id}: {error_msg}")
+        # Clean up partial file
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+    try:
+        set_upload_state(upload_session_id, UploadSession.VERIFYING)
+        verify_started = time.perf_counter()
+
+        file_size = os.path.getsize(upload_path)
+        if file_size != upload_session.file_size:
+            fail(f"File size mismatch: expected {upload_session.file_size}, got {file_size}")
+            return
+
+        # Hash it for the upload index, and make sure it's not a duplicate
+        sha256 = file_sha256(upload_path)
+        duplicate = find_duplicate(sha256)
+
+        if duplicate is not None:
+            fail(
+                f"This file is identical to the {duplicate.file_type} file already uploaded for "
+                f"Talk {duplicate.talk_id}: {duplicate.path} ({duplicate.size} bytes)."
+            )
+            return
+
+        with open(upload_path, "rb") as upload_file:
+            os.fsync(upload_file.fileno())
+        os.replace(upload_path, final_path)
+
+        record_upload(talk.id, upload_session.file_type, final_path, file_size, sha256)
+        set_upload_state(upload_session_id, UploadSession.SUCCESS)
+
+        UPLOAD_VERIFY_SECONDS.observe(time.perf_counter() - verify_started)
+        UPLOADS.inc(method="chunked")
+        # From the session starting to its last chunk, including any pauses to resume
+        if upload_session.created_at and upload_session.updated_at:
+            elapsed = (upload_session.updated_at - upload_session.created_at).total_seconds()
+            UPLOAD_SECONDS.observe(elapsed, method="chunked")
+            UPLOAD_SPEED.observe(file_size / max(elapsed, 1e-6), method="chunked")
+
+        app.logger.info(f"Upload completed for talk {talk.id}: {final_path} ({file_size} bytes)")
+
+        # Start video processing if needed
+        if upload_session.file_type == "raw" and upload_session.is_video:
+            raw_audio_path = get_path_for_file(talk.id, "raw", talk.title, talk.speaker)
+            extract_audio_from_video_async(final_path, raw_audio_path, talk.id)
+        elif upload_session.file_type == "edited":
+            enqueue_conversion(talk.id)
+
+    except Exception as e:
+        fail(f"Unexpected error finishing upload: {str(e)}")
+
+
+def _is_unchanged(uploaded):
+    """Whether the indexed file still has the contents it was hashed with.
+
+    A file of the same size and modification time is taken to; one modified
+    since is hashed again, as a replacement could be the same size.
+    """
+    try:
+        stat = os.stat(uploaded.path)
+    except OSError:
+        return False
+
+    if stat.st_size != uploaded.size:
+        return False
+    if stat.st_mtime == uploaded.mtime:
+        return True
+
+    if file_sha256(uploaded.path) != uploaded.sha256:
+        return False
+    uploaded.mtime = stat.st_mtime
+    return True
+
+
+def find_duplicate(sha256):
+    """The indexed upload with these contents, or None.
+
+    Entries for files that have since been deleted or replaced are dropped.
+    """
+    for uploaded in UploadedFile.query.filter_by(sha256=sha256):
+        if _is_unchanged(uploaded):
+            db.session.commit()
+            return uploaded
+
+        db.session.delete(uploaded)
+
+    db.session.commit()
+    return None
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def record_upload(talk_id, file_type, path, size, sha256):
+    """Add a file that is now in place to the index"""
+    uploaded = db.session.get(UploadedFile, path) or UploadedFile(path=path)
+    uploaded.talk_id = int(talk_id)
+    uploaded.file_type = file_type
+    uploaded.size = size
+    uploaded.sha256 = sha256
+    uploaded.mtime = _mtime(path)
+    uploaded.uploaded_at = datetime.now()
+
+    db.session.add(uploaded)
+    db.session.commit()
+
+    note_file(path)
+    return uploaded
+
+
+def forget_upload(path):
+    """Remove a deleted file from the index"""
+    uploaded = db.session.get(UploadedFile, path)
+    if uploaded is not None:
+        db.session.delete(uploaded)
+        db.session.commit()
+
+
+def index_existing_uploads():
+    """Hash any files in UPLOAD_DIR that aren't in the index yet.
+
+    For files uploaded before the index existed; returns how many were added.
+    """
+    added = 0
+
+    for entry in os.scandir(app.config["UPLOAD_DIR"]):
+        match = UPLOAD_NAME.match(entry.name)
+        if not match or not entry.is_file() or db.session.get(UploadedFile, entry.path):
+            continue
+
+        file_type = "edited" if match.group(2) == "EDITED" else "raw"
+        db.session.add(
+            UploadedFile(
+                path=entry.path,
+                talk_id=int(match.group(1)),
+                file_type=file_type,
+                size=entry.stat().st_size,
+                mtime=entry.stat().st_mtime,
+                sha256=file_sha256(entry.path),
+                uploaded_at=datetime.fromtimestamp(entry.stat().st_mtime),
+            )
+        )
+        added += 1
+
+    db.session.commit()
+    return added
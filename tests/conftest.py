@@ -22,6 +22,8 @@ os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{_TEST_ROOT / 'test.sqlite'}
 os.environ["GB_FRIDAY"] = TEST_GB_FRIDAY
 os.environ.setdefault("GOOGLE_OAUTH_CLIENT_ID", "test-client-id")
 os.environ.setdefault("GOOGLE_OAUTH_CLIENT_SECRET", "test-client-secret")
+# Tests run media jobs themselves, with run_pending_media_jobs()
+os.environ["MEDIA_JOB_WORKERS"] = "0"
 
 for _var, _subdir in [
     ("UPLOAD_DIR", "uploads"),
@@ -30,6 +32,7 @@ for _var, _subdir in [
     ("IMG_DIR", "images"),
     ("USB_GOLD_DIR", "usb_gold"),
     ("WEB_MP3_DIR", "web_mp3s"),
+    ("SCRATCH_DIR", "scratch"),
 ]:
     _path = _TEST_ROOT / _subdir
     _path.mkdir(parents=True, exist_ok=True)
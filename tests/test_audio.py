@@ -0,0 +1,336 @@
+"""Tests for the ffmpeg command building in gbtalks.audio.
+
+ffmpeg itself is not run here; these pin down the commands and filter graphs we
+hand to it, and the parsing of what it hands back.
+"""
+
+import os
+import subprocess
+import wave
+
+import pytest
+from mutagen.id3 import ID3
+
+from gbtalks.audio import (
+    AudioProcessingError,
+    concat_filter,
+    decoded_asset,
+    extraction_command,
+    fold_short_final_track,
+    invalidate_decoded_asset,
+    loudnorm_filter,
+    measure_command,
+    parse_loudnorm_stats,
+    probe_audio,
+    render_command,
+    retag_talk,
+    tag_processed_mp3,
+)
+from gbtalks.distribution import destination_path
+from gbtalks.libgbtalks import find_processed_files, get_path_for_file
+
+INPUTS = ["/up/top.mp3", "/up/gb26-007_EDITED.mp3", "/up/tail.mp3"]
+
+MEASURED = {
+    "input_i": "-21.40",
+    "input_lra": "6.10",
+    "input_tp": "-3.22",
+    "input_thresh": "-31.87",
+    "target_offset": "0.35",
+}
+
+LOUDNORM_OUTPUT = """
+[Parsed_loudnorm_3 @ 0x55d0c8a0]
+{
+	"input_i" : "-21.40",
+	"input_tp" : "-3.22",
+	"input_lra" : "6.10",
+	"input_thresh" : "-31.87",
+	"output_i" : "-13.52",
+	"output_tp" : "-2.00",
+	"output_lra" : "2.90",
+	"output_thresh" : "-23.90",
+	"normalization_type" : "dynamic",
+	"target_offset" : "0.35"
+}
+"""
+
+
+class TestConcatFilter:
+    def test_joins_every_input_in_order(self):
+        graph = concat_filter(3)
+        assert graph.endswith("[a0][a1][a2]concat=n=3:v=0:a=1")
+
+    def test_converts_each_input_to_cd_format_first(self):
+        graph = concat_filter(3)
+        for index in range(3):
+            assert (
+                f"[{index}:a]aformat=sample_rates=44100:channel_layouts=stereo[a{index}]"
+                in graph
+            )
+
+
+class TestLoudnormFilter:
+    def test_analysis_pass_prints_json(self):
+        assert loudnorm_filter() == "loudnorm=I=-13:LRA=3:TP=-2:print_format=json"
+
+    def test_second_pass_uses_the_measured_values(self):
+        graph = loudnorm_filter(MEASURED)
+
+        assert "measured_I=-21.40" in graph
+        assert "measured_LRA=6.10" in graph
+        assert "measured_TP=-3.22" in graph
+        assert "measured_thresh=-31.87" in graph
+        assert "offset=0.35" in graph
+        assert "linear=true" in graph
+
+    def test_silence_falls_back_to_one_pass(self):
+        silent = dict(MEASURED, input_i="-inf", input_thresh="-inf")
+        assert loudnorm_filter(silent) == "loudnorm=I=-13:LRA=3:TP=-2"
+
+
+class TestParseLoudnormStats:
+    def test_reads_the_json_summary(self):
+        assert parse_loudnorm_stats(LOUDNORM_OUTPUT) == MEASURED
+
+    def test_rejects_output_without_a_summary(self):
+        with pytest.raises(AudioProcessingError):
+            parse_loudnorm_stats("Output #0, null, to 'pipe:':")
+
+    def test_rejects_an_incomplete_summary(self):
+        with pytest.raises(AudioProcessingError):
+            parse_loudnorm_stats('{"input_i" : "-21.40"}')
+
+
+def test_measure_command_discards_the_audio():
+    command = measure_command(INPUTS)
+
+    assert command[-3:] == ["-f", "null", "-"]
+    assert command.count("-i") == 3
+    assert command[command.index("-filter_complex") + 1].endswith("print_format=json")
+
+
+class TestRenderCommand:
+    @pytest.fixture
+    def command(self):
+        return render_command(
+            INPUTS,
+            MEASURED,
+            ["/processed/GB26_007_Title_Speaker.mp3", "/web/gb26-007mp3.mp3"],
+            "/cds/gb26-007/",
+        )
+
+    def test_is_a_single_invocation_over_all_three_inputs(self, command):
+        assert [command[i + 1] for i, arg in enumerate(command) if arg == "-i"] == INPUTS
+
+    def test_encodes_the_mp3_once_for_both_destinations(self, command):
+        tee = command[command.index("tee") + 1]
+
+        assert command.count("libmp3lame") == 1
+        assert tee == (
+            "[f=mp3]/processed/GB26_007_Title_Speaker.mp3|[f=mp3]/web/gb26-007mp3.mp3"
+        )
+
+    def test_cuts_five_minute_cd_tracks(self, command):
+        assert command[command.index("-segment_time") + 1] == "300"
+        assert command[-1] == "/cds/gb26-007/%02d.wav"
+        assert "pcm_s16le" in command
+
+    def test_cd_audio_is_grouped_into_whole_sectors(self, command):
+        graph = command[command.index("-filter_complex") + 1]
+        assert "[pcm]asetnsamples=n=588:p=1[cd]" in graph
+
+    def test_escapes_tee_separators_in_filenames(self):
+        command = render_command(INPUTS, MEASURED, ["/p/It's A|B.mp3"], "/cds/")
+        assert command[command.index("tee") + 1] == "[f=mp3]/p/It\\'s A\\|B.mp3"
+
+
+def test_tag_processed_mp3_writes_the_talk_details(app_ctx, make_talk, tmp_path):
+    with open(os.path.join(app_ctx.config["IMG_DIR"], "alltalksicon.png"), "wb") as icon:
+        icon.write(b"\x89PNG\r\n\x1a\n")
+
+    mp3_path = tmp_path / "talk.mp3"
+    mp3_path.write_bytes(b"\xff\xfb\x90\x00" * 64)
+
+    talk = make_talk(talk_id=7, title="My Talk", speaker="Sam Speaker")
+    tag_processed_mp3(str(mp3_path), talk)
+
+    tags = ID3(str(mp3_path))
+    assert tags["TIT2"].text == ["My Talk"]
+    assert tags["TPE1"].text == ["Sam Speaker"]
+    assert tags["TRCK"].text == ["7"]
+    assert tags["TALB"].text == ["Greenbelt Festival Talks 2026"]
+
+
+class TestDecodedAssetCache:
+    @pytest.fixture
+    def jingle(self, app_ctx, tmp_path, monkeypatch):
+        monkeypatch.setitem(app_ctx.config, "DECODED_CACHE_DIR", str(tmp_path / "decoded"))
+
+        source = tmp_path / "top.mp3"
+        source.write_bytes(b"jingle")
+        return source
+
+    @pytest.fixture
+    def ffmpeg_calls(self, monkeypatch):
+        """Stand in for ffmpeg, writing a placeholder WAV for each decode."""
+        calls = []
+
+        def fake_run(command, **kwargs):
+            calls.append(command)
+            with open(command[-1], "wb") as output:
+                output.write(b"RIFF")
+            return subprocess.CompletedProcess(command, 0, "", "")
+
+        monkeypatch.setattr(subprocess, "run", fake_run)
+        return calls
+
+    def test_decodes_once_and_then_reuses_the_wav(self, jingle, ffmpeg_calls):
+        first = decoded_asset(str(jingle))
+        second = decoded_asset(str(jingle))
+
+        assert first == second
+        assert os.path.exists(first)
+        assert len(ffmpeg_calls) == 1
+
+    def test_a_changed_source_is_decoded_again(self, jingle, ffmpeg_calls):
+        old = decoded_asset(str(jingle))
+
+        jingle.write_bytes(b"a longer, newer jingle")
+        new = decoded_asset(str(jingle))
+
+        assert new != old
+        assert not os.path.exists(old), "the stale decoding was left behind"
+        assert len(ffmpeg_calls) == 2
+
+    def test_invalidate_removes_the_cached_wav(self, jingle, ffmpeg_calls):
+        path = decoded_asset(str(jingle))
+
+        invalidate_decoded_asset(str(jingle))
+
+        assert not os.path.exists(path)
+        decoded_asset(str(jingle))
+        assert len(ffmpeg_calls) == 2
+
+
+class TestExtraction:
+    def test_copies_an_mp3_track_out_unchanged(self):
+        method, command = extraction_command("/up/talk.mp4", "/up/raw.mp3", {"codec_name": "mp3"})
+
+        assert method == "copy"
+        assert command[command.index("-c:a") + 1] == "copy"
+        assert "libmp3lame" not in command
+
+    @pytest.mark.parametrize("stream", [{"codec_name": "aac"}, {"codec_name": "pcm_s16le"}, None])
+    def test_encodes_anything_else(self, stream):
+        method, command = extraction_command("/up/talk.mp4", "/up/raw.mp3", stream)
+
+        assert method == "transcode"
+        assert command[command.index("-c:a") + 1] == "libmp3lame"
+        assert command[-1] == "/up/raw.mp3"
+
+    def test_probe_reads_the_first_audio_stream(self, monkeypatch):
+        output = '{"streams": [{"codec_name": "aac", "sample_rate": "48000", "duration": "7200.0"}]}'
+        monkeypatch.setattr(
+            subprocess, "run", lambda command, **kwargs: subprocess.CompletedProcess(command, 0, output, "")
+        )
+
+        assert probe_audio("/up/talk.mp4")["codec_name"] == "aac"
+
+    def test_probe_of_a_video_without_audio(self, monkeypatch):
+        monkeypatch.setattr(
+            subprocess,
+            "run",
+            lambda command, **kwargs: subprocess.CompletedProcess(command, 0, '{"streams": []}', ""),
+        )
+
+        assert probe_audio("/up/talk.mp4") is None
+
+    def test_probe_without_ffprobe(self, monkeypatch):
+        def missing(command, **kwargs):
+            raise FileNotFoundError(command[0])
+
+        monkeypatch.setattr(subprocess, "run", missing)
+
+        assert probe_audio("/up/talk.mp4") is None
+
+
+class TestRetagTalk:
+    @pytest.fixture
+    def processed_talk(self, app_ctx, make_talk):
+        """Talk 7, processed under an old title, with a separate web copy."""
+        with open(os.path.join(app_ctx.config["IMG_DIR"], "alltalksicon.png"), "wb") as icon:
+            icon.write(b"\x89PNG\r\n\x1a\n")
+
+        talk = make_talk(talk_id=7, title="Old Title", speaker="Sam Speaker")
+
+        old_path = get_path_for_file(7, "processed", "Old Title", "Sam Speaker")
+        web_path = get_path_for_file(7, "web_mp3")
+        for path in (old_path, web_path):
+            with open(path, "wb") as mp3:
+                mp3.write(b"\xff\xfb\x90\x00" * 64)
+
+        yield talk
+
+        for path in find_processed_files(7) + [web_path, destination_path(7, "usb_gold")]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_renames_and_retags_the_processed_mp3(self, db, processed_talk):
+        processed_talk.title = "New Title"
+        db.session.commit()
+
+        new_path = retag_talk(processed_talk)
+
+        assert new_path == get_path_for_file(7, "processed", "New Title", "Sam Speaker")
+        assert find_processed_files(7) == [new_path]
+        assert ID3(new_path)["TIT2"].text == ["New Title"]
+
+    def test_web_mp3_becomes_a_link_to_the_processed_file(self, db, processed_talk):
+        new_path = retag_talk(processed_talk)
+        web_path = get_path_for_file(7, "web_mp3")
+
+        assert os.path.samefile(new_path, web_path)
+        assert ID3(web_path)["TIT2"].text == ["Old Title"]
+
+    def test_does_nothing_for_an_unprocessed_talk(self, db, make_talk):
+        talk = make_talk(talk_id=8)
+        assert retag_talk(talk) is None
+
+
+class TestFoldShortFinalTrack:
+    def write_track(self, path, seconds):
+        with wave.open(str(path), "wb") as track:
+            track.setnchannels(2)
+            track.setsampwidth(2)
+            track.setframerate(44100)
+            track.writeframes(b"\x01\x00\x02\x00" * int(seconds * 44100))
+
+    def frames(self, path):
+        with wave.open(str(path), "rb") as track:
+            return track.getnframes()
+
+    def test_a_short_final_track_joins_the_one_before(self, tmp_path):
+        self.write_track(tmp_path / "00.wav", 10)
+        self.write_track(tmp_path / "01.wav", 2)
+
+        fold_short_final_track(str(tmp_path))
+
+        assert sorted(os.listdir(tmp_path)) == ["00.wav"]
+        assert self.frames(tmp_path / "00.wav") == 12 * 44100
+        assert os.path.getsize(tmp_path / "00.wav") == 44 + 12 * 44100 * 4
+
+    def test_leaves_a_final_track_that_is_long_enough(self, tmp_path):
+        self.write_track(tmp_path / "00.wav", 10)
+        self.write_track(tmp_path / "01.wav", 5)
+
+        fold_short_final_track(str(tmp_path))
+
+        assert sorted(os.listdir(tmp_path)) == ["00.wav", "01.wav"]
+
+    def test_leaves_a_single_short_track(self, tmp_path):
+        self.write_track(tmp_path / "00.wav", 2)
+
+        fold_short_final_track(str(tmp_path))
+
+        assert self.frames(tmp_path / "00.wav") == 2 * 44100
@@ -0,0 +1,56 @@
+"""Tests for the pipeline benchmark harness in benchmarks/pipeline.py.
+
+ffmpeg isn't available to the tests, so these cover the measuring and the
+fixture commands rather than a full run.
+"""
+
+import click
+import pytest
+
+from benchmarks.pipeline import fixture_command, measure_stage
+
+
+def test_fixture_command_renders_the_source_for_the_given_length():
+    command = fixture_command("anoisesrc=color=pink", 600, "/bench/edited-10.mp3")
+
+    assert command[command.index("-i") + 1] == "anoisesrc=color=pink:duration=600"
+    assert command[-1] == "/bench/edited-10.mp3"
+
+
+class TestMeasureStage:
+    def test_reports_time_memory_and_bytes_written(self, tmp_path):
+        output = tmp_path / "out.bin"
+
+        def stage():
+            with open(output, "wb") as out:
+                out.write(b"\0" * 4096)
+
+        result = measure_stage(stage)
+
+        assert set(result) == {"wall_s", "cpu_s", "peak_rss_kb", "bytes_written"}
+        assert result["peak_rss_kb"] > 0
+        assert result["bytes_written"] >= 4096
+
+    def test_counts_the_outputs_ffmpeg_wrote(self, tmp_path):
+        output = tmp_path / "cd"
+        output.mkdir()
+        (output / "00.wav").write_bytes(b"\0" * 1000)
+
+        result = measure_stage(lambda: [str(output)])
+
+        assert result["bytes_written"] == 1000
+
+    def test_a_failing_stage_is_reported(self):
+        def stage():
+            raise OSError("ffmpeg not found")
+
+        with pytest.raises(click.ClickException, match="ffmpeg not found"):
+            measure_stage(stage)
+
+
+
+def test_the_command_passes_its_options_through(app):
+    result = app.test_cli_runner().invoke(args=["bench-pipeline", "--help"])
+
+    assert result.exit_code == 0
+    assert "--minutes" in result.output
@@ -0,0 +1,161 @@
+"""Tests for the flask CLI commands and the talk processing they drive.
+
+ffmpeg is stubbed out throughout; see test_audio.py for the commands it is given.
+"""
+
+import os
+import shutil
+
+import pytest
+
+from gbtalks import commands
+from gbtalks.distribution import DESTINATIONS, destination_path
+from gbtalks.libgbtalks import find_processed_files, get_cd_dir_for_talk, get_path_for_file
+from gbtalks.models import LoudnessMeasurement
+
+STATS = {
+    "input_i": "-21.40",
+    "input_lra": "6.10",
+    "input_tp": "-3.22",
+    "input_thresh": "-31.87",
+    "target_offset": "0.35",
+}
+
+
+@pytest.fixture
+def edited_talk(app_ctx, make_talk):
+    """Talk 7, with an edited file on disk."""
+    talk = make_talk(talk_id=7, title="My Talk", speaker="Sam Speaker", is_cleared=True)
+
+    edited_path = get_path_for_file(7, "edited")
+    with open(edited_path, "wb") as edited:
+        edited.write(b"edited audio")
+
+    yield talk
+
+    os.remove(edited_path)
+    for path in find_processed_files(7) + [
+        destination_path(7, destination) for destination in DESTINATIONS
+    ]:
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(get_cd_dir_for_talk(7), ignore_errors=True)
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Replace every ffmpeg-backed step of process_talk, recording the calls."""
+    calls = {"measure": [], "render": [], "tag": []}
+
+    monkeypatch.setattr(
+        commands, "top_and_tail", lambda: ("/decoded/top-1-1.wav", "/decoded/tail-1-1.wav")
+    )
+    monkeypatch.setattr(
+        commands, "measure_loudness", lambda inputs: calls["measure"].append(inputs) or STATS
+    )
+
+    def render_talk(inputs, measured, mp3_paths, cd_dir):
+        calls["render"].append((inputs, measured, mp3_paths, cd_dir))
+        for path in mp3_paths:
+            with open(path, "wb") as mp3:
+                mp3.write(b"processed audio")
+        with open(os.path.join(cd_dir, "00.wav"), "wb") as track:
+            track.write(b"RIFF")
+
+    monkeypatch.setattr(commands, "render_talk", render_talk)
+    monkeypatch.setattr(
+        commands, "tag_processed_mp3", lambda path, talk: calls["tag"].append(path)
+    )
+    monkeypatch.setattr(commands, "estimate_scratch_bytes", lambda duration: 1024)
+    return calls
+
+
+class TestProcessTalk:
+    def test_measures_new_audio_and_stores_the_result(self, db, edited_talk, pipeline):
+        result = commands.process_talk(7)
+
+        assert len(pipeline["measure"]) == 1
+        assert result["cached"] is False
+        assert result["integrated"] == pytest.approx(-21.4)
+        assert LoudnessMeasurement.query.count() == 1
+
+    def test_reuses_the_measurement_when_the_audio_is_unchanged(
+        self, db, edited_talk, pipeline
+    ):
+        commands.process_talk(7)
+        result = commands.process_talk(7)
+
+        assert len(pipeline["measure"]) == 1, "the analysis pass ran again"
+        assert result["cached"] is True
+
+        measured = pipeline["render"][-1][1]
+        assert measured["input_i"] == pytest.approx(-21.4)
+        assert measured["target_offset"] == pytest.approx(0.35)
+
+    def test_measures_again_when_the_edit_changes(self, db, edited_talk, pipeline):
+        commands.process_talk(7)
+
+        with open(get_path_for_file(7, "edited"), "wb") as edited:
+            edited.write(b"a re-edited talk")
+        commands.process_talk(7)
+
+        assert len(pipeline["measure"]) == 2
+
+    def test_tags_the_mp3_before_it_is_moved_into_place(
+        self, app_ctx, db, edited_talk, pipeline
+    ):
+        commands.process_talk(7)
+
+        [tagged] = pipeline["tag"]
+        assert tagged.startswith(app_ctx.config["SCRATCH_DIR"])
+        assert os.path.basename(tagged) == os.path.basename(
+            get_path_for_file(7, "processed", "My Talk", "Sam Speaker")
+        )
+
+    def test_web_mp3_is_the_processed_mp3(self, db, edited_talk, pipeline):
+        commands.process_talk(7)
+
+        processed_path = get_path_for_file(7, "processed", "My Talk", "Sam Speaker")
+        assert os.path.samefile(processed_path, get_path_for_file(7, "web_mp3"))
+
+    def test_usb_gold_copy_is_the_processed_mp3(self, db, edited_talk, pipeline):
+        commands.process_talk(7)
+
+        processed_path = get_path_for_file(7, "processed", "My Talk", "Sam Speaker")
+        assert os.path.samefile(processed_path, destination_path(7, "usb_gold"))
+
+    def test_cd_tracks_are_moved_into_the_cd_dir(self, db, edited_talk, pipeline):
+        commands.process_talk(7)
+
+        assert os.listdir(get_cd_dir_for_talk(7)) == ["00.wav"]
+
+    def test_scratch_space_is_cleaned_up(self, app_ctx, db, edited_talk, pipeline):
+        commands.process_talk(7)
+
+        assert [
+            entry for entry in os.listdir(app_ctx.config["SCRATCH_DIR"]) if entry != ".lock"
+        ] == []
+
+    def test_a_failed_render_leaves_no_processed_mp3(
+        self, db, edited_talk, pipeline, monkeypatch
+    ):
+        def failing_render(inputs, measured, mp3_paths, cd_dir):
+            with open(mp3_paths[0], "wb") as mp3:
+                mp3.write(b"half a talk")
+            raise RuntimeError("ffmpeg was killed")
+
+        monkeypatch.setattr(commands, "render_talk", failing_render)
+
+        with pytest.raises(RuntimeError):
+            commands.process_talk(7)
+
+        assert find_processed_files(7) == []
+
+
+def test_loudness_report_line():
+    line = commands.format_loudness_report(
+        {"talk_id": 7, "integrated": -21.4, "range": 6.1, "true_peak": -3.22, "cached": True}
+    )
+    assert line == (
+        "Talk 7: -21.4 LUFS, range 6.1 LU, true peak -3.2 dBTP (measured previously)"
+    )
@@ -0,0 +1,172 @@
+"""Tests for the conversion job queue in gbtalks.conversion."""
+
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from gbtalks.conversion import (
+    claim_next_job,
+    enqueue_conversion,
+    enqueue_unprocessed_talks,
+    fail_job,
+    requeue_abandoned_jobs,
+    run_worker,
+)
+from gbtalks.libgbtalks import get_path_for_file
+from gbtalks.models import ConversionJob
+
+
+class TestEnqueue:
+    def test_a_talk_is_only_queued_once(self, db):
+        first = enqueue_conversion(7)
+        second = enqueue_conversion("7")
+
+        assert first.id == second.id
+        assert ConversionJob.query.count() == 1
+
+    def test_a_finished_talk_can_be_queued_again(self, db):
+        job = enqueue_conversion(7)
+        job.state = ConversionJob.DONE
+        db.session.commit()
+
+        assert enqueue_conversion(7).id != job.id
+
+
+class TestClaim:
+    def test_takes_jobs_oldest_first(self, db):
+        enqueue_conversion(7)
+        enqueue_conversion(3)
+
+        job = claim_next_job(worker="test")
+
+        assert job.talk_id == 7
+        assert job.state == ConversionJob.RUNNING
+        assert job.attempts == 1
+        assert job.worker == "test"
+
+    def test_takes_priority_talks_then_the_shortest(self, db, make_talk):
+        make_talk(talk_id=7, is_priority=False)
+        make_talk(talk_id=8, is_priority=False)
+        make_talk(talk_id=9, is_priority=True)
+        for talk_id, duration in [(7, 3600), (8, 600), (9, 5400)]:
+            enqueue_conversion(talk_id).duration = duration
+        db.session.commit()
+
+        assert [claim_next_job().talk_id for _ in range(3)] == [9, 8, 7]
+
+    def test_a_job_is_only_claimed_once(self, db):
+        enqueue_conversion(7)
+
+        assert claim_next_job() is not None
+        assert claim_next_job() is None
+
+    def test_waits_out_the_retry_delay(self, db):
+        job = enqueue_conversion(7)
+        job.not_before = datetime.now() + timedelta(minutes=5)
+        db.session.commit()
+
+        assert claim_next_job() is None
+
+
+class TestFailure:
+    def test_a_failed_job_is_retried_later(self, db):
+        enqueue_conversion(7)
+        job = claim_next_job()
+
+        fail_job(job, RuntimeError("ffmpeg exited 1"))
+
+        assert job.state == ConversionJob.QUEUED
+        assert job.not_before > datetime.now()
+        assert job.error == "ffmpeg exited 1"
+
+    def test_gives_up_after_the_last_attempt(self, app, db):
+        enqueue_conversion(7)
+        job = claim_next_job()
+        job.attempts = app.config["CONVERSION_MAX_ATTEMPTS"]
+
+        fail_job(job, RuntimeError("ffmpeg exited 1"))
+
+        assert job.state == ConversionJob.FAILED
+
+    def test_interrupted_jobs_are_requeued(self, db):
+        enqueue_conversion(7)
+        claim_next_job()
+
+        assert requeue_abandoned_jobs() == 1
+        assert claim_next_job().talk_id == 7
+
+
+@pytest.fixture
+def edited_file(app_ctx, make_talk):
+    """Talk 7, with an edited file on disk but nothing processed."""
+    make_talk(talk_id=7)
+
+    edited_path = get_path_for_file(7, "edited")
+    with open(edited_path, "wb") as edited:
+        edited.write(b"edited audio")
+
+    yield edited_path
+
+    os.remove(edited_path)
+
+
+class TestScan:
+    def test_queues_edited_talks_with_no_processed_file(self, db, edited_file):
+        assert enqueue_unprocessed_talks() == [7]
+
+    def test_leaves_talks_that_ran_out_of_attempts(self, db, edited_file):
+        job = enqueue_conversion(7)
+        job.state = ConversionJob.FAILED
+        db.session.commit()
+
+        assert enqueue_unprocessed_talks() == []
+
+
+class TestRunWorker:
+    def test_runs_each_job_and_marks_it_done(self, db):
+        enqueue_conversion(7)
+        enqueue_conversion(8)
+        converted = []
+
+        run_worker(converted.append, once=True)
+
+        assert converted == [7, 8]
+        assert {job.state for job in ConversionJob.query} == {ConversionJob.DONE}
+
+    def test_records_a_failure_and_carries_on(self, db):
+        enqueue_conversion(7)
+        enqueue_conversion(8)
+        converted = []
+
+        def process_talk(talk_id):
+            if talk_id == 7:
+                raise RuntimeError("no edited file")
+            converted.append(talk_id)
+
+        run_worker(process_talk, once=True)
+
+        failed = ConversionJob.query.filter_by(talk_id=7).one()
+        assert converted == [8]
+        assert failed.state == ConversionJob.QUEUED
+        assert failed.error == "no edited file"
+
+
+def test_uploading_an_edited_file_queues_it(auth_client, make_talk):
+    make_talk(talk_id=7)
+
+    response = auth_client.post(
+        "/uploadtalk_ajax",
+        data={
+            "talk_id": "7",
+            "file_type": "edited",
+            "file": (io.BytesIO(b"\xff\xfb\x90\x00" * 64), "edit.mp3"),
+        },
+        content_type="multipart/form-data",
+    )
+
+    assert response.get_json()["success"] is True
+    assert ConversionJob.query.filter_by(talk_id=7).count() == 1
+
+    os.remove(get_path_for_file(7, "edited"))
@@ -0,0 +1,99 @@
+"""Tests for publishing processed MP3s in gbtalks.distribution."""
+
+import errno
+import os
+
+import pytest
+from mutagen.id3 import ID3, TIT2
+
+from gbtalks import distribution
+from gbtalks.distribution import (
+    DESTINATIONS,
+    destination_path,
+    place_file,
+    publish_processed_talks,
+    publish_talk,
+)
+from gbtalks.libgbtalks import get_path_for_file
+from gbtalks.models import PublishedFile
+
+
+@pytest.fixture
+def processed_mp3(app_ctx):
+    """A processed MP3 for talk 7, with nothing published yet."""
+    path = get_path_for_file(7, "processed", "My Talk", "Sam Speaker")
+    with open(path, "wb") as mp3:
+        mp3.write(b"\xff\xfb\x90\x00" * 64)
+
+    yield path
+
+    for leftover in [path] + [destination_path(7, destination) for destination in DESTINATIONS]:
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+@pytest.fixture
+def across_devices(monkeypatch):
+    """Make hard links and reflinks fail, as they do between filesystems."""
+
+    def cross_device(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(distribution.os, "link", cross_device)
+    monkeypatch.setattr(distribution, "_reflink", cross_device)
+
+
+class TestPlaceFile:
+    def test_hard_links_on_the_same_filesystem(self, tmp_path):
+        source = tmp_path / "talk.mp3"
+        source.write_bytes(b"audio")
+
+        assert place_file(str(source), str(tmp_path / "copy.mp3")) == "hardlink"
+        assert os.path.samefile(source, tmp_path / "copy.mp3")
+
+    def test_copies_across_filesystems(self, tmp_path, across_devices):
+        source = tmp_path / "talk.mp3"
+        source.write_bytes(b"audio")
+
+        assert place_file(str(source), str(tmp_path / "copy.mp3")) == "copy"
+        assert (tmp_path / "copy.mp3").read_bytes() == b"audio"
+        assert not os.path.samefile(source, tmp_path / "copy.mp3")
+
+
+class TestPublishTalk:
+    def test_links_into_the_web_and_usb_gold_directories(self, db, processed_mp3):
+        assert publish_talk(7, processed_mp3) == {"web": "hardlink", "usb_gold": "hardlink"}
+
+        assert os.path.samefile(processed_mp3, get_path_for_file(7, "web_mp3"))
+        assert PublishedFile.query.count() == 2
+
+    def test_republishing_a_retagged_talk_touches_nothing(self, db, processed_mp3):
+        publish_talk(7, processed_mp3)
+
+        tags = ID3()
+        tags.add(TIT2(encoding=3, text="New Title"))
+        tags.save(processed_mp3)
+
+        assert publish_talk(7, processed_mp3) == {}
+        assert ID3(destination_path(7, "usb_gold"))["TIT2"].text == ["New Title"]
+
+    def test_a_stale_copy_is_copied_again(self, db, processed_mp3, across_devices):
+        publish_talk(7, processed_mp3)
+
+        with open(processed_mp3, "ab") as mp3:
+            mp3.write(b"\x00" * 16)
+
+        assert publish_talk(7, processed_mp3) == {"web": "copy", "usb_gold": "copy"}
+        with open(processed_mp3, "rb") as mp3, open(get_path_for_file(7, "web_mp3"), "rb") as web:
+            assert web.read() == mp3.read()
+
+    def test_a_missing_copy_is_replaced(self, db, processed_mp3):
+        publish_talk(7, processed_mp3)
+        os.remove(destination_path(7, "usb_gold"))
+
+        assert publish_talk(7, processed_mp3) == {"usb_gold": "hardlink"}
+
+
+def test_publishes_every_processed_talk(db, processed_mp3):
+    assert publish_processed_talks() == {7: {"web": "hardlink", "usb_gold": "hardlink"}}
+    assert publish_processed_talks() == {}
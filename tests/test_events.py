@@ -0,0 +1,119 @@
+"""Tests for the progress event bus and its SSE stream in gbtalks.events."""
+
+import json
+import os
+
+import pytest
+
+from gbtalks import events
+from gbtalks.events import EventBus, capped_event_stream, event_stream, poll_events, publish
+from gbtalks.uploads import chunked_upload_path
+
+
+def parse(stream):
+    """The (id, type, data) of each event in some SSE text"""
+    parsed = []
+    for message in "".join(stream).split("\n\n"):
+        fields = dict(
+            line.split(": ", 1) for line in message.splitlines() if not line.startswith(":")
+        )
+        if "event" in fields:
+            parsed.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return parsed
+
+
+class TestEventBus:
+    def test_returns_events_after_an_id(self):
+        bus = EventBus()
+        first = bus.publish("upload", status="uploading")
+        bus.publish("upload", status="success")
+
+        assert bus.events_after(first) == [(first + 1, "upload", {"status": "success"})]
+
+    def test_waits_no_longer_than_the_timeout(self):
+        bus = EventBus()
+
+        assert bus.events_after(bus.last_id, timeout=0.01) == []
+
+    def test_keeps_only_recent_events(self):
+        bus = EventBus(history=2)
+        for n in range(5):
+            bus.publish("chunk", chunks_received=n)
+
+        assert [data["chunks_received"] for _, _, data in bus.events_after(0)] == [3, 4]
+
+
+class TestEventStream:
+    def test_replays_events_after_the_last_event_id(self):
+        last_seen = publish("video", talk_id=7, status="processing")
+        publish("video", talk_id=7, status="success")
+
+        streamed = parse(event_stream(last_seen, lifetime=0.05, heartbeat=0.01))
+
+        assert streamed == [(last_seen + 1, "video", {"talk_id": 7, "status": "success"})]
+
+    def test_sends_keepalives_while_idle(self):
+        stream = list(event_stream(lifetime=0.05, heartbeat=0.01))
+
+        assert ": keepalive\n\n" in stream
+
+
+class TestStreamLimit:
+    def test_polls_past_the_limit(self, short_streams):
+        first = capped_event_stream(None, max_streams=1)
+        assert next(first) == "retry: 2000\n\n"
+
+        assert next(capped_event_stream(None, max_streams=1)) == "retry: 10000\n\n"
+
+        first.close()
+        assert next(capped_event_stream(None, max_streams=1)) == "retry: 2000\n\n"
+
+    def test_a_poll_sends_what_is_waiting_and_where_to_carry_on(self):
+        last_seen = publish("video", talk_id=7, status="processing")
+        latest = publish("video", talk_id=7, status="success")
+
+        polled = list(poll_events(last_seen))
+
+        assert parse(polled) == [(latest, "video", {"talk_id": 7, "status": "success"})]
+        assert polled[-1] == f"id: {latest}\n\n"
+
+
+@pytest.fixture
+def short_streams(monkeypatch):
+    monkeypatch.setattr(events, "STREAM_LIFETIME", 0.05)
+    monkeypatch.setattr(events, "HEARTBEAT_INTERVAL", 0.01)
+
+
+def test_events_endpoint_streams_chunk_progress(auth_client, make_talk, short_streams):
+    make_talk(talk_id=7)
+    last_seen = events.bus.last_id
+
+    session_id = auth_client.post(
+        "/init_chunked_upload",
+        data={
+            "talk_id": "7",
+            "file_type": "raw",
+            "file_name": "recording.mp3",
+            "file_size": "100",
+            "total_chunks": "2",
+            "chunk_size": "50",
+        },
+    ).get_json()["upload_session_id"]
+    auth_client.post(
+        f"/upload_chunk?upload_session_id={session_id}&chunk_number=1",
+        data=b"\x00" * 50,
+        content_type="application/octet-stream",
+    )
+
+    response = auth_client.get("/events", headers={"Last-Event-ID": str(last_seen)})
+    os.remove(chunked_upload_path(session_id))
+
+    assert response.mimetype == "text/event-stream"
+    [(_, event_type, data)] = parse([response.get_data(as_text=True)])
+    assert event_type == "chunk"
+    assert data == {
+        "session_id": session_id,
+        "talk_id": 7,
+        "chunks_received": 1,
+        "total_chunks": 2,
+    }
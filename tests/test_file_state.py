@@ -0,0 +1,148 @@
+"""Tests for the per-talk file state cache in gbtalks.file_state."""
+
+import os
+
+import pytest
+
+from gbtalks import events, file_state
+from gbtalks.file_state import FileStateCache
+
+# 2001, well before any scan, so the directories count as settled
+LONG_AGO_NS = 1_000_000_000_000_000_000
+
+
+@pytest.fixture
+def dirs(app_ctx, tmp_path, monkeypatch):
+    """Empty upload, processed and image directories"""
+    paths = {}
+    for key in ("UPLOAD_DIR", "PROCESSED_DIR", "IMG_DIR"):
+        paths[key] = tmp_path / key.lower()
+        paths[key].mkdir()
+        monkeypatch.setitem(app_ctx.config, key, str(paths[key]))
+    return paths
+
+
+def settle(directory):
+    os.utime(directory, ns=(LONG_AGO_NS, LONG_AGO_NS))
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Count the directories scanned"""
+    scanned = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scanned.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(file_state.os, "scandir", counting_scandir)
+    return scanned
+
+
+def test_finds_each_kind_of_file(dirs):
+    (dirs["UPLOAD_DIR"] / "gb26-007_RAW.mp3").touch()
+    (dirs["UPLOAD_DIR"] / "gb26-007_VIDEO.mp4").touch()
+    (dirs["UPLOAD_DIR"] / "gb26-008_EDITED.mp3").touch()
+    (dirs["UPLOAD_DIR"] / "gb25-009_RAW.mp3").touch()  # last year's
+    (dirs["UPLOAD_DIR"] / "notes.txt").touch()
+    (dirs["PROCESSED_DIR"] / "GB26_008_A Talk_Sam Speaker.mp3").touch()
+    (dirs["IMG_DIR"] / "gb26-7recorder_notes.jpg").touch()
+
+    assert FileStateCache().talk_files() == {
+        7: {"raw", "video", "notes"},
+        8: {"edited", "processed"},
+    }
+
+
+def test_only_rescans_directories_that_changed(dirs, scans):
+    (dirs["UPLOAD_DIR"] / "gb26-007_RAW.mp3").touch()
+    for directory in dirs.values():
+        settle(directory)
+
+    cache = FileStateCache()
+    cache.talk_files()
+    assert len(scans) == 3
+
+    cache.talk_files()
+    assert len(scans) == 3
+
+    (dirs["UPLOAD_DIR"] / "gb26-008_RAW.mp3").touch()
+    assert set(cache.talk_files()) == {7, 8}
+    assert scans[3:] == [os.path.realpath(dirs["UPLOAD_DIR"])]
+
+
+def test_rescans_a_directory_changed_just_before_it_was_scanned(dirs, scans):
+    cache = FileStateCache()
+    cache.talk_files()
+    cache.talk_files()
+
+    # Changes within the same clock tick wouldn't show in the mtime
+    assert scans.count(os.path.realpath(dirs["UPLOAD_DIR"])) == 2
+
+
+def test_notes_uploaded_files_straight_away(dirs, monkeypatch):
+    published = []
+    monkeypatch.setattr(file_state, "publish", lambda event_type, **data: published.append(data))
+    cache = FileStateCache()
+
+    cache.note_file(str(dirs["UPLOAD_DIR"] / "gb26-007_RAW.mp3"))
+
+    [event] = published
+    assert (event["talk_id"], event["files"]) == (7, ["raw"])
+    assert event["version"].endswith("-1")
+
+
+def test_reports_only_talks_changed_since_a_version(dirs):
+    (dirs["UPLOAD_DIR"] / "gb26-007_RAW.mp3").touch()
+    cache = FileStateCache()
+    version, talks = cache.changes_since()
+    assert talks == {7: ["raw"]}
+
+    (dirs["UPLOAD_DIR"] / "gb26-008_RAW.mp3").touch()
+    (dirs["UPLOAD_DIR"] / "gb26-007_RAW.mp3").unlink()
+
+    version, talks = cache.changes_since(version)
+    assert talks == {7: [], 8: ["raw"]}
+    assert cache.changes_since(version) == (version, {})
+
+
+def test_a_version_from_before_a_restart_gets_everything(dirs):
+    (dirs["UPLOAD_DIR"] / "gb26-007_RAW.mp3").touch()
+    version, _ = FileStateCache().changes_since()
+
+    # The new process has counted past the old version by the time it's asked
+    after_restart = FileStateCache()
+    after_restart.refresh()
+    (dirs["UPLOAD_DIR"] / "gb26-008_RAW.mp3").touch()
+
+    assert after_restart.changes_since(version)[1] == {7: ["raw"], 8: ["raw"]}
+
+
+@pytest.mark.parametrize("version", ["100", "abc", "-1", ""])
+def test_a_version_it_cant_read_gets_everything(dirs, version):
+    (dirs["UPLOAD_DIR"] / "gb26-007_RAW.mp3").touch()
+
+    assert FileStateCache().changes_since(version)[1] == {7: ["raw"]}
+
+
+def test_file_state_endpoint(auth_client, dirs):
+    version = auth_client.get("/file_state").get_json()["version"]
+    (dirs["UPLOAD_DIR"] / "gb26-007_EDITED.mp3").touch()
+
+    response = auth_client.get(f"/file_state?since={version}").get_json()
+
+    assert response["talks"] == {"7": ["edited"]}
+    assert response["version"] != version
+
+
+def test_publishes_changes_as_events(dirs):
+    last_id = events.bus.last_id
+    (dirs["IMG_DIR"] / "gb26-7recorder_notes.jpg").touch()
+
+    cache = FileStateCache()
+    cache.refresh()
+
+    assert ("files", {"talk_id": 7, "files": ["notes"], "version": cache.changes_since()[0]}) in [
+        event[1:] for event in events.bus.events_after(last_id)
+    ]
@@ -0,0 +1,171 @@
+"""Tests for the background media job queue in gbtalks.media_jobs."""
+
+import os
+import subprocess
+
+import pytest
+
+from gbtalks import media_jobs
+from gbtalks.libgbtalks import (
+    extract_audio_from_video_async,
+    get_path_for_file,
+    get_video_processing_status,
+)
+from gbtalks.media_jobs import (
+    EXTRACT_AUDIO,
+    FINISH_UPLOAD,
+    claim_next_media_job,
+    queue_position,
+    requeue_interrupted_media_jobs,
+    run_pending_media_jobs,
+    submit,
+)
+from gbtalks.models import MediaJob
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    """Replace the job handlers with ones that record their calls"""
+    calls = []
+
+    def handler(kind):
+        return lambda **arguments: calls.append((kind, arguments))
+
+    monkeypatch.setattr(
+        media_jobs,
+        "_handlers",
+        lambda: {FINISH_UPLOAD: handler(FINISH_UPLOAD), EXTRACT_AUDIO: handler(EXTRACT_AUDIO)},
+    )
+    return calls
+
+
+class TestQueue:
+    def test_finishing_uploads_goes_before_extraction(self, db):
+        submit(EXTRACT_AUDIO, 1, video_path="a.mp4")
+        finish = submit(FINISH_UPLOAD, 2, upload_session_id="abc")
+
+        assert claim_next_media_job().id == finish.id
+
+    def test_oldest_first_within_a_kind(self, db):
+        first = submit(EXTRACT_AUDIO, 1)
+        submit(EXTRACT_AUDIO, 2)
+
+        assert claim_next_media_job().id == first.id
+
+    def test_limits_how_many_extractions_run_at_once(self, app, db, monkeypatch):
+        monkeypatch.setitem(app.config, "MEDIA_EXTRACT_CONCURRENCY", 1)
+        submit(EXTRACT_AUDIO, 1)
+        submit(EXTRACT_AUDIO, 2)
+
+        assert claim_next_media_job().talk_id == 1
+        assert claim_next_media_job() is None
+
+        # Other kinds of job aren't held up behind it
+        submit(FINISH_UPLOAD, 3, upload_session_id="abc")
+        assert claim_next_media_job().kind == FINISH_UPLOAD
+
+    def test_queue_position(self, db):
+        extract = submit(EXTRACT_AUDIO, 1)
+        assert queue_position(extract) == 1
+
+        submit(FINISH_UPLOAD, 2, upload_session_id="abc")
+        assert queue_position(extract) == 2
+
+        claim_next_media_job()
+        assert queue_position(extract) == 1
+
+        claim_next_media_job()
+        assert queue_position(extract) is None
+
+    def test_requeues_jobs_interrupted_by_a_restart(self, db):
+        job = submit(EXTRACT_AUDIO, 1)
+        claim_next_media_job()
+
+        assert requeue_interrupted_media_jobs() == 1
+
+        db.session.refresh(job)
+        assert job.state == MediaJob.QUEUED
+        assert job.started_at is None
+
+
+class TestRunning:
+    def test_runs_jobs_with_their_arguments(self, db, handled):
+        job = submit(FINISH_UPLOAD, 7, upload_session_id="abc")
+
+        assert run_pending_media_jobs() == 1
+        assert handled == [(FINISH_UPLOAD, {"talk_id": 7, "upload_session_id": "abc"})]
+
+        db.session.refresh(job)
+        assert job.state == MediaJob.DONE
+        assert job.finished_at is not None
+
+    def test_records_failures(self, db, monkeypatch):
+        def fail(**arguments):
+            raise RuntimeError("disk full")
+
+        monkeypatch.setattr(media_jobs, "_handlers", lambda: {EXTRACT_AUDIO: fail})
+        job = submit(EXTRACT_AUDIO, 7)
+        following = submit(EXTRACT_AUDIO, 8)
+
+        assert run_pending_media_jobs() == 2
+
+        db.session.refresh(job)
+        db.session.refresh(following)
+        assert (job.state, job.error) == (MediaJob.FAILED, "disk full")
+        assert following.state == MediaJob.FAILED
+
+    def test_not_started_without_workers(self, app):
+        media_jobs.start_media_jobs(app)
+
+        assert not media_jobs._started
+
+
+class TestVideoExtraction:
+    def test_queues_extraction(self, app, db, tmp_path):
+        audio = str(tmp_path / "gb26-007_RAW.mp3")
+
+        assert extract_audio_from_video_async(str(tmp_path / "video.mp4"), audio, 7)[0]
+
+        assert get_video_processing_status(audio)[0] == "queued"
+        assert MediaJob.query.filter_by(kind=EXTRACT_AUDIO, talk_id=7).count() == 1
+
+    def test_reports_extraction_failures(self, app, db, tmp_path):
+        audio = str(tmp_path / "gb26-007_RAW.mp3")
+        extract_audio_from_video_async(str(tmp_path / "missing.mp4"), audio, 7)
+
+        run_pending_media_jobs()
+
+        assert get_video_processing_status(audio)[0] == "error"
+        assert MediaJob.query.one().state == MediaJob.FAILED
+
+    def test_records_how_the_audio_was_extracted(self, app, db, tmp_path, monkeypatch):
+        def fake_run(command, **kwargs):
+            if command[0].endswith("ffprobe"):
+                return subprocess.CompletedProcess(command, 0, '{"streams": [{"codec_name": "mp3"}]}', "")
+            with open(command[-1], "wb") as output:
+                output.write(b"\xff\xfb")
+            return subprocess.CompletedProcess(command, 0, "", "")
+
+        monkeypatch.setattr(subprocess, "run", fake_run)
+        audio = str(tmp_path / "gb26-007_RAW.mp3")
+        extract_audio_from_video_async(str(tmp_path / "video.mp4"), audio, 7)
+
+        run_pending_media_jobs()
+
+        job = MediaJob.query.one()
+        assert job.state == MediaJob.DONE
+        assert job.outcome["method"] == "copy"
+        assert job.outcome["codec"] == "mp3"
+        assert job.outcome["seconds"] >= 0
+        assert get_video_processing_status(audio)[0] == "completed"
+
+    def test_status_includes_queue_position(self, auth_client, make_talk):
+        talk = make_talk(talk_id=7)
+        audio = get_path_for_file(7, "raw", talk.title, talk.speaker)
+        submit(EXTRACT_AUDIO, 6)
+        extract_audio_from_video_async("video.mp4", audio, 7)
+
+        status = auth_client.get("/check_video_status?talk_id=7").get_json()
+        os.remove(audio + ".status")
+
+        assert (status["status"], status["position"]) == ("queued", 2)
@@ -0,0 +1,115 @@
+"""Tests for the upload and media timings in gbtalks.metrics, and /metrics."""
+
+import io
+
+import pytest
+
+from gbtalks import metrics
+from gbtalks.metrics import Counter, Histogram
+from gbtalks.uploads import write_chunk
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """A registry of its own, so the test's metrics aren't served by /metrics"""
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    return metrics.REGISTRY
+
+
+@pytest.fixture
+def reset_metrics():
+    for metric in metrics.REGISTRY:
+        metric.reset()
+
+
+class TestCounter:
+    def test_renders_each_set_of_labels(self, registry):
+        counter = Counter("bytes_total", "Bytes", ("method",))
+        counter.inc(10, method="chunked")
+        counter.inc(5, method="chunked")
+        counter.inc(1, method="streamed")
+
+        assert metrics.render().splitlines() == [
+            "# HELP bytes_total Bytes",
+            "# TYPE bytes_total counter",
+            'bytes_total{method="chunked"} 15',
+            'bytes_total{method="streamed"} 1',
+        ]
+
+    def test_rejects_the_wrong_labels(self, registry):
+        counter = Counter("bytes_total", "Bytes", ("method",))
+
+        with pytest.raises(ValueError):
+            counter.inc(kind="chunked")
+
+
+class TestHistogram:
+    def test_renders_cumulative_buckets(self, registry):
+        histogram = Histogram("wait_seconds", "Wait", buckets=(1, 10))
+        for value in (0.5, 2, 3, 20):
+            histogram.observe(value)
+
+        assert metrics.render().splitlines()[2:] == [
+            'wait_seconds_bucket{le="1"} 1',
+            'wait_seconds_bucket{le="10"} 3',
+            'wait_seconds_bucket{le="+Inf"} 4',
+            "wait_seconds_sum 25.5",
+            "wait_seconds_count 4",
+        ]
+
+    def test_escapes_label_values(self, registry):
+        histogram = Histogram("run_seconds", "Run", ("kind",), buckets=(1,))
+        histogram.observe(0.5, kind='a "quoted" kind')
+
+        assert 'run_seconds_count{kind="a \\"quoted\\" kind"} 1' in metrics.render()
+
+    def test_summarises_recent_observations(self, registry):
+        histogram = Histogram("write_seconds", "Write")
+        for value in range(1, 101):
+            histogram.observe(value / 1000)
+
+        (row,) = metrics.summary()["timings"]
+
+        assert row["count"] == 100
+        assert (row["median"], row["p95"], row["max"]) == ("51 ms", "95 ms", "100 ms")
+
+    def test_times_a_block(self, registry):
+        histogram = Histogram("block_seconds", "Block")
+        with histogram.time():
+            pass
+
+        assert histogram.summary()[0]["count"] == 1
+
+
+def test_chunk_writes_are_timed(app_ctx, tmp_path, reset_metrics):
+    path = tmp_path / "upload.partial"
+    path.write_bytes(b"\0" * 8)
+
+    write_chunk(str(path), 0, io.BytesIO(b"abcd"), 4)
+
+    assert metrics.UPLOAD_BYTES.value(method="chunked") == 4
+    assert metrics.CHUNK_RECEIVE_SECONDS.summary()[0]["count"] == 1
+    assert metrics.CHUNK_WRITE_SECONDS.summary()[0]["count"] == 1
+
+
+class TestEndpoint:
+    def test_requires_a_team_leader(self, client):
+        assert client.get("/metrics").status_code in (302, 401)
+
+    def test_serves_prometheus_text(self, auth_client):
+        response = auth_client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.content_type.startswith("text/plain; version=0.0.4")
+        assert "# TYPE gbtalks_chunk_write_seconds histogram" in response.text
+
+    def test_accepts_the_metrics_token(self, app, client, monkeypatch):
+        monkeypatch.setitem(app.config, "METRICS_TOKEN", "s3cret")
+
+        assert client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+        assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code in (302, 401)
+
+    def test_health_shows_the_timings(self, app_ctx, auth_client, reset_metrics):
+        metrics.UPLOAD_VERIFY_SECONDS.observe(2.5)
+
+        assert "Time to hash a chunked upload and move it into place" in auth_client.get("/health").text
@@ -0,0 +1,206 @@
+"""Tests for the in-memory rota solver in gbtalks.rota.engine."""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from gbtalks.models import Talk
+from gbtalks.rota import engine
+from gbtalks.rota.engine import Rota, RotaRecorder, RotaRules, RotaTalk
+
+SATURDAY = datetime(2026, 8, 29)
+
+
+def talk(talk_id, start, minutes=60, venue="The Big Top", is_priority=True, is_rotaed=True):
+    start_time = SATURDAY + timedelta(hours=int(start[:2]), minutes=int(start[3:]))
+    return RotaTalk(
+        talk_id,
+        start_time,
+        start_time + timedelta(minutes=minutes),
+        venue=venue,
+        is_priority=is_priority,
+        is_rotaed=is_rotaed,
+    )
+
+
+@pytest.fixture
+def statements(db):
+    """The SQL statements run, and how many rows each was given"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append((statement, len(parameters) if executemany else 1))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(db.engine, "before_cursor_execute", record)
+
+
+class TestGenerate:
+    def test_keeps_a_recorder_in_the_venue_for_the_next_priority_talk(self):
+        rota = Rota(
+            [talk(1, "10:00"), talk(2, "11:30"), talk(3, "11:30", venue="Canopy")],
+            [RotaRecorder("Ann", 2), RotaRecorder("Bob", 2)],
+        )
+
+        engine.generate(rota)
+
+        assert rota.assignments() == {1: "Ann", 2: "Ann", 3: "Bob"}
+
+    def test_keeps_a_recorder_in_the_venue_however_many_talks_follow(self):
+        # max_talks_per_shift only limits what optimising and repairing add
+        rota = Rota(
+            [talk(1, "10:00", minutes=30), talk(2, "10:55", minutes=30), talk(3, "11:50", minutes=30)],
+            [RotaRecorder("Ann", 2), RotaRecorder("Bob", 2)],
+        )
+
+        engine.generate(rota)
+
+        assert rota.assignments() == {1: "Ann", 2: "Ann", 3: "Ann"}
+        assert not engine.can_fit(rota.recorder("Ann"), talk(4, "12:45", minutes=10), rota.rules)
+
+    def test_picks_up_an_unflagged_talk_after_an_additional_one(self):
+        rota = Rota(
+            [
+                talk(1, "10:00", is_priority=False),
+                talk(2, "11:30", venue="Canopy", is_priority=False, is_rotaed=False),
+                talk(3, "12:30", is_priority=False, is_rotaed=False),
+            ],
+            [RotaRecorder("Ann", 2)],
+        )
+
+        engine.generate(rota)
+
+        # 11:30 is between 20 minutes and an hour after 10:00-11:00 ends; 12:30 isn't
+        assert rota.assignments() == {1: "Ann", 2: "Ann", 3: None}
+
+    def test_leaves_talks_already_assigned(self):
+        ann, bob = RotaRecorder("Ann", 2), RotaRecorder("Bob", 2)
+        first = talk(1, "10:00")
+        rota = Rota([first, talk(2, "16:00")], [ann, bob])
+        rota.assign(bob, first)
+
+        assert engine.generate(rota) == {2: "Ann"}
+
+    def test_follows_the_rules_given(self):
+        rota = Rota(
+            [talk(1, "10:00"), talk(2, "12:30", venue="Canopy")],
+            [RotaRecorder("Ann", 2)],
+            RotaRules(break_between_shifts=1),
+        )
+
+        engine.generate(rota)
+
+        assert rota.assignments() == {1: "Ann", 2: "Ann"}
+
+    def test_leaves_out_cancelled_talks_and_recorders_who_dropped_out(self):
+        cancelled = talk(2, "11:30")
+        cancelled.is_cancelled = True
+        rota = Rota(
+            [talk(1, "10:00"), cancelled, talk(3, "10:00", venue="Canopy")],
+            [RotaRecorder("Ann", 2, has_dropped_out=True), RotaRecorder("Bob", 2)],
+        )
+
+        engine.generate(rota)
+
+        assert rota.assignments() == {1: "Bob", 2: None, 3: None}
+        assert engine.coverage(rota)["priority"] == (1, 2)
+
+    def test_ties_go_to_the_recorder_whose_first_talk_is_earliest(self):
+        late, early = RotaRecorder("Late", 2), RotaRecorder("Early", 2)
+        rota = Rota([talk(1, "14:00"), talk(2, "09:00"), talk(3, "19:00")], [late, early])
+        rota.assign(late, rota.talks[1])
+        rota.assign(early, rota.talks[2])
+
+        assert engine.find_recorder(rota, rota.talks[3]) is early
+
+
+class TestAssign:
+    def test_moves_the_talk_between_recorders(self):
+        ann, bob = RotaRecorder("Ann"), RotaRecorder("Bob")
+        first, second = talk(1, "14:00"), talk(2, "10:00")
+        rota = Rota([first, second], [ann, bob])
+
+        rota.assign(ann, first)
+        rota.assign(ann, second)
+        rota.assign(bob, first)
+
+        assert ann.talks == [second]
+        assert bob.talks == [first]
+        assert rota.changes() == {1: "Bob", 2: "Ann"}
+
+
+class TestDatabase:
+    def test_loads_and_saves_only_what_changed(self, db, make_recorder, make_talk):
+        make_recorder(name="Ann")
+        make_talk(talk_id=1, start="09:00", end="10:00", recorder_name="Ann")
+        make_talk(talk_id=2, start="14:00", end="15:00", is_priority=True, is_rotaed=True)
+
+        rota = engine.load_rota()
+        assert rota.recorder("Ann").talks == [rota.talks[1]]
+
+        engine.generate(rota)
+
+        assert engine.save_rota(rota) == {2: "Ann"}
+        assert db.session.get(Talk, 2).recorder_name == "Ann"
+        assert rota.changes() == {}
+
+    def test_saves_in_one_statement(self, db, make_recorder, make_talk, statements):
+        make_recorder(name="Ann")
+        for talk_id, start in enumerate(("09:00", "14:00", "19:00"), start=1):
+            make_talk(talk_id=talk_id, start=start, end=start[:2] + ":45")
+
+        rota = engine.load_rota()
+        for rota_talk in rota.talks.values():
+            rota.assign(rota.recorder("Ann"), rota_talk)
+        statements.clear()
+
+        engine.save_rota(rota)
+
+        updates = [rows for statement, rows in statements if statement.startswith("UPDATE")]
+        assert updates == [3]
+
+    def test_generating_the_rota_does_not_query_per_talk(
+        self, auth_client, db, make_recorder, make_talk, statements
+    ):
+        for i in range(10):
+            make_recorder(name=f"Recorder {i}")
+        for i in range(40):
+            make_talk(
+                talk_id=i + 1,
+                start=f"{9 + i % 12:02d}:00",
+                end=f"{9 + i % 12:02d}:45",
+                venue=f"Venue {i % 4}",
+                is_priority=i % 2 == 0,
+                is_rotaed=True,
+            )
+        statements.clear()
+
+        auth_client.post("/rota")
+
+        assert sum(statement.startswith("SELECT") for statement, _ in statements) < 10
+        assert sum(statement.startswith("UPDATE") for statement, _ in statements) == 1
+
+
+def test_solves_a_festival_quickly():
+    days = [SATURDAY + timedelta(days=day) for day in range(4)]
+    talks = [
+        RotaTalk(
+            i,
+            days[i % 4] + timedelta(hours=9 + i // 4 % 12, minutes=15 * (i % 3)),
+            days[i % 4] + timedelta(hours=10 + i // 4 % 12),
+            venue=f"Venue {i % 10}",
+            is_priority=i % 3 == 0,
+            is_rotaed=True,
+        )
+        for i in range(400)
+    ]
+    rota = Rota(talks, [RotaRecorder(f"Recorder {i}", 1 + i % 3) for i in range(40)])
+
+    started = time.perf_counter()
+    engine.generate(rota)
+
+    assert time.perf_counter() - started < 2
+    assert any(rota.assignments().values())
@@ -40,6 +40,14 @@ class TestRotaGeneration:
         assert "Assigned 0/" not in body, body[body.find("Assigned") - 60 :][:200]
 
 
+class TestViewingTheRota:
+    def test_changes_nothing(self, client, db, make_talk, make_recorder):
+        _build_festival(make_talk, make_recorder)
+
+        assert client.get("/rota").status_code == 200
+        assert Talk.query.filter(Talk.recorder_name.isnot(None)).count() == 0
+
+
 class TestRotaFromSampleData:
     """The shipped sample data must produce a usable rota.
 
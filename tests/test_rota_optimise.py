@@ -0,0 +1,147 @@
+"""Tests for improving on the greedy rota in gbtalks.rota.optimise."""
+
+from datetime import datetime, time, timedelta
+
+from gbtalks.models import Talk
+from gbtalks.rota import engine
+from gbtalks.rota.engine import Rota, RotaRecorder, RotaTalk
+from gbtalks.rota.optimise import optimise, score
+
+SATURDAY = datetime(2026, 8, 29)
+
+
+def talk(talk_id, start, is_priority=True):
+    start_time = SATURDAY + timedelta(hours=int(start[:2]), minutes=int(start[3:]))
+    return RotaTalk(
+        talk_id, start_time, start_time + timedelta(hours=1), is_priority=is_priority, is_rotaed=True
+    )
+
+
+def shifts(talks, rules):
+    """A recorder's talks split into shifts wherever there's a break between
+    them, in start order"""
+    split = []
+    for rota_talk in sorted(talks, key=lambda rota_talk: rota_talk.start_time):
+        if split and rota_talk.start_time < split[-1][-1].end_time + timedelta(hours=rules.break_between_shifts):
+            split[-1].append(rota_talk)
+        else:
+            split.append([rota_talk])
+    return split
+
+
+def greedy_misses_a_priority_talk():
+    """Ann gets the 09:00 talk, as she's listed first, but only she can do 09:30"""
+    return Rota(
+        [talk(1, "09:00"), talk(2, "09:30")],
+        [RotaRecorder("Ann", 2), RotaRecorder("Bob", 2, latest_end_time=time(10, 0))],
+    )
+
+
+def test_moves_a_talk_to_make_room_for_a_priority_one():
+    rota = greedy_misses_a_priority_talk()
+    engine.generate(rota)
+    assert rota.assignments() == {1: "Ann", 2: None}
+
+    assert optimise(rota, seconds=5) > 0
+
+    assert rota.assignments() == {1: "Bob", 2: "Ann"}
+
+
+def test_gives_up_an_additional_talk_for_a_priority_one():
+    rota = Rota(
+        [talk(1, "09:00", is_priority=False), talk(2, "09:30")],
+        [RotaRecorder("Ann", 2)],
+    )
+    rota.assign(rota.recorder("Ann"), rota.talks[1])
+
+    optimise(rota, seconds=5)
+
+    assert rota.assignments() == {1: None, 2: "Ann"}
+
+
+def test_shares_talks_out():
+    ann, bob = RotaRecorder("Ann", 2), RotaRecorder("Bob", 2)
+    rota = Rota([talk(1, "09:00"), talk(2, "15:00")], [ann, bob])
+    rota.assign(ann, rota.talks[1])
+    rota.assign(ann, rota.talks[2])
+
+    optimise(rota, seconds=5)
+
+    assert (len(ann.talks), len(bob.talks)) == (1, 1)
+
+
+def test_stops_when_out_of_time():
+    rota = greedy_misses_a_priority_talk()
+    engine.generate(rota)
+
+    assert optimise(rota, seconds=0) == 0
+    assert rota.talks[2].recorder is None
+
+
+def test_never_makes_the_rota_worse_or_breaks_the_rules():
+    days = [SATURDAY + timedelta(days=day) for day in range(4)]
+    talks = [
+        RotaTalk(
+            i,
+            days[i % 4] + timedelta(hours=9 + i * 7 % 12, minutes=15 * (i % 4)),
+            days[i % 4] + timedelta(hours=10 + i * 7 % 12, minutes=15 * (i % 3)),
+            venue=f"Venue {i % 6}",
+            is_priority=i % 3 == 0,
+            is_rotaed=True,
+        )
+        for i in range(200)
+    ]
+    rota = Rota(talks, [RotaRecorder(f"Recorder {i}", 1 + i % 3) for i in range(12)])
+    engine.generate(rota)
+    before = score(rota)
+
+    optimise(rota, seconds=5)
+
+    assert score(rota)[:2] >= before[:2]
+    for recorder in rota.recorders:
+        for shift in shifts(recorder.talks, rota.rules):
+            assert len(shift) <= rota.rules.max_talks_per_shift, (recorder.name, shift)
+        for rota_talk in list(recorder.talks):
+            rota.unassign(rota_talk)
+            assert engine.can_fit(recorder, rota_talk, rota.rules), (recorder, rota_talk)
+            rota.assign(recorder, rota_talk)
+
+
+def test_never_puts_more_talks_in_a_shift_than_allowed():
+    starts = [SATURDAY + timedelta(hours=10, minutes=61 * i) for i in range(3)]
+    rota = Rota(
+        [
+            RotaTalk(i + 1, start, start + timedelta(minutes=40), is_priority=True, is_rotaed=True)
+            for i, start in enumerate(starts)
+        ],
+        [RotaRecorder("Ann", 2)],
+    )
+    engine.generate(rota)
+
+    optimise(rota, seconds=5)
+
+    assert len(rota.recorder("Ann").talks) == rota.rules.max_talks_per_shift
+
+
+class TestGeneratingAnOptimisedRota:
+    def make_festival(self, make_recorder, make_talk):
+        make_recorder(name="Ann")
+        make_recorder(name="Bob", latest_end_time=time(10, 0))
+        make_talk(talk_id=1, start="09:00", end="10:00", is_priority=True, is_rotaed=True)
+        make_talk(talk_id=2, start="09:30", end="10:30", is_priority=True, is_rotaed=True)
+
+    def test_from_the_rota_page(self, auth_client, db, make_recorder, make_talk):
+        self.make_festival(make_recorder, make_talk)
+
+        body = auth_client.post("/rota", data={"mode": "optimise"}, follow_redirects=True).text
+
+        assert "recording +1 priority" in body
+        assert db.session.get(Talk, 2).recorder_name == "Ann"
+
+    def test_from_the_command_line(self, app, db, make_recorder, make_talk):
+        self.make_festival(make_recorder, make_talk)
+
+        result = app.test_cli_runner().invoke(args=["generate-rota", "--optimise", "--seconds", "5"])
+
+        assert "Assigned 2/2 priority talks" in result.output
+        assert db.session.get(Talk, 1).recorder_name == "Bob"
@@ -0,0 +1,192 @@
+"""Tests for mending the rota after a change, in gbtalks.rota.repair."""
+
+import time
+from datetime import datetime, timedelta
+from datetime import time as clock_time
+
+from gbtalks.models import Recorder, Talk
+from gbtalks.rota import engine
+from gbtalks.rota.engine import Rota, RotaRecorder, RotaTalk
+from gbtalks.rota.repair import describe, repair
+
+SATURDAY = datetime(2026, 8, 29)
+
+
+def talk(talk_id, start, is_priority=True, minutes=60, **kwargs):
+    start_time = SATURDAY + timedelta(hours=int(start[:2]), minutes=int(start[3:]))
+    return RotaTalk(
+        talk_id,
+        start_time,
+        start_time + timedelta(minutes=minutes),
+        is_priority=is_priority,
+        is_rotaed=True,
+        **kwargs,
+    )
+
+
+def rota_of(assignments, talks, recorders):
+    """A rota as if loaded with {talk id: recorder name} already assigned"""
+    rota = Rota(talks, recorders)
+    for talk_id, name in assignments.items():
+        rota.assign(rota.recorder(name), rota.talks[talk_id])
+    rota.loaded = rota.assignments()
+    return rota
+
+
+def test_releases_a_cancelled_talk_and_nothing_else():
+    rota = rota_of(
+        {1: "Ann", 2: "Bob"},
+        [talk(1, "10:00", is_cancelled=True), talk(2, "10:00")],
+        [RotaRecorder("Ann", 2), RotaRecorder("Bob", 2)],
+    )
+
+    assert repair(rota, talk_ids=[1]) == {1: ("Ann", None)}
+
+
+def test_a_moved_talk_stays_with_its_recorder_if_it_still_fits():
+    # Loaded after the talk moved to 14:30
+    rota = rota_of({1: "Ann"}, [talk(1, "14:30")], [RotaRecorder("Bob", 2), RotaRecorder("Ann", 2)])
+
+    assert repair(rota, talk_ids=[1]) == {}
+    assert rota.talks[1].recorder_name == "Ann"
+
+
+def test_a_recorder_who_drops_out_has_their_talks_shared_out():
+    rota = rota_of(
+        {1: "Ann", 2: "Ann", 3: "Bob"},
+        [talk(1, "10:00"), talk(2, "15:00"), talk(3, "10:00")],
+        [RotaRecorder("Ann", 2), RotaRecorder("Bob", 2), RotaRecorder("Cat", 2)],
+    )
+
+    changes = repair(rota, dropped_out=["Ann"])
+
+    assert changes == {1: ("Ann", "Cat"), 2: ("Ann", "Bob")}
+    assert rota.talks[3].recorder_name == "Bob"
+
+
+def test_a_recorder_whose_times_changed_keeps_the_talks_that_still_fit():
+    ann = RotaRecorder("Ann", 2)
+    rota = rota_of({1: "Ann", 2: "Ann"}, [talk(1, "10:00"), talk(2, "15:00")], [ann, RotaRecorder("Bob", 2)])
+    ann.latest_end_time = clock_time(12, 0)
+
+    assert repair(rota, recorder_names=["Ann"]) == {2: ("Ann", "Bob")}
+
+
+def test_never_fills_a_shift_past_max_talks_per_shift():
+    ann, bob = RotaRecorder("Ann", 2), RotaRecorder("Bob", 2)
+    rota = rota_of(
+        {1: "Bob", 2: "Bob", 3: "Ann"},
+        [talk(1, "10:00", minutes=40), talk(2, "11:01", minutes=40), talk(3, "12:02", minutes=40)],
+        [ann, bob],
+    )
+    ann.latest_end_time = clock_time(12, 0)
+
+    # Bob's shift already has max_talks_per_shift talks
+    assert repair(rota, recorder_names=["Ann"]) == {3: ("Ann", None)}
+    assert len(bob.talks) == rota.rules.max_talks_per_shift
+
+
+def test_refits_a_day_that_no_longer_splits_into_shifts():
+    # Ann's shifts are 1 and 2, then 3 and 4. Without talk 1 her first shift
+    # starts later and takes in talk 3, leaving talk 4 too soon after it.
+    rota = rota_of(
+        {1: "Ann", 2: "Ann", 3: "Ann", 4: "Ann"},
+        [
+            talk(1, "09:00", is_cancelled=True),
+            talk(2, "10:30", minutes=30),
+            talk(3, "13:00", minutes=30),
+            talk(4, "14:00", minutes=30),
+        ],
+        [RotaRecorder("Ann", 2), RotaRecorder("Bob", 2)],
+    )
+
+    assert repair(rota, talk_ids=[1]) == {1: ("Ann", None), 4: ("Ann", "Bob")}
+    assert not engine.breaks_shift_pattern(rota.recorder("Ann"), SATURDAY.date(), rota.rules)
+
+
+def test_finds_new_recorders_for_talks_whose_recorder_was_deleted():
+    rota = Rota([talk(1, "10:00")], [RotaRecorder("Bob", 2)])
+    rota.loaded = {1: "Ann"}
+
+    assert repair(rota) == {1: ("Ann", "Bob")}
+
+
+def test_gives_nothing_to_a_recorder_who_dropped_out_earlier():
+    rota = rota_of(
+        {1: "Bob"},
+        [talk(1, "10:00", is_cancelled=True), talk(2, "10:00")],
+        [RotaRecorder("Ann", 2, has_dropped_out=True), RotaRecorder("Bob", 2)],
+    )
+
+    assert repair(rota, talk_ids=[1, 2]) == {1: ("Bob", None), 2: (None, "Bob")}
+
+
+def test_leaves_a_talk_nobody_can_take_unassigned():
+    rota = rota_of({1: "Ann"}, [talk(1, "10:00")], [RotaRecorder("Ann", 2)])
+
+    assert repair(rota, dropped_out=["Ann"]) == {1: ("Ann", None)}
+    assert describe({1: ("Ann", None)}) == ["Talk 1: Ann → nobody"]
+
+
+def test_repairs_a_festival_in_milliseconds():
+    talks = [
+        RotaTalk(
+            i,
+            SATURDAY + timedelta(days=i % 4, hours=9 + i // 4 % 12),
+            SATURDAY + timedelta(days=i % 4, hours=10 + i // 4 % 12),
+            is_priority=i % 3 == 0,
+            is_rotaed=True,
+        )
+        for i in range(400)
+    ]
+    rota = Rota(talks, [RotaRecorder(f"Recorder {i}", 2) for i in range(40)])
+    engine.generate(rota)
+    rota.loaded = rota.assignments()
+
+    started = time.perf_counter()
+    changes = repair(rota, dropped_out=["Recorder 0"])
+
+    assert time.perf_counter() - started < 0.1
+    assert {old for old, new in changes.values()} <= {"Recorder 0"}
+
+
+class TestRepairRotaRoute:
+    def test_takes_a_cancelled_talk_off_the_rota(self, auth_client, db, make_recorder, make_talk):
+        make_recorder(name="Ann")
+        make_talk(talk_id=1, recorder_name="Ann", is_cancelled=True)
+        make_talk(talk_id=2, start="15:00", end="16:00", recorder_name="Ann")
+
+        body = auth_client.post("/repair_rota", data={"talk_id": "1"}, follow_redirects=True).text
+
+        assert "Talk 1: Ann → nobody" in body
+        assert db.session.get(Talk, 1).recorder_name is None
+        assert db.session.get(Talk, 2).recorder_name == "Ann"
+
+    def test_shares_out_the_talks_of_a_recorder_who_dropped_out(
+        self, auth_client, db, make_recorder, make_talk
+    ):
+        make_recorder(name="Ann")
+        make_recorder(name="Bob")
+        make_talk(talk_id=1, recorder_name="Ann", is_rotaed=True, is_priority=True)
+
+        response = auth_client.post("/repair_rota", data={"dropped_out": "Ann", "next": "recorders"})
+
+        assert response.location.endswith("/recorders")
+        assert db.session.get(Talk, 1).recorder_name == "Bob"
+        assert db.session.get(Recorder, "Ann") is not None
+
+    def test_a_recorder_who_dropped_out_stays_off_the_rota(self, auth_client, db, make_recorder, make_talk):
+        make_recorder(name="Ann")
+        make_talk(talk_id=1, recorder_name="Ann", is_rotaed=True, is_priority=True)
+        auth_client.post("/repair_rota", data={"dropped_out": "Ann"})
+
+        auth_client.get("/rota")
+        assert db.session.get(Talk, 1).recorder_name is None
+
+        auth_client.post("/rota", data={"mode": "optimise"})
+        assert db.session.get(Talk, 1).recorder_name is None
+
+        auth_client.post("/repair_rota", data={"returned": "Ann", "next": "recorders"})
+        auth_client.post("/rota")
+        assert db.session.get(Talk, 1).recorder_name == "Ann"
+        assert db.session.get(Recorder, "Ann").has_dropped_out is False
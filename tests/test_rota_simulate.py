@@ -0,0 +1,121 @@
+"""Tests for trying out rota settings, in gbtalks.rota.simulate."""
+
+import json
+
+import pytest
+
+from gbtalks.models import Talk
+from gbtalks.rota import simulate as simulate_module
+from gbtalks.rota.simulate import MAX_SCENARIOS, ScenarioError, simulate
+
+
+@pytest.fixture
+def festival(db, make_recorder, make_talk):
+    """Ann records talk 1; talk 2 starts too soon after it for the default
+    20 minutes between talks"""
+    make_recorder(name="Ann")
+    make_talk(talk_id=1, start="10:00", end="11:00", is_priority=True, is_rotaed=True, recorder_name="Ann")
+    make_talk(talk_id=2, start="11:10", end="12:10", is_priority=True, is_rotaed=True)
+
+
+def test_reports_coverage_load_and_changes_without_saving(festival, db):
+    [current, shorter_gap] = simulate([
+        {"name": "current"},
+        {"name": "shorter gap", "settings": {"minimum_time_between_talks": "5"}},
+    ])
+
+    assert current["coverage"]["priority"] == {"assigned": 1, "total": 2}
+    assert current["changes"] == {}
+
+    assert shorter_gap["settings"]["minimum_time_between_talks"] == 5
+    assert shorter_gap["coverage"]["priority"] == {"assigned": 2, "total": 2}
+    assert shorter_gap["load"] == {"Ann": {"talks": 2, "per_day": {"2026-08-29": 2}}}
+    assert shorter_gap["changes"] == {2: {"live": None, "simulated": "Ann"}}
+
+    assert db.session.get(Talk, 2).recorder_name is None
+
+
+def test_runs_scenarios_in_worker_processes(festival):
+    scenarios = [{"settings": {"minimum_time_between_talks": minutes}} for minutes in (5, 20, 5)]
+
+    results = simulate(scenarios, workers=3)
+
+    assert [result["name"] for result in results] == [
+        "minimum_time_between_talks=5",
+        "minimum_time_between_talks=20",
+        "minimum_time_between_talks=5",
+    ]
+    assert [result["coverage"]["priority"]["assigned"] for result in results] == [2, 1, 2]
+
+
+@pytest.mark.parametrize(
+    "scenarios, error",
+    [
+        ([{"settings": {"shift_length": "long"}}], "Invalid value for shift_length"),
+        ([{"settings": {"max_shifts_per_day_limit": 4}}], "cannot exceed 3"),
+        ([{"settings": {"coffee_breaks": 1}}], "Unknown rota setting"),
+        ([{"optimise": "soon"}], "optimise must be"),
+        ([{}] * (MAX_SCENARIOS + 1), f"At most {MAX_SCENARIOS}"),
+        ([], "list of scenarios"),
+    ],
+)
+def test_rejects_scenarios_it_cant_run(db, scenarios, error):
+    with pytest.raises(ScenarioError, match=error):
+        simulate(scenarios)
+
+
+class TestSimulateRotaRoute:
+    def test_needs_a_team_leader(self, client, festival):
+        response = client.post("/rota/simulate", json={"scenarios": [{}]})
+
+        assert response.status_code in (302, 401)
+
+    def test_returns_each_scenario(self, auth_client, festival):
+        response = auth_client.post("/rota/simulate", json={
+            "scenarios": [{"settings": {"minimum_time_between_talks": 5}, "optimise": True}],
+        })
+
+        assert response.json["success"] is True
+        assert response.json["scenarios"][0]["coverage"]["priority"]["assigned"] == 2
+        assert response.json["scenarios"][0]["changes"] == {"2": {"live": None, "simulated": "Ann"}}
+
+    def test_runs_scenarios_in_the_request_thread(self, app, auth_client, festival, monkeypatch):
+        monkeypatch.setitem(app.config, "ROTA_SIMULATION_WORKERS", "2")
+
+        def no_pool(*args, **kwargs):
+            raise AssertionError("the web server started worker processes")
+
+        monkeypatch.setattr(simulate_module, "ProcessPoolExecutor", no_pool)
+
+        response = auth_client.post("/rota/simulate", json={"scenarios": [{}, {"name": "again"}]})
+
+        assert [result["name"] for result in response.json["scenarios"]] == ["current settings", "again"]
+
+    def test_explains_a_bad_scenario(self, auth_client, festival):
+        response = auth_client.post("/rota/simulate", json={"scenarios": [{"settings": {"nap_length": 1}}]})
+
+        assert response.json == {"success": False, "error": "Unknown rota setting: nap_length"}
+
+
+class TestSimulateRotaCommand:
+    def test_compares_scenarios_with_the_current_settings(self, app, festival, db):
+        result = app.test_cli_runner().invoke(
+            args=["simulate-rota", "-s", "minimum_time_between_talks=5", "--workers", "1"]
+        )
+
+        assert result.exit_code == 0, result.output
+        assert "current settings: 1/2 priority" in result.output
+        assert "minimum_time_between_talks=5: 2/2 priority" in result.output
+        assert "1 talk(s) differ from the live rota" in result.output
+        assert db.session.get(Talk, 2).recorder_name is None
+
+    def test_prints_json(self, app, festival):
+        result = app.test_cli_runner().invoke(args=["simulate-rota", "--json", "--workers", "1"])
+
+        assert json.loads(result.output)[0]["name"] == "current settings"
+
+    def test_rejects_a_malformed_scenario(self, app, festival):
+        result = app.test_cli_runner().invoke(args=["simulate-rota", "-s", "shift_length"])
+
+        assert result.exit_code != 0
+        assert "setting=value" in result.output
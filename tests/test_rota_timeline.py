@@ -0,0 +1,66 @@
+"""Tests for the sorted per-recorder talk index in gbtalks.rota.timeline."""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from gbtalks.rota.timeline import Timeline
+
+SATURDAY = datetime(2026, 8, 29)
+
+
+def talk(start, minutes=60, day=SATURDAY):
+    start_time = day + timedelta(hours=int(start[:2]), minutes=int(start[3:]))
+    return SimpleNamespace(start_time=start_time, end_time=start_time + timedelta(minutes=minutes))
+
+
+@pytest.fixture
+def timeline():
+    # A long morning workshop, and two talks in the afternoon
+    return Timeline([talk("15:00"), talk("09:00", minutes=240), talk("17:00")])
+
+
+def test_keeps_talks_in_start_order(timeline):
+    late = talk("20:00")
+    timeline.add(late)
+    timeline.add(talk("12:00"))
+    timeline.remove(late)
+
+    assert [t.start_time.hour for t in timeline] == [9, 12, 15, 17]
+
+
+def test_removing_a_talk_it_does_not_hold_fails(timeline):
+    with pytest.raises(ValueError):
+        timeline.remove(talk("15:00"))
+
+
+def test_finds_talks_still_running_from_long_before(timeline):
+    found = timeline.overlapping(SATURDAY.replace(hour=12), SATURDAY.replace(hour=16))
+
+    assert [t.start_time.hour for t in found] == [9, 15]
+
+
+def test_talks_back_to_back_do_not_overlap(timeline):
+    assert timeline.overlapping(SATURDAY.replace(hour=16), SATURDAY.replace(hour=17)) == []
+
+
+def test_clashes_count_the_gap_after_each_talk(timeline):
+    candidate = talk("16:10", minutes=30)
+
+    assert timeline.clashes(candidate) == []
+    assert timeline.clashes(candidate, timedelta(minutes=20)) == [timeline.talks[1]]
+
+
+def test_counts_and_groups_talks_by_day(timeline):
+    timeline.add(talk("10:00", day=SATURDAY + timedelta(days=1)))
+
+    assert timeline.count_on(SATURDAY.date()) == 3
+    assert len(timeline.on_day(SATURDAY.date())) == 3
+    assert timeline.count_on((SATURDAY + timedelta(days=1)).date()) == 1
+
+
+def test_finds_talks_starting_between_two_times(timeline):
+    found = timeline.starting_between(SATURDAY.replace(hour=9), SATURDAY.replace(hour=17))
+
+    assert [t.start_time.hour for t in found] == [15]
@@ -4,8 +4,11 @@ These are deliberately broad rather than deep: the point is a safety net that
 notices if a refactor breaks a page, not exhaustive behavioural coverage.
 """
 
+import os
+
 import pytest
 
+from gbtalks.libgbtalks import find_processed_files, get_path_for_file
 from gbtalks.models import Talk
 
 # Routes that render a page and need no query parameters.
@@ -156,6 +159,38 @@ class TestEditTalkPage:
         assert response.status_code == 200
         assert "Talk 99999 not found" in response.get_data(as_text=True)
 
+    def test_renaming_a_processed_talk_renames_its_mp3(self, app, auth_client, make_talk):
+        make_talk(talk_id=1, title="Old Title", speaker="Sam Speaker")
+        with app.app_context():
+            with open(os.path.join(app.config["IMG_DIR"], "alltalksicon.png"), "wb") as icon:
+                icon.write(b"\x89PNG\r\n\x1a\n")
+            with open(get_path_for_file(1, "processed", "Old Title", "Sam Speaker"), "wb") as mp3:
+                mp3.write(b"\xff\xfb\x90\x00" * 64)
+
+        auth_client.post(
+            "/edit_talk",
+            data={
+                "talk_id": "1",
+                "title": "New Title",
+                "speaker": "Sam Speaker",
+                "description": "A description",
+                "day": "Saturday",
+                "start_time": "10:00",
+                "end_time": "11:00",
+            },
+        )
+
+        with app.app_context():
+            processed = find_processed_files(1)
+            try:
+                assert processed == [
+                    get_path_for_file(1, "processed", "New Title", "Sam Speaker")
+                ]
+            finally:
+                for path in processed + [get_path_for_file(1, "web_mp3")]:
+                    if os.path.exists(path):
+                        os.remove(path)
+
 
 class TestTalksPage:
     def test_lists_talks_in_start_time_order(self, auth_client, make_talk):
@@ -248,3 +283,42 @@ class TestAssignRecorder:
         )
 
         assert db.session.get(Talk, 1).recorder_name == "Robin Recorder"
+
+    def test_refuses_a_recorder_already_recording_then(
+        self, auth_client, db, make_talk, make_recorder
+    ):
+        make_recorder(name="Robin Recorder")
+        make_talk(talk_id=1, start="10:00", end="11:00", recorder_name="Robin Recorder")
+        make_talk(talk_id=2, start="10:30", end="11:30")
+
+        auth_client.post(
+            "/assign_recorder",
+            data={"talk_id": "2", "recorder_name": "Robin Recorder"},
+        )
+
+        assert db.session.get(Talk, 2).recorder_name is None
+
+
+class TestSwapRecorderAssignments:
+    def test_swaps_the_recorders(self, auth_client, db, make_talk, make_recorder):
+        make_recorder(name="Ann")
+        make_recorder(name="Bob")
+        make_talk(talk_id=1, start="10:00", end="11:00", recorder_name="Ann")
+        make_talk(talk_id=2, start="14:00", end="15:00", recorder_name="Bob")
+
+        auth_client.post("/swap_recorder_assignments", data={"talk1": "1", "talk2": "2"})
+
+        assert db.session.get(Talk, 1).recorder_name == "Bob"
+        assert db.session.get(Talk, 2).recorder_name == "Ann"
+
+    def test_refuses_a_swap_that_would_clash(self, auth_client, db, make_talk, make_recorder):
+        make_recorder(name="Ann")
+        make_recorder(name="Bob")
+        make_talk(talk_id=1, start="10:00", end="11:00", recorder_name="Ann")
+        make_talk(talk_id=2, start="14:00", end="15:00", recorder_name="Bob")
+        make_talk(talk_id=3, start="14:30", end="15:30", recorder_name="Ann")
+
+        auth_client.post("/swap_recorder_assignments", data={"talk1": "1", "talk2": "2"})
+
+        assert db.session.get(Talk, 1).recorder_name == "Ann"
+        assert db.session.get(Talk, 2).recorder_name == "Bob"
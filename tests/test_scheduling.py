@@ -0,0 +1,107 @@
+"""Tests for sizing and ordering conversions in gbtalks.scheduling."""
+
+import os
+import signal
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from gbtalks import scheduling
+from gbtalks.scheduling import (
+    MB,
+    estimate_job_memory,
+    order_for_conversion,
+    run_scheduled,
+    worker_count,
+)
+
+
+def _slow_for_talk_one(talk_id):
+    time.sleep(0.3 if talk_id == 1 else 0)
+    return talk_id
+
+
+def _killed_on_talk_two(talk_id):
+    # As the kernel's OOM killer would
+    if talk_id == 2:
+        os.kill(os.getpid(), signal.SIGKILL)
+    return talk_id
+
+
+class TestWorkerCount:
+    def test_an_override_wins(self, app_ctx):
+        assert worker_count(override=3) == 3
+
+    def test_config_overrides_the_hardware(self, app_ctx, monkeypatch):
+        monkeypatch.setitem(app_ctx.config, "CONVERSION_WORKERS", "2")
+        assert worker_count() == 2
+
+    def test_keeps_a_core_for_the_web_app(self, app_ctx, monkeypatch):
+        monkeypatch.setattr(scheduling, "available_cpus", lambda: 8)
+        assert worker_count() == 7
+
+    def test_is_limited_by_memory(self, app_ctx, monkeypatch):
+        monkeypatch.setattr(scheduling, "available_cpus", lambda: 8)
+        assert worker_count(budget=2 * estimate_job_memory(None)) == 2
+
+    def test_always_at_least_one(self, app_ctx, monkeypatch):
+        monkeypatch.setattr(scheduling, "available_cpus", lambda: 8)
+        assert worker_count(budget=10 * MB) == 1
+
+
+def test_longer_talks_are_expected_to_need_more_memory():
+    assert estimate_job_memory(7200) > estimate_job_memory(600)
+
+
+def test_priority_talks_first_then_shortest(app_ctx, make_talk, monkeypatch):
+    durations = {1: 3600, 2: 600, 3: 1800, 4: None}
+    monkeypatch.setattr(
+        scheduling,
+        "talk_duration",
+        lambda path: durations[int(os.path.basename(path)[5:8])],
+    )
+    make_talk(talk_id=1, is_priority=True)
+    make_talk(talk_id=2, is_priority=False)
+    make_talk(talk_id=3, is_priority=False)
+    make_talk(talk_id=4, is_priority=False)
+
+    jobs = order_for_conversion(["004", "003", "002", "001"])
+
+    assert [talk_id for talk_id, _ in jobs] == [1, 2, 3, 4]
+
+
+class TestRunScheduled:
+    JOBS = [(1, 600), (2, 600)]
+
+    def test_runs_jobs_side_by_side(self, app_ctx):
+        finished = [talk_id for talk_id, _, _ in run_scheduled(_slow_for_talk_one, self.JOBS, 2)]
+        assert finished == [2, 1]
+
+    def test_holds_jobs_back_that_would_not_fit_in_memory(self, app_ctx):
+        budget = estimate_job_memory(600) + MB
+        finished = [
+            talk_id for talk_id, _, _ in run_scheduled(_slow_for_talk_one, self.JOBS, 2, budget)
+        ]
+        assert finished == [1, 2]
+
+    def test_reports_failures(self, app_ctx):
+        results = list(run_scheduled(int, [("x", 600)], 1))
+
+        talk_id, result, error = results[0]
+        assert talk_id == "x"
+        assert result is None
+        with pytest.raises(ValueError):
+            raise error
+
+    def test_reports_every_unfinished_talk_when_a_worker_is_killed(self, app_ctx):
+        jobs = [(1, 600), (2, 600), (3, 600), (4, 600)]
+
+        results = list(run_scheduled(_killed_on_talk_two, jobs, 1))
+
+        assert [talk_id for talk_id, _, _ in results] == [1, 2, 3, 4]
+        assert results[0] == (1, 1, None)
+        for _, result, error in results[1:]:
+            assert result is None
+            assert isinstance(error, BrokenProcessPool)
+            assert "out of memory" in str(error)
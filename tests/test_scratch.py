@@ -0,0 +1,90 @@
+"""Tests for the conversion scratch space in gbtalks.scratch."""
+
+import json
+import os
+import socket
+
+import pytest
+
+from gbtalks.scratch import (
+    MB,
+    ScratchSpaceError,
+    move_into_place,
+    scratch_job,
+    sweep_scratch,
+)
+
+
+@pytest.fixture
+def scratch_dir(app_ctx, tmp_path, monkeypatch):
+    path = tmp_path / "scratch"
+    monkeypatch.setitem(app_ctx.config, "SCRATCH_DIR", str(path))
+    monkeypatch.setitem(app_ctx.config, "SCRATCH_HEADROOM_MB", 0)
+    monkeypatch.setitem(app_ctx.config, "SCRATCH_QUOTA_MB", "10")
+    monkeypatch.setitem(app_ctx.config, "SCRATCH_WAIT_TIMEOUT", 0)
+    return path
+
+
+def make_job_dir(scratch_dir, name, pid, reserved):
+    job_dir = scratch_dir / name
+    job_dir.mkdir(parents=True)
+    (job_dir / ".reservation").write_text(
+        json.dumps({"host": socket.gethostname(), "pid": pid, "bytes": reserved})
+    )
+    return job_dir
+
+
+class TestScratchJob:
+    def test_the_directory_is_removed_afterwards(self, scratch_dir):
+        with scratch_job(7, MB) as job_dir:
+            with open(os.path.join(job_dir, "talk.mp3"), "wb") as mp3:
+                mp3.write(b"audio")
+
+        assert not os.path.exists(job_dir)
+
+    def test_the_directory_is_removed_when_the_job_fails(self, scratch_dir):
+        with pytest.raises(RuntimeError), scratch_job(7, MB) as job_dir:
+            raise RuntimeError("ffmpeg exited 1")
+
+        assert not os.path.exists(job_dir)
+
+    def test_a_job_bigger_than_the_quota_fails_straight_away(self, scratch_dir):
+        with pytest.raises(ScratchSpaceError), scratch_job(7, 20 * MB):
+            pass
+
+    def test_waits_for_space_held_by_running_jobs(self, scratch_dir):
+        make_job_dir(scratch_dir, "talk003-1", os.getpid(), 8 * MB)
+
+        with pytest.raises(ScratchSpaceError, match="Timed out"), scratch_job(7, 4 * MB):
+            pass
+
+    def test_space_held_by_dead_workers_is_reclaimed(self, scratch_dir):
+        orphan = make_job_dir(scratch_dir, "talk003-999999999", 999999999, 8 * MB)
+
+        with scratch_job(7, 4 * MB):
+            assert not orphan.exists()
+
+
+def test_sweep_leaves_running_jobs_alone(scratch_dir):
+    live = make_job_dir(scratch_dir, "talk003-1", os.getpid(), MB)
+    make_job_dir(scratch_dir, "talk004-999999999", 999999999, MB)
+
+    assert sweep_scratch() == ["talk004-999999999"]
+    assert live.exists()
+
+
+def test_move_into_place_replaces_an_existing_directory(tmp_path):
+    new = tmp_path / "scratch" / "cd"
+    new.mkdir(parents=True)
+    (new / "00.wav").write_bytes(b"new")
+
+    old = tmp_path / "cds" / "gb26-007"
+    old.mkdir(parents=True)
+    (old / "00.wav").write_bytes(b"old")
+    (old / "01.wav").write_bytes(b"old")
+
+    move_into_place(str(new), str(old) + "/")
+
+    assert sorted(os.listdir(old)) == ["00.wav"]
+    assert (old / "00.wav").read_bytes() == b"new"
+    assert not new.exists()
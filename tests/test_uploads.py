@@ -0,0 +1,390 @@
+"""Tests for the upload index in gbtalks.uploads, and the duplicate check that uses it."""
+
+import hashlib
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from gbtalks.libgbtalks import get_path_for_file
+from gbtalks.media_jobs import run_pending_media_jobs
+from gbtalks.models import MediaJob, UploadedFile, UploadSession
+from gbtalks.uploads import (
+    StreamedUpload,
+    allocate_upload,
+    chunked_upload_path,
+    expire_upload_sessions,
+    find_duplicate,
+    index_existing_uploads,
+    open_upload_session,
+    record_upload,
+    upload_status_path,
+    write_chunk,
+)
+
+AUDIO = b"\xff\xfb\x90\x00" * 64
+
+
+@pytest.fixture
+def uploaded_files(app, app_ctx):
+    """Removes any files a test uploads for talks 7 and 8, and unfinished uploads."""
+    yield
+    for talk_id in (7, 8):
+        for file_type in ("raw", "edited"):
+            path = get_path_for_file(talk_id, file_type)
+            if os.path.exists(path):
+                os.remove(path)
+
+    incoming_dir = app.config["UPLOAD_INCOMING_DIR"]
+    if os.path.isdir(incoming_dir):
+        for name in os.listdir(incoming_dir):
+            os.remove(os.path.join(incoming_dir, name))
+
+
+def upload(client, talk_id, contents, file_type="raw", query=""):
+    return client.post(
+        "/uploadtalk_ajax" + query,
+        data={
+            "talk_id": str(talk_id),
+            "file_type": file_type,
+            "file": (io.BytesIO(contents), "recording.mp3"),
+        },
+        content_type="multipart/form-data",
+    ).get_json()
+
+
+class TestStreamedUpload:
+    def test_hashes_what_it_writes(self, tmp_path):
+        upload = StreamedUpload(tmp_path)
+        upload.write(AUDIO[:100])
+        upload.write(AUDIO[100:])
+
+        assert upload.size == len(AUDIO)
+        assert upload.sha256 == hashlib.sha256(AUDIO).hexdigest()
+
+        upload.move_to(tmp_path / "gb26-007_RAW.mp3")
+        upload.close()
+
+        assert os.listdir(tmp_path) == ["gb26-007_RAW.mp3"]
+        assert (tmp_path / "gb26-007_RAW.mp3").read_bytes() == AUDIO
+
+    def test_is_removed_if_never_moved(self, tmp_path):
+        upload = StreamedUpload(tmp_path)
+        upload.write(AUDIO)
+        upload.close()
+
+        assert os.listdir(tmp_path) == []
+
+
+class TestFindDuplicate:
+    def test_finds_a_file_with_the_same_contents(self, db, tmp_path):
+        path = tmp_path / "gb26-007_RAW.mp3"
+        path.write_bytes(AUDIO)
+        record_upload(7, "raw", str(path), len(AUDIO), "abc")
+
+        assert find_duplicate("abc").talk_id == 7
+
+    def test_forgets_a_file_replaced_by_one_of_the_same_size(self, db, tmp_path):
+        path = tmp_path / "gb26-007_RAW.mp3"
+        path.write_bytes(AUDIO)
+        record_upload(7, "raw", str(path), len(AUDIO), hashlib.sha256(AUDIO).hexdigest())
+
+        path.write_bytes(bytes(reversed(AUDIO)))
+        os.utime(path, (0, 0))
+
+        assert find_duplicate(hashlib.sha256(AUDIO).hexdigest()) is None
+        assert UploadedFile.query.count() == 0
+
+    def test_still_finds_a_file_touched_since(self, db, tmp_path):
+        path = tmp_path / "gb26-007_RAW.mp3"
+        path.write_bytes(AUDIO)
+        record_upload(7, "raw", str(path), len(AUDIO), hashlib.sha256(AUDIO).hexdigest())
+
+        os.utime(path, (0, 0))
+
+        assert find_duplicate(hashlib.sha256(AUDIO).hexdigest()).mtime == 0
+
+    def test_forgets_files_that_have_gone(self, db, tmp_path):
+        record_upload(7, "raw", str(tmp_path / "deleted.mp3"), len(AUDIO), "abc")
+
+        assert find_duplicate("abc") is None
+        assert UploadedFile.query.count() == 0
+
+
+def test_indexes_files_uploaded_before_the_index(db, uploaded_files):
+    with open(get_path_for_file(7, "edited"), "wb") as edited:
+        edited.write(AUDIO)
+
+    assert index_existing_uploads() == 1
+
+    indexed = find_duplicate(hashlib.sha256(AUDIO).hexdigest())
+    assert (indexed.talk_id, indexed.file_type) == (7, "edited")
+
+
+class TestUploadRoutes:
+    def test_uploads_are_indexed(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+
+        assert upload(auth_client, 7, AUDIO)["success"] is True
+
+        indexed = UploadedFile.query.one()
+        assert indexed.path == get_path_for_file(7, "raw")
+        assert indexed.sha256 == hashlib.sha256(AUDIO).hexdigest()
+
+    def test_rejects_a_recording_already_uploaded_for_another_talk(
+        self, auth_client, make_talk, uploaded_files
+    ):
+        make_talk(talk_id=7)
+        make_talk(talk_id=8)
+        upload(auth_client, 7, AUDIO)
+
+        result = upload(auth_client, 8, AUDIO)
+
+        assert result["success"] is False
+        assert "Talk 7" in result["error"]
+        assert not os.path.exists(get_path_for_file(8, "raw"))
+
+    def test_accepts_a_different_recording_of_the_same_size(
+        self, auth_client, make_talk, uploaded_files
+    ):
+        make_talk(talk_id=7)
+        make_talk(talk_id=8)
+        upload(auth_client, 7, AUDIO)
+
+        assert upload(auth_client, 8, AUDIO[::-1])["success"] is True
+
+    def test_writes_straight_to_the_upload_dir(self, app, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+
+        assert upload(auth_client, 7, AUDIO)["success"] is True
+
+        with open(get_path_for_file(7, "raw"), "rb") as uploaded:
+            assert uploaded.read() == AUDIO
+        assert os.listdir(app.config["UPLOAD_INCOMING_DIR"]) == []
+        assert os.stat(app.config["UPLOAD_INCOMING_DIR"]).st_dev == os.stat(
+            app.config["UPLOAD_DIR"]
+        ).st_dev
+
+    def test_a_rejected_upload_is_not_left_behind(self, app, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+
+        assert upload(auth_client, 8, AUDIO)["success"] is False
+        assert os.listdir(app.config["UPLOAD_INCOMING_DIR"]) == []
+
+    def test_reports_progress_to_the_upload_session(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+
+        upload(auth_client, 7, AUDIO, query="?upload_session_id=test-session")
+
+        with open(upload_status_path("test-session")) as status:
+            assert status.read().startswith("success:")
+
+        progress = auth_client.get("/upload_progress?session_id=test-session").get_json()
+        assert progress["status"] == "completed"
+        assert not os.path.exists(upload_status_path("test-session"))
+
+
+def test_chunks_are_written_in_place_in_any_order(tmp_path):
+    path = tmp_path / "upload.partial"
+    allocate_upload(path, len(AUDIO))
+
+    for offset in (200, 0, 100):
+        chunk = AUDIO[offset : offset + 100]
+        assert write_chunk(path, offset, io.BytesIO(chunk), len(chunk)) == len(chunk)
+
+    assert path.read_bytes() == AUDIO
+
+
+class TestChunkedUpload:
+    def init(self, client, talk_id, contents, chunk_size, fingerprint=None):
+        data = {
+            "talk_id": str(talk_id),
+            "file_type": "raw",
+            "file_name": "recording.mp3",
+            "file_size": str(len(contents)),
+            "total_chunks": str(-(-len(contents) // chunk_size)),
+            "chunk_size": str(chunk_size),
+        }
+        if fingerprint:
+            data["fingerprint"] = fingerprint
+
+        return client.post("/init_chunked_upload", data=data).get_json()
+
+    def start(self, client, talk_id, contents, chunk_size, fingerprint=None):
+        return self.init(client, talk_id, contents, chunk_size, fingerprint)["upload_session_id"]
+
+    def send_chunk(self, client, session_id, chunk_number, chunk):
+        return client.post(
+            f"/upload_chunk?upload_session_id={session_id}&chunk_number={chunk_number}",
+            data=chunk,
+            content_type="application/octet-stream",
+        ).get_json()
+
+    def finish(self, client, session_id):
+        assert client.post(
+            "/complete_chunked_upload", data={"upload_session_id": session_id}
+        ).get_json()["success"]
+
+        # The tests run no media job workers, so finish it here
+        with client.application.app_context():
+            run_pending_media_jobs()
+
+        return client.get(f"/check_reassembly_status?session_id={session_id}").get_json()
+
+    def test_assembles_chunks_sent_out_of_order(self, app, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+        session_id = self.start(auth_client, 7, AUDIO, 100)
+
+        for chunk_number in (2, 0, 1):
+            chunk = AUDIO[chunk_number * 100 : (chunk_number + 1) * 100]
+            assert self.send_chunk(auth_client, session_id, chunk_number, chunk)["success"]
+
+        assert self.finish(auth_client, session_id)["status"] == "completed"
+
+        with open(get_path_for_file(7, "raw"), "rb") as uploaded:
+            assert uploaded.read() == AUDIO
+        assert os.listdir(app.config["UPLOAD_INCOMING_DIR"]) == []
+        assert UploadedFile.query.one().sha256 == hashlib.sha256(AUDIO).hexdigest()
+
+    def test_queues_one_job_however_often_it_is_completed(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+        session_id = self.start(auth_client, 7, AUDIO, len(AUDIO))
+        assert self.send_chunk(auth_client, session_id, 0, AUDIO)["success"]
+
+        responses = [
+            auth_client.post("/complete_chunked_upload", data={"upload_session_id": session_id}).get_json()
+            for _ in range(2)
+        ]
+
+        assert [response["success"] for response in responses] == [True, True]
+        assert responses[1]["status"] == UploadSession.STARTING
+        assert MediaJob.query.count() == 1
+
+    def test_can_be_completed_again_if_its_job_could_not_be_queued(
+        self, auth_client, make_talk, uploaded_files, monkeypatch
+    ):
+        make_talk(talk_id=7)
+        session_id = self.start(auth_client, 7, AUDIO, len(AUDIO))
+        assert self.send_chunk(auth_client, session_id, 0, AUDIO)["success"]
+
+        def fail_to_queue(*args, **kwargs):
+            raise RuntimeError("database is locked")
+
+        with monkeypatch.context() as patch:
+            patch.setattr("gbtalks.routes.submit_media_job", fail_to_queue)
+            response = auth_client.post("/complete_chunked_upload", data={"upload_session_id": session_id})
+
+        assert response.get_json()["success"] is False
+        assert UploadSession.query.one().state == UploadSession.UPLOADING
+        assert self.finish(auth_client, session_id)["status"] == "completed"
+
+    def test_rejects_a_chunk_of_the_wrong_size(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+        session_id = self.start(auth_client, 7, AUDIO, 100)
+
+        assert not self.send_chunk(auth_client, session_id, 0, AUDIO[:50])["success"]
+
+    def test_rejects_a_duplicate(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+        make_talk(talk_id=8)
+        upload(auth_client, 7, AUDIO)
+        session_id = self.start(auth_client, 8, AUDIO, len(AUDIO))
+        self.send_chunk(auth_client, session_id, 0, AUDIO)
+
+        status = self.finish(auth_client, session_id)
+
+        assert status["status"] == "error"
+        assert "Talk 7" in status["message"]
+        assert not os.path.exists(get_path_for_file(8, "raw"))
+
+    def test_a_chunk_sent_twice_is_counted_once(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+        session_id = self.start(auth_client, 7, AUDIO, 100)
+
+        self.send_chunk(auth_client, session_id, 0, AUDIO[:100])
+        result = self.send_chunk(auth_client, session_id, 0, AUDIO[:100])
+
+        assert result["chunks_received"] == 1
+        assert UploadSession.query.filter_by(id=session_id).one().chunks_received == 1
+
+    def test_sessions_in_progress_are_reported(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+        session_id = self.start(auth_client, 7, AUDIO, 100)
+        self.send_chunk(auth_client, session_id, 1, AUDIO[100:200])
+
+        ongoing = auth_client.get("/check_ongoing_uploads").get_json()["ongoing_uploads"]
+
+        assert ongoing[f"chunked_{session_id}"]["talk_id"] == 7
+        assert ongoing[f"chunked_{session_id}"]["chunks_received"] == 1
+
+    def test_starting_the_same_upload_again_resumes_it(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+        session_id = self.start(auth_client, 7, AUDIO, 100, fingerprint="recording.mp3:256:1")
+        self.send_chunk(auth_client, session_id, 2, AUDIO[200:])
+
+        resumed = self.init(auth_client, 7, AUDIO, 100, fingerprint="recording.mp3:256:1")
+
+        assert resumed["upload_session_id"] == session_id
+        assert resumed["existing_chunks"] == [2]
+
+        for chunk_number in (0, 1):
+            chunk = AUDIO[chunk_number * 100 : (chunk_number + 1) * 100]
+            self.send_chunk(auth_client, session_id, chunk_number, chunk)
+        assert self.finish(auth_client, session_id)["status"] == "completed"
+
+        with open(get_path_for_file(7, "raw"), "rb") as uploaded:
+            assert uploaded.read() == AUDIO
+
+    def test_a_different_file_gets_a_new_session(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+        first = self.start(auth_client, 7, AUDIO, 100, fingerprint="recording.mp3:256:1")
+
+        assert self.start(auth_client, 7, AUDIO, 100, fingerprint="other.mp3:256:1") != first
+
+    def test_changing_the_chunk_size_starts_again(self, auth_client, make_talk, uploaded_files):
+        make_talk(talk_id=7)
+        session_id = self.start(auth_client, 7, AUDIO, 100, fingerprint="recording.mp3:256:1")
+        self.send_chunk(auth_client, session_id, 0, AUDIO[:100])
+
+        restarted = self.init(auth_client, 7, AUDIO, 128, fingerprint="recording.mp3:256:1")
+
+        assert restarted["existing_chunks"] == []
+
+
+def test_abandoned_uploads_expire(app, db, make_talk, uploaded_files):
+    upload_session, _ = open_upload_session(
+        "abandoned",
+        talk_id=7,
+        file_type="raw",
+        file_size=len(AUDIO),
+        chunk_size=100,
+        total_chunks=3,
+    )
+    upload_session.updated_at = datetime.now() - timedelta(hours=app.config["UPLOAD_SESSION_TTL"] + 1)
+    db.session.commit()
+
+    open_upload_session(
+        "recent", talk_id=8, file_type="raw", file_size=len(AUDIO), chunk_size=100, total_chunks=3
+    )
+
+    assert expire_upload_sessions() == ["abandoned"]
+    assert not os.path.exists(chunked_upload_path("abandoned"))
+    assert [remaining.id for remaining in UploadSession.query] == ["recent"]
+
+
+def test_duplicates_left_for_checking_expire(app, db, uploaded_files):
+    incoming_dir = app.config["UPLOAD_INCOMING_DIR"]
+    os.makedirs(incoming_dir, exist_ok=True)
+    old, current = (os.path.join(incoming_dir, f".upload-{name}.partial") for name in ("old", "current"))
+    for path in (old, current):
+        with open(path, "wb") as partial:
+            partial.write(AUDIO)
+    long_ago = time.time() - (app.config["UPLOAD_SESSION_TTL"] + 1) * 3600
+    os.utime(old, (long_ago, long_ago))
+
+    expire_upload_sessions()
+
+    assert not os.path.exists(old)
+    assert os.path.exists(current)
@@ -1,3 +1,6 @@
 #!/bin/bash
 
-rsync /storage/processed/*mp3.mp3 /storage/usb_gold
+# Hard-link every processed talk into /storage/usb_gold (see gbtalks/distribution.py)
+cd /home/gbtalks/talks-processing || exit 1
+source .ve/bin/activate
+flask publish-talks